@@ -3,27 +3,71 @@ from werkzeug.security import generate_password_hash
 from model import *
 from login import login_api
 from project import project_api
+from report import report_api
+from dashboard import dashboard_api
+from sync import sync_api
+from batch import batch_api
 from task import task_api
 from user import user_api
 from work import work_api
 from datetime import date
-from flask_heroku import Heroku
+from notifications import notifier
+from metrics import metrics, metrics_api
+from profiling import profiler, profile_api
+from compression import compressor
+from payloads import payload_cache
+from routing import router
+from decorators import user_cache
+from blobstore import get_blob_store
+import migrations
 
 import os
 
 # https://www.restapitutorial.com/httpstatuscodes.html
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'thisissecret'
+# Extensiones y blueprints de la aplicacion, en el orden en que se registran
+_EXTENSIONS = (router, db, ma, notifier, metrics, profiler, compressor, payload_cache, user_cache)
+_BLUEPRINTS = (login_api, user_api, project_api, task_api, work_api, report_api, dashboard_api, sync_api,
+               batch_api, metrics_api, profile_api)
 
-if 'HEROKU' in os.environ:  # heroku config:set HEROKU=1
-    heroku = Heroku(app)
-else:  # local
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///das'  # postgresql
 
+def _default_config(app):
+    """Configuracion por defecto, en parte sacada de las variables de entorno."""
+    app.config['SECRET_KEY'] = 'thisissecret'
 
-db.init_app(app)
-ma.init_app(app)
+    if 'HEROKU' in os.environ:  # heroku config:set HEROKU=1
+        from flask_heroku import Heroku  # solo hace falta en heroku
+        Heroku(app)
+    else:  # local
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///das'  # postgresql
+
+    # Replicas de solo lectura separadas por espacios y pool de conexiones, ver routing.py
+    app.config['DATABASE_REPLICA_URIS'] = os.environ.get('DATABASE_REPLICA_URLS', '').split()
+    app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    app.config['DATABASE_MAX_OVERFLOW'] = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    app.config['DATABASE_POOL_RECYCLE'] = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    app.config['DATABASE_POOL_PRE_PING'] = os.environ.get('DATABASE_POOL_PRE_PING', '1') == '1'
+
+
+def create_app(config=None):
+    """Crea la aplicacion con la configuracion por defecto mas la de `config` (un diccionario).
+
+    No abre conexiones a la base de datos, asi que se puede crear una sola vez
+    antes del fork de los workers (gunicorn --preload) y compartir su memoria;
+    cada worker abre luego sus propias conexiones (ver routing.py).
+    """
+    app = Flask(__name__)
+    _default_config(app)
+    app.config.update(config or {})
+    for extension in _EXTENSIONS:
+        extension.init_app(app)
+    for blueprint in _BLUEPRINTS:
+        app.register_blueprint(blueprint)
+    return app
+
+
+# La aplicacion que sirve gunicorn (ver Procfile) y que usan los scripts
+app = create_app()
 
 
 def initial_setup():
@@ -34,9 +78,43 @@ def initial_setup():
     """
     with app.app_context():
         db.create_all()
+        migrations.stamp()
         _add_initial_values()
 
 
+def upgrade_schema():
+    """Aplica las migraciones pendientes a una base de datos ya creada, ver migrations.py.
+    heroku run python3
+    import api
+    api.upgrade_schema()
+    """
+    with app.app_context():
+        return migrations.upgrade()
+
+
+def migrate_project_images(batch_size=100):
+    """Mueve las imagenes guardadas en la tabla project al almacen de blobs.
+    heroku run python3
+    import api
+    api.migrate_project_images()
+    """
+    upgrade_schema()
+    with app.app_context():
+        store = get_blob_store()
+        while True:
+            projects = db.session.query(Project.project_id, Project.img) \
+                .filter(Project.img != None, Project.img != '').limit(batch_size).all()  # noqa: E711
+            if not projects:
+                break
+            for project_id, img in projects:
+                Project.query.filter_by(project_id=project_id) \
+                    .update({'img_hash': store.put(img.encode('utf-8')), 'img': None, 'version': change_version()},
+                            synchronize_session=False)
+            db.session.commit()
+        Project.query.filter(Project.img == '').update({'img': None}, synchronize_session=False)
+        db.session.commit()
+
+
 def _add_initial_values():
     """Añadir valores iniciales a la base de datos."""
     hashed_password = generate_password_hash('admin', method='sha256')
@@ -70,13 +148,6 @@ def _add_initial_values():
     return jsonify({'message': 'Initial values created!'})
 
 
-app.register_blueprint(login_api)
-app.register_blueprint(user_api)
-app.register_blueprint(project_api)
-app.register_blueprint(task_api)
-app.register_blueprint(work_api)
-
-
 if __name__ == '__main__':
     app.run(debug=True, host= '0.0.0.0')
 
@@ -0,0 +1,117 @@
+from flask import Blueprint, jsonify, request, current_app
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException
+from werkzeug.urls import url_decode
+from model import db
+from decorators import token_required, load_data
+from operations import succeeded
+from permissions import member_task_ids
+from task import create_task_operation, modify_task_operation, delete_task_operation
+from work import create_work_operation, modify_work_operation, delete_work_operation
+
+
+batch_api = Blueprint('batch_api', __name__)
+
+# atomic: si falla una operacion no se guarda ninguna. best-effort: se guardan las que van bien
+BATCH_MODES = ('atomic', 'best-effort')
+
+# Endpoints que se pueden usar en un lote y la operacion que hace cada uno
+OPERATIONS = {
+    'task_api.create_task': create_task_operation,
+    'task_api.modify_task': modify_task_operation,
+    'task_api.delete_task': delete_task_operation,
+    'work_api.create_work': create_work_operation,
+    'work_api.modify_work': modify_work_operation,
+    'work_api.delete_work': delete_work_operation,
+}
+
+
+def _parse(operations):
+    """Comprueba la lista de operaciones. Devuelve (operaciones, errores)."""
+    if not isinstance(operations, list) or not operations:
+        return None, {'operations': ['must be a non-empty list']}
+    limit = current_app.config.get('BATCH_MAX_OPERATIONS', 100)
+    if len(operations) > limit:
+        return None, {'operations': ['max length is %d' % limit]}
+    errors = {}
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not isinstance(operation.get('method'), str) \
+                or not isinstance(operation.get('path'), str):
+            errors[index] = ['must have method and path']
+    return operations, errors
+
+
+def _resolve(adapter, operation):
+    """Operacion del lote, sus argumentos de la URL y los de la query string; o None si no existe."""
+    path, _, query = operation['path'].partition('?')
+    try:
+        endpoint, view_args = adapter.match(path, method=operation['method'].upper())
+    except HTTPException:
+        return None, None, None
+    if endpoint not in OPERATIONS:
+        return None, None, None
+    return OPERATIONS[endpoint], view_args, url_decode(query)
+
+
+def _run(current_user, function, view_args, args, data):
+    """Ejecuta una operacion. Un error de la base de datos cuenta como operacion fallida."""
+    try:
+        return function(current_user, data, args, **view_args)
+    except SQLAlchemyError:
+        current_app.logger.exception('Batch operation failed')
+        return {'message': 'Operation failed!'}, 500, None
+
+
+@batch_api.route('/api/v1/batch', methods=['POST'])
+@token_required
+@load_data
+def run_batch(data, current_user):
+    """Ejecuta en orden varias escrituras de tareas y trabajos con un solo commit.
+
+    El cuerpo es {"operations": [{"method": "POST", "path": "/api/v1/tasks/<task_id>/works?mode=add",
+    "body": {...}}, ...]}, con las mismas rutas y cuerpos que sus endpoints. La
+    respuesta trae el codigo y la respuesta de cada operacion en results. Con
+    ?mode=atomic (por defecto) la primera operacion que falla deshace todo el lote
+    y la respuesta es un 400 que acaba en esa operacion; con ?mode=best-effort cada
+    operacion va en su SAVEPOINT y solo se deshacen las que fallan.
+    """
+    mode = request.args.get('mode', 'atomic')
+    if mode not in BATCH_MODES:
+        return jsonify({'message': 'Batch not executed!',
+                        'errors': {'mode': ['must be one of ' + ', '.join(BATCH_MODES)]}}), 400
+
+    operations, errors = _parse(data.get('operations') if isinstance(data, dict) else None)
+    if errors:
+        return jsonify({'message': 'Batch not executed!', 'errors': errors}), 400
+
+    adapter = current_app.url_map.bind_to_environ(request.environ)
+    resolved = [_resolve(adapter, operation) for operation in operations]
+    # Los permisos de todas las tareas del lote con una sola consulta; el resto se recuerdan al comprobarlos
+    member_task_ids(current_user, {view_args['task_id'] for _, view_args, _ in resolved
+                                   if view_args and 'task_id' in view_args})
+
+    results, after_commit = [], []
+    for operation, (function, view_args, args) in zip(operations, resolved):
+        if function is None:
+            output, status, done = {'message': 'No operation found!'}, 404, None
+        elif mode == 'atomic':
+            output, status, done = _run(current_user, function, view_args, args, operation.get('body', {}))
+        else:
+            savepoint = db.session.begin_nested()
+            output, status, done = _run(current_user, function, view_args, args, operation.get('body', {}))
+            if succeeded(status):
+                savepoint.commit()
+            else:
+                savepoint.rollback()
+        results.append({'status': status, 'body': output})
+
+        if not succeeded(status) and mode == 'atomic':
+            db.session.rollback()
+            return jsonify({'message': 'Batch not executed!', 'results': results}), 400
+        if done is not None:
+            after_commit.append(done)
+
+    db.session.commit()
+    for done in after_commit:
+        done()
+    return jsonify({'message': 'Batch executed!', 'results': results})
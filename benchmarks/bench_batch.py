@@ -0,0 +1,87 @@
+"""Compara crear dias trabajados con una peticion cada uno o con un solo lote (POST /api/v1/batch).
+
+Mide el tiempo total, las consultas SQL y los commits de cada forma. Con una
+base de datos en disco para que cada commit cueste lo que cuesta de verdad.
+Desde la raiz del repositorio:
+    python -m benchmarks.bench_batch sqlite:////tmp/batch.db [operaciones]
+    python -m benchmarks.bench_batch postgresql:///das_batch 200
+"""
+from datetime import date, timedelta
+import base64
+import json
+import sys
+import time
+
+from sqlalchemy import event
+
+from api import app
+from model import db
+import api
+
+
+def _measure(send):
+    """Tiempo, consultas y commits de send()."""
+    counts = {'queries': 0, 'commits': 0}
+
+    def query(*args):
+        counts['queries'] += 1
+
+    def commit(*args):
+        counts['commits'] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', query)
+    event.listen(engine, 'commit', commit)
+    try:
+        start = time.perf_counter()
+        send()
+        return time.perf_counter() - start, counts['queries'], counts['commits']
+    finally:
+        event.remove(engine, 'before_cursor_execute', query)
+        event.remove(engine, 'commit', commit)
+
+
+def main(url, operations=100):
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['BATCH_MAX_OPERATIONS'] = max(operations, app.config.get('BATCH_MAX_OPERATIONS', 100))
+    with app.app_context():
+        db.create_all()
+        api._add_initial_values()
+
+    client = app.test_client()
+    auth = 'Basic ' + base64.b64encode(b'admin:admin').decode('ascii')
+    headers = {'x-access-token': client.get('/api/v1/login', headers={'Authorization': auth}).get_json()['token']}
+    project_id = client.post('/api/v1/projects', headers=headers,
+                             data=json.dumps({'name': 'batch'})).get_json()['project']['project_id']
+
+    def new_task():
+        return client.post('/api/v1/projects/%s/tasks' % project_id, headers=headers,
+                           data=json.dumps({'name': 'batch'})).get_json()['task']['task_id']
+
+    def works(task_id):
+        return [('/api/v1/tasks/%s/works' % task_id,
+                 {'date': (date(2020, 1, 1) + timedelta(days=i)).isoformat(), 'time': 1.0}) for i in range(operations)]
+
+    def one_by_one():
+        for path, body in works(new_task()):
+            assert client.post(path, headers=headers, data=json.dumps(body)).status_code == 201
+
+    def batch(mode):
+        def send():
+            operations = [{'method': 'POST', 'path': path, 'body': body} for path, body in works(new_task())]
+            response = client.post('/api/v1/batch?mode=' + mode, headers=headers,
+                                   data=json.dumps({'operations': operations}))
+            assert response.status_code == 200, response.get_json()
+        return send
+
+    print('%d works' % operations)
+    print('%-20s %10s %10s %10s' % ('', 'ms', 'queries', 'commits'))
+    for label, send in (('one request each', one_by_one), ('batch, atomic', batch('atomic')),
+                        ('batch, best-effort', batch('best-effort'))):
+        elapsed, queries, commits = _measure(send)
+        print('%-20s %10.1f %10d %10d' % (label, elapsed * 1000, queries, commits))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100)
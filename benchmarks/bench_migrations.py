@@ -0,0 +1,150 @@
+"""Mide las consultas mas comunes antes y despues de aplicar migrations.py.
+
+Crea el esquema original (ids VARCHAR y sin indices) en una base de datos
+vacia, la llena con `rows` dias trabajados, mide, migra y vuelve a medir.
+Desde la raiz del repositorio:
+    python -m benchmarks.bench_migrations postgresql:///das_bench 3000000
+    python -m benchmarks.bench_migrations sqlite:////tmp/bench.db 200000
+"""
+from datetime import date, timedelta
+import hashlib
+import sys
+import time
+
+from api import app
+from model import db
+import migrations
+
+USERS = 1000
+PROJECTS = 1000
+TASKS = 10000
+
+# Esquema anterior a las migraciones, igual que lo creaba db.create_all()
+_BASELINE_SCHEMA = [
+    'CREATE TABLE "user" (user_id VARCHAR(50) PRIMARY KEY, name VARCHAR(50) NOT NULL, email VARCHAR(100) UNIQUE, '
+    'password VARCHAR(80) NOT NULL, admin BOOLEAN, firebase_token VARCHAR(200))',
+    'CREATE TABLE project (project_id VARCHAR PRIMARY KEY, name VARCHAR(100) NOT NULL, "desc" VARCHAR(300), img TEXT)',
+    'CREATE TABLE task (task_id VARCHAR PRIMARY KEY, name VARCHAR(100) NOT NULL, "desc" VARCHAR(300), due_date DATE, '
+    'init_date DATE, expected FLOAT, progress INTEGER, project_id VARCHAR(50) REFERENCES project (project_id))',
+    'CREATE TABLE work (work_id VARCHAR NOT NULL UNIQUE, task_id VARCHAR(50) REFERENCES task (task_id), '
+    'user_id VARCHAR(50) REFERENCES "user" (user_id), date DATE NOT NULL, time FLOAT NOT NULL, '
+    'PRIMARY KEY (task_id, user_id, date))',
+    'CREATE TABLE invitation (invitation_id VARCHAR NOT NULL UNIQUE, user_id VARCHAR(50) REFERENCES "user" (user_id), '
+    'project_id VARCHAR(50) REFERENCES project (project_id), PRIMARY KEY (user_id, project_id))',
+    'CREATE TABLE project_member (user_id VARCHAR(50) REFERENCES "user" (user_id), '
+    'project_id VARCHAR(50) REFERENCES project (project_id), PRIMARY KEY (user_id, project_id))',
+]
+
+# Consultas de los endpoints afectados
+_QUERIES = {
+    'login (user by name)': ('SELECT user_id, password FROM "user" WHERE name = :name', {'name': 'user7'}),
+    'tasks of project': ('SELECT task_id, name FROM task WHERE project_id = :project_id', {'project_id': None}),
+    'works of user by date': ('SELECT work_id, time FROM work WHERE user_id = :user_id '
+                              'AND date BETWEEN :start AND :end', {'user_id': None, 'start': '2016-01-01',
+                                                                   'end': '2016-03-31'}),
+    'work by work_id': ('SELECT task_id, time FROM work WHERE work_id = :work_id', {'work_id': None}),
+}
+
+
+def _uuid(prefix, n):
+    """uuid determinista para poder generar los datos sin consultar los ids."""
+    digest = hashlib.md5(('%s%d' % (prefix, n)).encode('ascii')).hexdigest()
+    return '%s-%s-%s-%s-%s' % (digest[:8], digest[8:12], digest[12:16], digest[16:20], digest[20:])
+
+
+def _seed_postgresql(rows):
+    """Llena la base de datos con generate_series, en el propio servidor."""
+    uuid = "md5('%s' || %s)::uuid::text"
+    db.session.execute('INSERT INTO "user" (user_id, name, email, password, admin) '
+                       'SELECT %s, \'user\' || i, \'user\' || i, \'x\', false FROM generate_series(0, %d) i'
+                       % (uuid % ('u', 'i'), USERS - 1))
+    db.session.execute('INSERT INTO project (project_id, name) SELECT %s, \'project\' || i '
+                       'FROM generate_series(0, %d) i' % (uuid % ('p', 'i'), PROJECTS - 1))
+    db.session.execute('INSERT INTO project_member (user_id, project_id) SELECT %s, %s FROM generate_series(0, %d) i'
+                       % (uuid % ('u', 'i'), uuid % ('p', 'i'), min(USERS, PROJECTS) - 1))
+    db.session.execute('INSERT INTO task (task_id, name, project_id) SELECT %s, \'task\' || i, %s '
+                       'FROM generate_series(0, %d) i' % (uuid % ('t', 'i'), uuid % ('p', 'i %% %d' % PROJECTS),
+                                                          TASKS - 1))
+    db.session.execute('INSERT INTO work (work_id, task_id, user_id, date, time) '
+                       'SELECT %s, %s, %s, DATE \'2015-01-01\' + (i %% 3650), 1.5 FROM generate_series(0, %d) i'
+                       % (uuid % ('w', 'i'), uuid % ('t', 'i %% %d' % TASKS), uuid % ('u', '(i / %d) %% %d'
+                                                                                    % (TASKS, USERS)), rows - 1))
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def _seed_generic(rows, batch_size=10000):
+    """Llena la base de datos desde Python, por lotes."""
+    db.session.execute('INSERT INTO "user" (user_id, name, email, password, admin) VALUES '
+                       '(:user_id, :name, :name, \'x\', 0)',
+                       [{'user_id': _uuid('u', i), 'name': 'user%d' % i} for i in range(USERS)])
+    db.session.execute('INSERT INTO project (project_id, name) VALUES (:project_id, :name)',
+                       [{'project_id': _uuid('p', i), 'name': 'project%d' % i} for i in range(PROJECTS)])
+    db.session.execute('INSERT INTO project_member (user_id, project_id) VALUES (:user_id, :project_id)',
+                       [{'user_id': _uuid('u', i), 'project_id': _uuid('p', i)} for i in range(min(USERS, PROJECTS))])
+    db.session.execute('INSERT INTO task (task_id, name, project_id) VALUES (:task_id, :name, :project_id)',
+                       [{'task_id': _uuid('t', i), 'name': 'task%d' % i, 'project_id': _uuid('p', i % PROJECTS)}
+                        for i in range(TASKS)])
+    start = date(2015, 1, 1)
+    for offset in range(0, rows, batch_size):
+        db.session.execute('INSERT INTO work (work_id, task_id, user_id, date, time) '
+                           'VALUES (:work_id, :task_id, :user_id, :date, 1.5)',
+                           [{'work_id': _uuid('w', i), 'task_id': _uuid('t', i % TASKS),
+                             'user_id': _uuid('u', (i // TASKS) % USERS),
+                             'date': (start + timedelta(days=i % 3650)).isoformat()}
+                            for i in range(offset, min(rows, offset + batch_size))])
+    db.session.commit()
+
+
+def _measure(repeat=50):
+    """Tiempo medio en milisegundos de cada consulta."""
+    params = {'project_id': _uuid('p', 7), 'user_id': _uuid('u', 7), 'work_id': _uuid('w', 7)}
+    results = {}
+    for label, (sql, values) in sorted(_QUERIES.items()):
+        values = {key: params.get(key, value) if value is None else value for key, value in values.items()}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            db.session.execute(sql, values).fetchall()
+        results[label] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def _size():
+    """Tamaño en disco de la tabla work con sus indices (solo PostgreSQL)."""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    return db.session.execute("SELECT pg_total_relation_size('work')").scalar()
+
+
+def main(url, rows):
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    with app.app_context():
+        for statement in _BASELINE_SCHEMA:
+            db.session.execute(statement)
+        db.session.commit()
+        print('seeding %d work rows...' % rows)
+        if db.engine.dialect.name == 'postgresql':
+            _seed_postgresql(rows)
+        else:
+            _seed_generic(rows)
+
+        before, size_before = _measure(), _size()
+        start = time.perf_counter()
+        applied = migrations.upgrade()
+        elapsed = time.perf_counter() - start
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('ANALYZE')
+            db.session.commit()
+        after, size_after = _measure(), _size()
+
+        print('migrations %s applied in %.1f s' % (applied, elapsed))
+        print('%-24s %12s %12s' % ('query', 'before (ms)', 'after (ms)'))
+        for label in sorted(before):
+            print('%-24s %12.3f %12.3f' % (label, before[label], after[label]))
+        if size_before is not None:
+            print('%-24s %12.1f %12.1f' % ('work table size (MB)', size_before / 2 ** 20, size_after / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3000000)
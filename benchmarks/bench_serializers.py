@@ -0,0 +1,58 @@
+"""Compara los esquemas de marshmallow con los serializadores rapidos.
+
+Desde la raiz del repositorio:
+    python -m benchmarks.bench_serializers [filas]
+"""
+from datetime import date, timedelta
+import sys
+import time
+
+from api import app
+from model import db, User, Project, Task, Work, project_member, generate_uuid, \
+    users_schema, projects_schema, tasks_schema, works_schema
+from serializers import dump_users, dump_projects, dump_tasks, dump_works
+
+
+def _seed(rows):
+    """Crea `rows` usuarios, proyectos, tareas y dias trabajados."""
+    users = [{'user_id': generate_uuid(), 'name': 'user%d' % i, 'email': 'user%d' % i, 'password': 'x',
+              'admin': False} for i in range(rows)]
+    projects = [{'project_id': generate_uuid(), 'name': 'project%d' % i, 'desc': 'desc'} for i in range(rows)]
+    members = [{'user_id': u['user_id'], 'project_id': p['project_id']} for u, p in zip(users, projects)]
+    tasks = [{'task_id': generate_uuid(), 'name': 'task%d' % i, 'project_id': projects[i]['project_id'],
+              'expected': 10.0, 'progress': 0, 'due_date': date(2020, 1, 1)} for i in range(rows)]
+    works = [{'work_id': generate_uuid(), 'task_id': tasks[i]['task_id'], 'user_id': users[i]['user_id'],
+              'date': date(2020, 1, 1) + timedelta(days=i % 365), 'time': 1.5} for i in range(rows)]
+    for table, values in ((User.__table__, users), (Project.__table__, projects), (project_member, members),
+                          (Task.__table__, tasks), (Work.__table__, works)):
+        db.session.execute(table.insert(), values)
+    db.session.commit()
+
+
+def _measure(fn, objects, repeat=3):
+    """Mejor tiempo de `repeat` ejecuciones."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(objects)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(rows=10000):
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    with app.test_request_context('/'):
+        db.create_all()
+        _seed(rows)
+        print('%-8s %14s %14s %8s' % ('model', 'schema rows/s', 'fast rows/s', 'speedup'))
+        for model, schema, fast in ((User, users_schema, dump_users), (Project, projects_schema, dump_projects),
+                                    (Task, tasks_schema, dump_tasks), (Work, works_schema, dump_works)):
+            objects = model.query.all()
+            slow = _measure(lambda o: schema.dump(o), objects)
+            quick = _measure(fast, objects)
+            print('%-8s %14.0f %14.0f %7.1fx' % (model.__name__, len(objects) / slow, len(objects) / quick, slow / quick))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,123 @@
+"""Mide el arranque de la aplicacion: tiempo de `import api` y memoria de cada worker de gunicorn.
+
+El tiempo de import es la mediana de varios procesos nuevos. La memoria se mide
+con los workers arrancados y despues de atender unas peticiones, con y sin
+--preload: RSS es lo que ve cada worker y PSS su parte real, contando a medias
+las paginas que comparte con el resto (Linux, /proc/<pid>/smaps_rollup).
+Desde la raiz del repositorio:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --workers 4 --imports 20
+"""
+from urllib.request import urlopen
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT = 'import time; start = time.perf_counter(); import api; print(time.perf_counter() - start)'
+
+
+def import_time(repeat):
+    """Mediana en milisegundos de `import api` en un proceso nuevo."""
+    times = [float(subprocess.check_output([sys.executable, '-W', 'ignore', '-c', _IMPORT], cwd=ROOT))
+             for _ in range(repeat)]
+    return statistics.median(times) * 1000
+
+
+def _free_port():
+    """Un puerto libre para gunicorn."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid):
+    """Procesos hijos de pid (los workers de gunicorn)."""
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/%s/stat' % entry) as stat:
+                    if int(stat.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (IOError, IndexError, ValueError):
+                pass
+    return children
+
+
+def _memory(pid):
+    """RSS y PSS del proceso en KiB."""
+    memory = {}
+    for path, key, name in (('status', 'VmRSS:', 'rss'), ('smaps_rollup', 'Pss:', 'pss')):
+        try:
+            with open('/proc/%d/%s' % (pid, path)) as info:
+                for line in info:
+                    if line.startswith(key):
+                        memory[name] = int(line.split()[1])
+                        break
+        except IOError:
+            memory[name] = None
+    return memory
+
+
+def workers_memory(workers, preload, requests):
+    """Arranca gunicorn y devuelve (segundos hasta atender, memoria del master, memoria de cada worker)."""
+    port = _free_port()
+    # gunicorn 19 no se puede lanzar con -m
+    command = [sys.executable, '-W', 'ignore', '-c', 'from gunicorn.app.wsgiapp import run; run()',
+               '--workers', str(workers), '--bind', '127.0.0.1:%d' % port] + (['--preload'] if preload else []) \
+        + ['api:app']
+    start = time.perf_counter()
+    master = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urlopen('http://127.0.0.1:%d/metrics' % port, timeout=1).read()
+                break
+            except IOError:
+                if master.poll() is not None or time.perf_counter() - start > 60:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.02)
+        ready = time.perf_counter() - start
+        while len(_children(master.pid)) < workers:
+            time.sleep(0.05)
+        for _ in range(requests):
+            urlopen('http://127.0.0.1:%d/metrics' % port, timeout=5).read()
+        return ready, _memory(master.pid), [_memory(pid) for pid in _children(master.pid)]
+    finally:
+        master.terminate()
+        master.wait()
+
+
+def _average(values):
+    """Media de los valores medidos, en MiB."""
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) / 1024 if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--imports', type=int, default=10, help='processes to time `import api`')
+    parser.add_argument('--requests', type=int, default=50, help='requests before measuring memory')
+    args = parser.parse_args()
+
+    print('import api: %.1f ms (median of %d)' % (import_time(args.imports), args.imports))
+    print('%-10s %10s %12s %14s %14s %16s' % ('gunicorn', 'ready (s)', 'master RSS', 'worker RSS', 'worker PSS',
+                                              'total PSS (MiB)'))
+    for preload in (False, True):
+        ready, master, workers = workers_memory(args.workers, preload, args.requests)
+        total = (master['pss'] or 0) + sum(worker['pss'] or 0 for worker in workers)
+        print('%-10s %10.2f %12.1f %14.1f %14.1f %16.1f' % (
+            '--preload' if preload else 'default', ready, master['rss'] / 1024,
+            _average(worker['rss'] for worker in workers), _average(worker['pss'] for worker in workers),
+            total / 1024))
+
+
+if __name__ == '__main__':
+    main()
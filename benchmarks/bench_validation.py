@@ -0,0 +1,119 @@
+"""Compara los validadores precompilados de validation.py con los de cerberus.
+
+Primero comprueba que dan los mismos errores y el mismo documento con
+peticiones validas e invalidas, luego mide cuantas validan por segundo y al
+final usa el mismo validador desde varios hilos a la vez, que es lo que pasa
+en los workers con hilos. Desde la raiz del repositorio:
+    python -m benchmarks.bench_validation [repeticiones]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+
+from cerberus import Validator
+
+from model import create_user_validator, create_project_validator, update_project_validator, \
+    create_task_validator, update_task_validator, create_work_validator, update_work_validator
+
+# Peticiones de cada validador: la primera es valida y el resto no
+_SAMPLES = [
+    ('create user', create_user_validator, [
+        {'name': 'ander', 'email': 'ander@example.com', 'password': 'secret'},
+        {'name': 'ander', 'email': '', 'password': 'secret'},
+        {'name': 'ander', 'email': None},
+        {'name': 1, 'email': 'ander@example.com', 'password': 'secret', 'admin': True},
+    ]),
+    ('create project', create_project_validator, [
+        {'name': 'TFG', 'desc': 'Trabajo de fin de grado'},
+        {'desc': ''},
+        {'name': ['TFG'], 'img': 7},
+    ]),
+    ('update project', update_project_validator, [
+        {'name': 'TFG'},
+        {'name': '', 'project_id': 'x'},
+    ]),
+    ('create task', create_task_validator, [
+        {'name': 'API', 'desc': 'REST', 'due_date': '2020-06-30', 'init_date': '2020-01-01', 'expected': 120.5,
+         'progress': 10},
+        {'name': 'API', 'due_date': '30/06/2020', 'expected': -1, 'progress': 101},
+        {'name': '', 'init_date': None, 'expected': '1', 'progress': 1.5},
+        {'due_date': 20200630, 'progress': True},
+    ]),
+    ('update task', update_task_validator, [
+        {'progress': 50, 'expected': 3},
+        {'progress': -1, 'due_date': ''},
+    ]),
+    ('create work', create_work_validator, [
+        {'date': '2020-01-01', 'time': 1.5},
+        {'date': '2020-13-01', 'time': None},
+        {'time': ''},
+    ]),
+    ('update work', update_work_validator, [
+        {'time': 2},
+        {'time': '2', 'date': '2020-01-01'},
+    ]),
+]
+
+
+def _cerberus(validator, document):
+    """Resultado de cerberus en el formato de CompiledValidator.validate."""
+    valid = validator.validate(document)
+    return validator.document, {} if valid else validator.errors
+
+
+def check_parity():
+    """Falla si algun validador no da lo mismo que cerberus."""
+    for label, compiled, documents in _SAMPLES:
+        validator = Validator(compiled.schema)
+        for document in documents:
+            expected, got = _cerberus(validator, document), compiled.validate(document)
+            assert got == expected, '%s %r: %r != %r' % (label, document, got, expected)
+
+
+def _rate(validate, documents, repeat):
+    """Documentos validados por segundo."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            validate(document)
+    return repeat * len(documents) / (time.perf_counter() - start)
+
+
+def _races(validate, documents, expected, threads=8, repeat=2000):
+    """Resultados mal o excepciones al validar desde varios hilos con el mismo validador."""
+    def run(offset):
+        wrong = 0
+        for number in range(repeat):
+            index = (number + offset) % len(documents)
+            try:
+                if validate(documents[index]) != expected[index]:
+                    wrong += 1
+            except Exception:
+                wrong += 1
+        return wrong
+    with ThreadPoolExecutor(threads) as executor:
+        return sum(executor.map(run, range(threads)))
+
+
+def main(repeat=2000):
+    check_parity()
+    print('same errors and documents as cerberus')
+    print('%-16s %14s %14s %8s' % ('validator', 'cerberus doc/s', 'compiled doc/s', 'speedup'))
+    for label, compiled, documents in _SAMPLES:
+        validator = Validator(compiled.schema)
+        slow = _rate(lambda document: validator.validate(document), documents, repeat)
+        quick = _rate(compiled.validate, documents, repeat)
+        print('%-16s %14.0f %14.0f %7.1fx' % (label, slow, quick, quick / slow))
+
+    # Antes la misma instancia de cerberus se compartia entre todas las peticiones
+    _, compiled, documents = _SAMPLES[3]
+    shared = Validator(compiled.schema)
+    expected = [compiled.validate(document) for document in documents]
+    sys.setswitchinterval(1e-6)
+    print('wrong results with 8 threads: cerberus %d, compiled %d' % (
+        _races(lambda document: _cerberus(shared, document), documents, expected),
+        _races(compiled.validate, documents, expected)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,148 @@
+"""Comprueba el Notifier contra un servidor FCM falso en local.
+
+Los 5xx y los fallos de red se reintentan con espera exponencial, los 4xx no,
+los mensajes con los mismos datos se envian juntos en registration_ids (como
+mucho batch_size tokens por peticion) y las metricas cuentan cada token.
+Desde la raiz del repositorio:
+    python -m benchmarks.check_notifications
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Event, Lock, Thread
+import json
+import time
+
+from notifications import Notifier
+
+
+class FakeFCM(object):
+    """Servidor HTTP que apunta lo que recibe y contesta con los codigos de `statuses` (luego 200)."""
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        self.release = Event()
+        self.release.set()
+        self._lock = Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                fake.release.wait()
+                with fake._lock:
+                    fake.requests.append((time.monotonic(), self.headers.get('Authorization'), body))
+                    status = fake.statuses.pop(0) if fake.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/fcm/send' % self._server.server_port
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def reset(self, statuses=()):
+        """Olvida lo recibido y prepara las respuestas siguientes."""
+        with self._lock:
+            self.requests = []
+            self.statuses = list(statuses)
+
+    def tokens(self):
+        """Tokens de cada peticion recibida."""
+        return [body.get('registration_ids') or [body['to']] for _, _, body in self.requests]
+
+    def close(self):
+        self._server.shutdown()
+
+
+def _notifier(fcm, workers=1, backoff=0.02, **options):
+    """Notifier contra el servidor falso, con esperas cortas para no alargar la comprobacion."""
+    return Notifier(url=fcm.url, server_key='test-key', timeout=2, workers=workers, backoff=backoff, **options)
+
+
+def check_retries(fcm):
+    """Un 5xx se reintenta con espera exponencial hasta que va bien."""
+    fcm.reset([503, 502])
+    notifier = _notifier(fcm, retries=3)
+    notifier.send('token-1', {'message': 'retry'})
+    notifier.join()
+    assert len(fcm.requests) == 3, fcm.requests
+    times = [at for at, _, _ in fcm.requests]
+    assert times[1] - times[0] >= 0.02 and times[2] - times[1] >= 0.04, times
+    assert all(auth == 'key=test-key' for _, auth, _ in fcm.requests)
+    assert fcm.requests[-1][2] == {'to': 'token-1', 'data': {'message': 'retry'}}, fcm.requests[-1][2]
+    stats = notifier.stats()
+    assert (stats['sent'], stats['failed'], stats['queue_depth']) == (1, 0, 0), stats
+    assert stats['latency_max'] >= 0.06, stats
+
+
+def check_gives_up(fcm):
+    """Tras retries reintentos el mensaje cuenta como fallido; un 4xx no se reintenta."""
+    fcm.reset([500] * 10)
+    notifier = _notifier(fcm, retries=2)
+    notifier.send('token-1', {'message': 'down'})
+    notifier.join()
+    assert len(fcm.requests) == 3, fcm.requests
+
+    fcm.reset([400])
+    notifier.send('token-2', {'message': 'bad'})
+    notifier.join()
+    assert len(fcm.requests) == 1, fcm.requests
+    stats = notifier.stats()
+    assert (stats['sent'], stats['failed']) == (0, 2), stats
+
+
+def check_network_errors(fcm):
+    """Si no se puede conectar tambien se reintenta, y al final cuenta como fallido."""
+    notifier = Notifier(url='http://127.0.0.1:9/', server_key='test-key', workers=1, timeout=1, retries=2,
+                        backoff=0.01)
+    notifier.send('token-1', {'message': 'nobody'})
+    notifier.join()
+    stats = notifier.stats()
+    assert (stats['sent'], stats['failed']) == (0, 1), stats
+
+
+def check_multicast(fcm, tokens=250, batch_size=100):
+    """Los mensajes que esperan en la cola con los mismos datos van en una sola peticion por lote."""
+    fcm.reset()
+    notifier = _notifier(fcm, retries=0, batch_size=batch_size)
+    # La primera peticion se queda esperando para que el resto se acumule en la cola
+    fcm.release.clear()
+    notifier.send('first', {'message': 'hello'})
+    while notifier.stats()['queue_depth']:
+        time.sleep(0.01)
+    for number in range(tokens):
+        notifier.send('token-%d' % number, {'message': 'hello'})
+    notifier.send('other', {'message': 'bye'})
+    fcm.release.set()
+    notifier.join()
+
+    sent = fcm.tokens()
+    assert sent[0] == ['first'], sent[0]
+    hello = [ids for ids, (_, _, body) in zip(sent, fcm.requests) if body['data'] == {'message': 'hello'}][1:]
+    assert sorted(token for ids in hello for token in ids) == sorted('token-%d' % n for n in range(tokens))
+    assert all(len(ids) <= batch_size for ids in sent), [len(ids) for ids in sent]
+    # 250 + 1 mensajes en lotes de 100: tres peticiones, y 'bye' aparte sin mezclarse
+    assert len(hello) == 3, [len(ids) for ids in hello]
+    assert ['other'] in sent
+    for ids, (_, _, body) in zip(sent, fcm.requests):
+        assert ('to' in body) == (len(ids) == 1), body
+    stats = notifier.stats()
+    assert (stats['sent'], stats['failed']) == (tokens + 2, 0), stats
+
+
+def main():
+    fcm = FakeFCM()
+    try:
+        for check in (check_retries, check_gives_up, check_network_errors, check_multicast):
+            check(fcm)
+            print('ok %s' % check.__name__)
+    finally:
+        fcm.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Comprueba la cache de respuestas con un backend que guarda en JSON, como RedisCache.
+
+Cada endpoint cacheado tiene que dar lo mismo sin cache, al llenarla y al
+leer de ella. Desde la raiz del repositorio:
+    python -m benchmarks.check_payload_cache
+"""
+import base64
+import json
+
+from api import app
+from cache import MemoryCache
+from model import db
+from payloads import payload_cache
+from benchmarks.check_query_counts import _seed
+
+# Endpoints que pasan por payload_cache
+CACHED_URLS = [
+    '/api/v1/projects/{project_id}',
+    '/api/v1/projects/{project_id}/tasks',
+    '/api/v1/tasks/{task_id}',
+    '/api/v1/tasks/{task_id}/works',
+]
+
+
+class JSONMemoryCache(MemoryCache):
+    """MemoryCache que pasa los valores por JSON al guardarlos y leerlos, igual que RedisCache."""
+
+    def get(self, key):
+        value = super(JSONMemoryCache, self).get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        super(JSONMemoryCache, self).set(key, json.dumps(value))
+
+
+def main():
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    with app.app_context():
+        db.create_all()
+        project_id, task_id = _seed(projects=2, tasks=3, days=3)
+    payload_cache.set_backend(JSONMemoryCache())
+
+    client = app.test_client()
+    auth = 'Basic ' + base64.b64encode(b'admin:admin').decode('ascii')
+    headers = {'x-access-token': client.get('/api/v1/login', headers={'Authorization': auth}).get_json()['token']}
+
+    for fast in (True, False):
+        app.config['FAST_SERIALIZERS'] = fast
+        for url in CACHED_URLS:
+            url = url.format(project_id=project_id, task_id=task_id)
+            app.config['PAYLOAD_CACHE_ENABLED'] = False
+            expected = client.get(url, headers=headers)
+            assert expected.status_code == 200, (url, expected.status_code)
+            app.config['PAYLOAD_CACHE_ENABLED'] = True
+            payload_cache.invalidate(*_entry(url, project_id, task_id))
+            hits = payload_cache.stats()['hits']
+            for attempt in ('miss', 'hit'):
+                response = client.get(url, headers=headers)
+                assert response.status_code == 200, (url, attempt, response.status_code)
+                assert response.data == expected.data, (url, attempt)
+                assert response.mimetype == expected.mimetype, (url, attempt)
+            assert payload_cache.stats()['hits'] == hits + 1, url
+            print('%-6s ok %s' % ('fast' if fast else 'schema', url))
+
+
+def _entry(url, project_id, task_id):
+    """(tipo, id) de la entrada de la cache de una URL."""
+    if url.endswith('/tasks'):
+        return 'tasks', project_id
+    if url.endswith('/works'):
+        return 'works', task_id
+    return ('project', project_id) if '/projects/' in url else ('task', task_id)
+
+
+if __name__ == '__main__':
+    main()
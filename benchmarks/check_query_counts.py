@@ -0,0 +1,100 @@
+"""Comprueba que los listados ejecutan un numero fijo de consultas, sin N+1.
+
+Desde la raiz del repositorio:
+    python -m benchmarks.check_query_counts
+"""
+from datetime import date, timedelta
+import base64
+import json
+
+from werkzeug.security import generate_password_hash
+
+from api import app
+from model import db, User, Project, Task, Work, project_member, generate_uuid
+from querycount import assert_max_queries
+
+# Consultas maximas por endpoint, independientes del numero de filas. Las rutas de
+# administrador tienen una mas: admin se lee siempre de la base de datos (ver decorators.py)
+QUERY_BUDGETS = {
+    '/api/v1/users': 2,
+    '/api/v1/projects/all': 5,
+    '/api/v1/projects': 4,
+    '/api/v1/projects/{project_id}/tasks': 5,
+    '/api/v1/tasks/{task_id}/works': 5,
+    '/api/v1/projects/{project_id}/dashboard': 8,
+    '/api/v1/projects/{project_id}/dashboard?from=2020-01-01&to=2020-01-10': 11,
+    '/api/v1/sync': 10,
+    '/api/v1/sync?since=1': 11,
+}
+
+# Escrituras, en este orden: (metodo, url, cuerpo, consultas maximas contando el commit)
+WRITE_BUDGETS = [
+    ('POST', '/api/v1/tasks/{task_id}/works', {'date': '2021-01-01', 'time': 2.0}, 11),
+    ('POST', '/api/v1/works/{work_id}', {'time': 3.0}, 9),
+    ('POST', '/api/v1/tasks/{task_id}', {'progress': 50}, 9),
+    ('DELETE', '/api/v1/works/{work_id}', None, 9),
+    ('POST', '/api/v1/users/token', {'firebase_token': 'token'}, 2),
+]
+
+
+def _seed(projects=20, tasks=20, days=20):
+    """Crea un administrador miembro de `projects` proyectos con tareas y dias trabajados."""
+    admin = {'user_id': generate_uuid(), 'name': 'admin', 'email': 'admin', 'admin': True,
+             'password': generate_password_hash('admin', method='sha256')}
+    others = [{'user_id': generate_uuid(), 'name': 'user%d' % i, 'email': 'user%d' % i, 'password': 'x',
+               'admin': False} for i in range(days)]
+    project_rows, member_rows, task_rows, work_rows = [], [], [], []
+    for i in range(projects):
+        project_id = generate_uuid()
+        project_rows.append({'project_id': project_id, 'name': 'project%d' % i})
+        member_rows.append({'user_id': admin['user_id'], 'project_id': project_id})
+        member_rows += [{'user_id': user['user_id'], 'project_id': project_id} for user in others]
+        for j in range(tasks):
+            task_id = generate_uuid()
+            task_rows.append({'task_id': task_id, 'name': 'task%d' % j, 'project_id': project_id})
+            work_rows += [{'work_id': generate_uuid(), 'task_id': task_id, 'user_id': user['user_id'],
+                           'date': date(2020, 1, 1) + timedelta(days=k), 'time': 1.0}
+                          for k, user in enumerate(others)]
+    for table, values in ((User.__table__, [admin] + others), (Project.__table__, project_rows),
+                          (project_member, member_rows), (Task.__table__, task_rows), (Work.__table__, work_rows)):
+        db.session.execute(table.insert(), values)
+    db.session.commit()
+    return project_rows[0]['project_id'], task_rows[0]['task_id']
+
+
+def main():
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    # Se miden las consultas de verdad, no los aciertos de la cache de respuestas
+    app.config['PAYLOAD_CACHE_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        project_id, task_id = _seed()
+
+    client = app.test_client()
+    auth = 'Basic ' + base64.b64encode(b'admin:admin').decode('ascii')
+    token = client.get('/api/v1/login', headers={'Authorization': auth}).get_json()['token']
+    headers = {'x-access-token': token}
+    client.get('/api/v1/users', headers=headers)  # llena la cache de usuarios
+
+    for fast in (True, False):
+        app.config['FAST_SERIALIZERS'] = fast
+        for url, limit in sorted(QUERY_BUDGETS.items()):
+            url = url.format(project_id=project_id, task_id=task_id)
+            with app.app_context(), assert_max_queries(limit) as statements:
+                response = client.get(url, headers=headers)
+            assert response.status_code == 200, (url, response.status_code)
+            print('%-6s %-3d %s' % ('fast' if fast else 'schema', len(statements), url))
+
+    work_id = None
+    for method, url, body, limit in WRITE_BUDGETS:
+        url = url.format(project_id=project_id, task_id=task_id, work_id=work_id)
+        with app.app_context(), assert_max_queries(limit) as statements:
+            response = client.open(url, method=method, headers=headers,
+                                   data=json.dumps(body) if body is not None else None)
+        assert response.status_code < 300, (method, url, response.status_code)
+        work_id = (response.get_json().get('work') or {}).get('work_id', work_id)
+        print('%-6s %-3d %s %s' % ('write', len(statements), method, url))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Comprueba el reparto de peticiones entre la base de datos principal y una replica.
+
+Usa dos bases de datos SQLite: la replica es una copia de la principal que no
+recibe los cambios posteriores, como una replica con mucho retraso. Desde la
+raiz del repositorio:
+    python -m benchmarks.check_replica_routing
+"""
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from api import app
+from model import db, Project
+from routing import router
+import api
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    primary, replica = os.path.join(directory, 'primary.db'), os.path.join(directory, 'replica.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + primary
+    app.config['DATABASE_REPLICA_URIS'] = ['sqlite:///' + replica]
+    # Sin cache de respuestas, para ver siempre lo que hay en cada base de datos
+    app.config['PAYLOAD_CACHE_ENABLED'] = False
+    router.recent_writes.ttl = 1
+    try:
+        with app.app_context():
+            db.create_all()
+            api._add_initial_values()
+            project_id = Project.query.filter_by(name='TFG').first().project_id
+            db.engine.dispose()
+        shutil.copy(primary, replica)
+
+        client = app.test_client()
+        auth = 'Basic ' + base64.b64encode(b'admin:admin').decode('ascii')
+        headers = {'x-access-token': client.get('/api/v1/login', headers={'Authorization': auth}).get_json()['token']}
+
+        def name():
+            return client.get('/api/v1/projects/%s' % project_id, headers=headers).get_json()['project']['name']
+
+        assert name() == 'TFG'
+        response = client.post('/api/v1/projects/%s' % project_id, headers=headers, data=json.dumps({'name': 'new'}))
+        assert response.status_code == 200, response.status_code
+        assert name() == 'new', 'a read right after a write has to go to the primary'
+        print('read after write: primary')
+
+        time.sleep(router.recent_writes.ttl + 0.1)
+        assert name() == 'TFG', 'reads after the sticky window have to go to the replica'
+        print('read after %ss: replica' % router.recent_writes.ttl)
+
+        other = client.post('/api/v1/users', data=json.dumps({'name': 'other', 'email': 'other', 'password': 'x'}))
+        assert other.status_code == 201, other.status_code
+        response = client.get('/api/v1/users/%s' % other.get_json()['user']['user_id'], headers=headers)
+        assert response.get_json() == {'message': 'No user found!'}, 'reads of other users have to go to the replica'
+        print('other reads: replica')
+    finally:
+        app.config['DATABASE_REPLICA_URIS'] = []
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
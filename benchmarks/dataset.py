@@ -0,0 +1,159 @@
+"""Generador de datos sinteticos con un reparto parecido al de produccion.
+
+Unos pocos proyectos concentran la mayoria de miembros y tareas, y unos pocos
+usuarios registran la mayoria de las horas (reparto de Zipf). Los usuarios se
+llaman user0, user1... y todos tienen la contraseña PASSWORD. El usuario 0 es
+administrador. Con la misma semilla siempre se generan los mismos datos.
+Desde la raiz del repositorio:
+    python -m benchmarks.dataset sqlite:////tmp/load.db --users 1000 --projects 200 --years 3
+    python -m benchmarks.dataset postgresql:///das_load --users 20000 --projects 5000 --years 5
+"""
+from datetime import date, timedelta
+from itertools import accumulate
+import argparse
+import random
+import time
+import uuid
+
+from werkzeug.security import generate_password_hash
+
+from api import app
+from model import db, User, Project, Task, Work, Invitation, project_member
+import migrations
+
+PASSWORD = 'secret'
+
+# Filas por cada INSERT
+BATCH_SIZE = 10000
+
+
+def _zipf_weights(n, skew):
+    """Pesos 1/k^skew para k = 1..n: el primero es el mas popular."""
+    return [1.0 / (k ** skew) for k in range(1, n + 1)]
+
+
+class Dataset(object):
+    """Describe los datos a generar. generate() los inserta en la base de datos de la aplicacion."""
+
+    def __init__(self, users=1000, projects=200, tasks_per_project=20, years=3, members_per_project=5,
+                 invitations=0.1, skew=1.1, seed=1):
+        self.users = users
+        self.projects = projects
+        self.tasks_per_project = tasks_per_project
+        self.years = years
+        self.members_per_project = members_per_project
+        self.invitations = invitations
+        self.skew = skew
+        self.seed = seed
+
+    def _uuid(self, rng):
+        """uuid4 sacado del generador de numeros aleatorios, para que sea reproducible."""
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def generate(self, log=print):
+        """Inserta los datos por lotes. Devuelve el numero de filas de cada tabla."""
+        rng = random.Random(self.seed)
+        counts = {}
+        password = generate_password_hash(PASSWORD, method='sha256')
+        user_ids = [self._uuid(rng) for _ in range(self.users)]
+        self._insert(User.__table__, ({'user_id': user_id, 'name': 'user%d' % i, 'email': 'user%d@example.com' % i,
+                                       'password': password, 'admin': i == 0}
+                                      for i, user_id in enumerate(user_ids)), counts, log)
+
+        project_ids = [self._uuid(rng) for _ in range(self.projects)]
+        self._insert(Project.__table__, ({'project_id': project_id, 'name': 'project%d' % i,
+                                          'desc': 'Synthetic project %d' % i}
+                                         for i, project_id in enumerate(project_ids)), counts, log)
+
+        # Los proyectos mas populares tienen mas miembros y tareas
+        project_weights = _zipf_weights(self.projects, self.skew)
+        scale = self.projects / sum(project_weights)
+        user_weights = list(accumulate(_zipf_weights(self.users, self.skew)))
+        members = {}
+        tasks = {}
+        for i, project_id in enumerate(project_ids):
+            size = max(1, int(round(project_weights[i] * scale)))
+            chosen = {user_ids[0] if i == 0 else rng.choices(user_ids, cum_weights=user_weights)[0]}
+            while len(chosen) < min(max(1, self.users // 2), int(self.members_per_project * size)):
+                chosen.add(rng.choices(user_ids, cum_weights=user_weights)[0])
+            members[project_id] = sorted(chosen)
+            tasks[project_id] = [self._uuid(rng) for _ in range(max(1, int(self.tasks_per_project * size)))]
+
+        self._insert(project_member, ({'user_id': user_id, 'project_id': project_id}
+                                      for project_id in project_ids for user_id in members[project_id]), counts, log)
+
+        start = date.today() - timedelta(days=365 * self.years)
+        self._insert(Task.__table__, ({'task_id': task_id, 'name': 'task%d' % j, 'project_id': project_id,
+                                       'init_date': start + timedelta(days=rng.randrange(365 * self.years)),
+                                       'expected': float(rng.randrange(1, 200)), 'progress': rng.randrange(101)}
+                                      for project_id in project_ids for j, task_id in enumerate(tasks[project_id])),
+                     counts, log)
+
+        invited = []
+        for project_id in project_ids:
+            if rng.random() < self.invitations:
+                user_id = rng.choice(user_ids)
+                if user_id not in members[project_id]:
+                    invited.append({'invitation_id': self._uuid(rng), 'user_id': user_id, 'project_id': project_id})
+        self._insert(Invitation.__table__, invited, counts, log)
+
+        self._insert(Work.__table__, self._works(rng, project_ids, members, tasks, user_ids, start), counts, log)
+        db.session.commit()
+        return counts
+
+    def _works(self, rng, project_ids, members, tasks, user_ids, start):
+        """Dias trabajados: cada miembro trabaja en su proyecto algunos dias laborables."""
+        activity = dict(zip(user_ids, _zipf_weights(len(user_ids), self.skew / 4)))
+        days = [start + timedelta(days=d) for d in range(365 * self.years)]
+        days = [day for day in days if day.weekday() < 5]
+        for project_id in project_ids:
+            for user_id in members[project_id]:
+                ratio = activity[user_id] * 0.8 / len(members[project_id]) ** 0.5
+                for day in days:
+                    if rng.random() < ratio:
+                        yield {'work_id': self._uuid(rng), 'task_id': rng.choice(tasks[project_id]),
+                               'user_id': user_id, 'date': day, 'time': rng.choice((0.5, 1.0, 2.0, 4.0, 7.5, 8.0))}
+
+    def _insert(self, table, rows, counts, log):
+        """INSERT por lotes de BATCH_SIZE filas."""
+        started = time.perf_counter()
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                db.session.execute(table.insert(), batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(table.insert(), batch)
+            total += len(batch)
+        counts[table.name] = total
+        log('%-15s %10d rows in %.1f s' % (table.name, total, time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Llena una base de datos vacia con datos sinteticos.')
+    parser.add_argument('url', help='URL de SQLAlchemy de la base de datos')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--tasks-per-project', type=int, default=20)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--members-per-project', type=int, default=5)
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.url
+    with app.app_context():
+        db.create_all()
+        migrations.stamp()
+        Dataset(args.users, args.projects, args.tasks_per_project, args.years, args.members_per_project,
+                skew=args.skew, seed=args.seed).generate()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('ANALYZE')
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
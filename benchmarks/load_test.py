@@ -0,0 +1,274 @@
+"""Prueba de carga de todos los endpoints de la API, con varios hilos a la vez.
+
+Cada hilo es un usuario virtual que repite un recorrido por todos los endpoints
+(ver _iteration). Por endpoint se mide la latencia (p50/p95/p99), el
+rendimiento (peticiones por segundo) y las consultas SQL por peticion. Los
+resultados se guardan en benchmarks/results/ para poder comparar ejecuciones.
+Si la base de datos esta vacia se llena antes con benchmarks.dataset.
+Desde la raiz del repositorio:
+    python -m benchmarks.load_test sqlite:////tmp/load.db --threads 8 --iterations 20 --label baseline
+    python -m benchmarks.load_test postgresql:///das_load --threads 16 --compare benchmarks/results/<fichero>.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import argparse
+import base64
+import json
+import os
+import subprocess
+import threading
+import time
+
+from sqlalchemy import event, inspect
+
+from api import app
+from model import db, User, Task, Work, project_member
+from notifications import notifier
+import migrations
+from benchmarks.dataset import Dataset, PASSWORD
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+_local = threading.local()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Cuenta las consultas de la peticion en curso en este hilo."""
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def _percentile(values, percent):
+    """Percentil por el metodo del rango mas cercano. values tiene que estar ordenado."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(percent / 100.0 * len(values))) - 1))]
+
+
+class VirtualUser(object):
+    """Un usuario de la prueba: su cliente, su token y los datos que usa en cada recorrido."""
+
+    def __init__(self, name, user_id, project_id, task_id, admin_token, samples):
+        self.name = name
+        self.user_id = user_id
+        self.project_id = project_id
+        self.task_id = task_id
+        self.admin_token = admin_token
+        self.samples = samples
+        self.client = app.test_client()
+        self.token = None
+        self.sync_token = None
+        self.counter = 0
+
+    def call(self, method, url, admin=False, **kwargs):
+        """Hace una peticion y apunta (endpoint, estado, segundos, consultas, bytes)."""
+        headers = kwargs.pop('headers', {})
+        token = self.admin_token if admin else self.token
+        if token:
+            headers['x-access-token'] = token
+        endpoint, _ = app.url_map.bind('localhost').match(url.split('?')[0], method=method.upper())
+        _local.queries = 0
+        start = time.perf_counter()
+        response = getattr(self.client, method)(url, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.samples.append((endpoint, response.status_code, elapsed, _local.queries, len(response.data)))
+        return response
+
+    def login(self):
+        """Hace login y guarda el token."""
+        auth = base64.b64encode(('%s:%s' % (self.name, PASSWORD)).encode('utf-8')).decode('ascii')
+        response = self.call('get', '/api/v1/login', headers={'Authorization': 'Basic ' + auth})
+        self.token = response.get_json()['token']
+
+    def unique(self, prefix):
+        """Nombre que no se repite entre hilos ni recorridos."""
+        self.counter += 1
+        return '%s-%s-%d-%d' % (prefix, self.name, threading.get_ident(), self.counter)
+
+
+def _iteration(user):
+    """Un recorrido por todos los endpoints. Lo que se crea se borra al final."""
+    # Lecturas sobre los datos generados
+    user.login()
+    user.call('get', '/api/v1/users', admin=True)
+    user.call('get', '/api/v1/users/%s' % user.user_id)
+    user.call('get', '/api/v1/projects')
+    user.call('get', '/api/v1/projects/all', admin=True)
+    user.call('get', '/api/v1/projects/%s' % user.project_id)
+    user.call('get', '/api/v1/projects/%s/img' % user.project_id)
+    user.call('get', '/api/v1/projects/%s/tasks' % user.project_id)
+    user.call('get', '/api/v1/tasks/%s' % user.task_id)
+    works = user.call('get', '/api/v1/tasks/%s/works' % user.task_id).get_json()['works']
+    if works:
+        user.call('get', '/api/v1/works/%s' % works[0]['work_id'])
+    user.call('get', '/api/v1/projects/%s/report?by=task,month' % user.project_id)
+    user.call('get', '/api/v1/projects/%s/report/expected' % user.project_id)
+    user.call('post', '/api/v1/users/token', data=json.dumps({'firebase_token': user.unique('token')}))
+    # Sincronizacion completa la primera vez y luego solo lo cambiado desde el recorrido anterior
+    since = '?since=%s' % user.sync_token if user.sync_token else ''
+    user.sync_token = user.call('get', '/api/v1/sync' + since).get_json()['token']
+
+    # Escrituras sobre datos propios del recorrido
+    name = user.unique('user')
+    new_user = user.call('post', '/api/v1/users', data=json.dumps({'name': name, 'email': name,
+                                                                   'password': PASSWORD})).get_json()['user']
+    user.call('put', '/api/v1/users/%s' % new_user['user_id'], admin=True)
+
+    project = user.call('post', '/api/v1/projects', data=json.dumps({'name': user.unique('project')})) \
+        .get_json()['project']
+    user.call('post', '/api/v1/projects/%s' % project['project_id'], data=json.dumps({'desc': 'load test'}))
+    user.call('put', '/api/v1/projects/%s/invite/%s' % (project['project_id'], name))
+    task = user.call('post', '/api/v1/projects/%s/tasks' % project['project_id'],
+                     data=json.dumps({'name': 'task', 'expected': 10.0})).get_json()['task']
+    user.call('post', '/api/v1/tasks/%s' % task['task_id'], data=json.dumps({'progress': 50}))
+    work = user.call('post', '/api/v1/tasks/%s/works?mode=replace' % task['task_id'],
+                     data=json.dumps({'date': '2020-01-01', 'time': 2.0})).get_json()['work']
+    user.call('post', '/api/v1/works/%s' % work['work_id'], data=json.dumps({'time': 3.0}))
+    operations = [{'method': 'POST', 'path': '/api/v1/tasks/%s/works?mode=add' % task['task_id'],
+                   'body': {'date': '2019-12-%02d' % day, 'time': 1.0}} for day in range(1, 11)]
+    operations.append({'method': 'POST', 'path': '/api/v1/tasks/%s' % task['task_id'], 'body': {'progress': 60}})
+    user.call('post', '/api/v1/batch', data=json.dumps({'operations': operations}))
+    start = date(2020, 1, 2)
+    rows = '\n'.join(json.dumps({'task_id': task['task_id'], 'date': (start + timedelta(days=i)).isoformat(),
+                                 'time': 1.0}) for i in range(50))
+    user.call('post', '/api/v1/works/import', data=rows, content_type='application/x-ndjson')
+    user.call('delete', '/api/v1/works/%s' % work['work_id'])
+    user.call('delete', '/api/v1/tasks/%s' % task['task_id'])
+    deletion = user.call('delete', '/api/v1/projects/%s?background=1' % project['project_id']).get_json()
+    if 'job' in deletion:
+        user.call('get', '/api/v1/deletions/%s' % deletion['job']['job_id'])
+    user.call('delete', '/api/v1/users/%s' % new_user['user_id'], admin=True)
+
+
+def _virtual_users(count, samples):
+    """Elige `count` usuarios miembros de algun proyecto con tareas y trabajos, mas el administrador."""
+    rows = db.session.query(User.name, User.user_id, project_member.c.project_id, Task.task_id) \
+        .join(project_member, project_member.c.user_id == User.user_id) \
+        .join(Task, Task.project_id == project_member.c.project_id) \
+        .join(Work, Work.task_id == Task.task_id) \
+        .distinct().limit(count * 20).all()
+    chosen = {}
+    for name, user_id, project_id, task_id in rows:
+        chosen.setdefault(name, (name, user_id, project_id, task_id))
+    admin = db.session.query(User.name).filter(User.admin == True).order_by(User.name).first()  # noqa: E712
+    admin_user = VirtualUser(admin.name, None, None, None, None, samples)
+    admin_user.login()
+    users = list(chosen.values())[:count]
+    return [VirtualUser(*users[i % len(users)], admin_token=admin_user.token, samples=samples) for i in range(count)]
+
+
+def _summary(samples, wall_time):
+    """Estadisticas por endpoint a partir de las muestras."""
+    by_endpoint = {}
+    for endpoint, status, elapsed, queries, size in samples:
+        by_endpoint.setdefault(endpoint, []).append((status, elapsed, queries, size))
+    summary = {}
+    for endpoint, values in sorted(by_endpoint.items()):
+        latencies = sorted(elapsed * 1000 for _, elapsed, _, _ in values)
+        summary[endpoint] = {
+            'requests': len(values),
+            'errors': sum(1 for status, _, _, _ in values if status >= 500),
+            'statuses': sorted(set(status for status, _, _, _ in values)),
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'p99_ms': _percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'throughput_rps': len(values) / wall_time,
+            'queries_per_request': sum(queries for _, _, queries, _ in values) / float(len(values)),
+            'bytes_per_request': sum(size for _, _, _, size in values) / float(len(values)),
+        }
+    return summary
+
+
+def _git_commit():
+    """Commit actual del repositorio, si se puede saber."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL) \
+            .decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print(summary, previous=None):
+    """Tabla de resultados, con la diferencia de p95 respecto a otra ejecucion si se da."""
+    print('%-40s %6s %5s %9s %9s %9s %8s %7s %s' % ('endpoint', 'reqs', 'errs', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                    'req/s', 'queries', 'p95 vs previous' if previous else ''))
+    for endpoint, stats in summary.items():
+        line = '%-40s %6d %5d %9.2f %9.2f %9.2f %8.1f %7.1f' % (
+            endpoint, stats['requests'], stats['errors'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+            stats['throughput_rps'], stats['queries_per_request'])
+        if previous and endpoint in previous:
+            before = previous[endpoint]['p95_ms']
+            line += ' %+8.1f%%' % ((stats['p95_ms'] - before) / before * 100 if before else 0)
+        print(line)
+
+
+def run(threads=4, iterations=10):
+    """Lanza la prueba de carga. Hay que llamarlo dentro de un contexto de aplicacion."""
+    samples = []
+    users = _virtual_users(threads, samples)
+    db.session.remove()
+
+    def worker(user):
+        with app.app_context():
+            for _ in range(iterations):
+                _iteration(user)
+
+    event.listen(db.engine, 'before_cursor_execute', _count_query)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(worker, users))
+        wall_time = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _count_query)
+    return samples, wall_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de todos los endpoints.')
+    parser.add_argument('url', help='URL de SQLAlchemy de la base de datos')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=10, help='recorridos por hilo')
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--compare', help='fichero de resultados de otra ejecucion')
+    parser.add_argument('--users', type=int, default=1000, help='si hay que generar los datos')
+    parser.add_argument('--projects', type=int, default=200, help='si hay que generar los datos')
+    parser.add_argument('--years', type=int, default=3, help='si hay que generar los datos')
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.url
+    # Las invitaciones no deben llegar a firebase
+    notifier.url = 'http://127.0.0.1:9/'
+    notifier.retries = 0
+
+    with app.app_context():
+        if 'user' not in inspect(db.engine).get_table_names() or not db.session.query(User.user_id).first():
+            print('generating dataset...')
+            db.create_all()
+            migrations.stamp()
+            Dataset(args.users, args.projects, years=args.years).generate()
+        samples, wall_time = run(args.threads, args.iterations)
+        dialect = db.engine.dialect.name
+
+    summary = _summary(samples, wall_time)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['endpoints']
+    _print(summary, previous)
+    print('%d requests in %.1f s: %.1f req/s' % (len(samples), wall_time, len(samples) / wall_time))
+
+    result = {'label': args.label, 'commit': _git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'database': dialect, 'threads': args.threads, 'iterations': args.iterations,
+              'requests': len(samples), 'wall_time_s': wall_time, 'throughput_rps': len(samples) / wall_time,
+              'endpoints': summary}
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(RESULTS_DIR, '%s-%s.json' % (time.strftime('%Y%m%d-%H%M%S'), args.label))
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    print('results saved to %s' % path)
+
+
+if __name__ == '__main__':
+    main()
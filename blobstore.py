@@ -0,0 +1,61 @@
+from flask import current_app as app
+import hashlib
+import os
+import re
+import tempfile
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class LocalBlobStore(object):
+    """Almacen de blobs direccionado por contenido (sha256) en el sistema de ficheros.
+
+    Cualquier otro almacen (S3, base de datos...) solo necesita implementar
+    put y get con la misma firma.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest):
+        """Ruta del fichero de un blob, repartida en subdirectorios."""
+        if not _DIGEST.match(digest):
+            raise ValueError('Bad digest: %r' % digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        """Guarda los bytes dados y devuelve su hash. Si ya existian no se reescriben."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def get(self, digest):
+        """Devuelve los bytes de un blob o None si no existe."""
+        try:
+            with open(self._path(digest), 'rb') as f:
+                return f.read()
+        except (IOError, ValueError):
+            return None
+
+
+_store = None
+
+
+def set_blob_store(store):
+    """Cambia el almacen de blobs usado por la aplicacion."""
+    global _store
+    _store = store
+
+
+def get_blob_store():
+    """Devuelve el almacen de blobs. Por defecto uno local en BLOB_STORE_PATH."""
+    global _store
+    if _store is None:
+        _store = LocalBlobStore(app.config.get('BLOB_STORE_PATH') or os.path.join(app.instance_path, 'blobs'))
+    return _store
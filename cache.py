@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from threading import Lock
+import json
+import time
+
+
+class MemoryCache(object):
+    """Cache LRU en memoria del proceso, limitada en tamaño y con caducidad (ttl en segundos).
+
+    Cualquier otro backend (p.e. uno compartido entre workers) solo necesita
+    implementar get, set y delete con la misma firma.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """Devuelve el valor guardado o None si no existe o ha caducado."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Guarda un valor, descartando el menos usado si la cache esta llena."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Elimina un valor de la cache."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Vacia la cache."""
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache(object):
+    """Cache compartida entre workers en Redis, con la misma interfaz que MemoryCache.
+
+    Las claves tienen que ser strings y los valores se guardan en JSON. Si Redis no
+    responde se comporta como una cache vacia. En local se puede usar MemoryCache
+    en su lugar.
+    """
+
+    def __init__(self, url, ttl=60, prefix='api:'):
+        try:
+            import redis  # pip install redis; solo se importa si se usa
+        except ImportError:
+            raise RuntimeError('RedisCache needs the redis package')
+        self._errors = redis.RedisError
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        """Devuelve el valor guardado o None si no existe o ha caducado."""
+        try:
+            value = self._client.get(self.prefix + key)
+        except self._errors:
+            return None
+        return json.loads(value.decode('utf-8')) if value is not None else None
+
+    def set(self, key, value):
+        """Guarda un valor con caducidad."""
+        try:
+            self._client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except self._errors:
+            pass
+
+    def delete(self, key):
+        """Elimina un valor de la cache."""
+        try:
+            self._client.delete(self.prefix + key)
+        except self._errors:
+            pass
+
+    def clear(self):
+        """Vacia la cache (solo las claves con el prefijo)."""
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
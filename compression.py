@@ -0,0 +1,74 @@
+from functools import wraps
+import gzip
+
+from flask import g, request, current_app
+
+try:
+    import brotli
+except ImportError:  # pip install Brotli para poder usar br
+    brotli = None
+
+# Tipos de contenido que merece la pena comprimir
+_COMPRESSIBLE = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+
+def _encoding(accept_encoding):
+    """Mejor codificacion aceptada por el cliente ('br', 'gzip') o None."""
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+class Compressor(object):
+    """Comprime con brotli o gzip las respuestas grandes, segun Accept-Encoding.
+
+    Solo se comprimen las respuestas de mas de COMPRESS_MIN_SIZE bytes (1024 por
+    defecto), ni las que van en streaming, ni las de las vistas marcadas con
+    exempt. El ETag pasa a ser debil porque el cuerpo cambia con la codificacion.
+    Configuracion: COMPRESS_MIN_SIZE, COMPRESS_LEVEL (gzip), COMPRESS_BR_QUALITY.
+    """
+
+    def init_app(self, app):
+        """Registra el hook que comprime las respuestas."""
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_QUALITY', 4)
+        app.after_request(self._after_request)
+
+    def exempt(self, f):
+        """Decorator para no comprimir nunca las respuestas de una vista, p.e. si su ETag tiene que ser fuerte."""
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            g._compress_exempt = True
+            return f(*args, **kwargs)
+        return decorated
+
+    def _after_request(self, response):
+        """Comprime la respuesta si el cliente lo acepta y es lo bastante grande."""
+        response.vary.add('Accept-Encoding')
+        if (response.is_streamed or response.direct_passthrough or response.status_code < 200
+                or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+                or response.mimetype not in _COMPRESSIBLE or g.get('_compress_exempt')):
+            return response
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = _encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            data = brotli.compress(data, quality=current_app.config['COMPRESS_BR_QUALITY'])
+        else:
+            data = gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'])
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compressor = Compressor()
@@ -0,0 +1,30 @@
+from flask import request, Response
+import hashlib
+
+
+def make_etag(*parts):
+    """Genera un ETag a partir de la version del recurso y de los argumentos de la peticion."""
+    raw = '|'.join(str(part) for part in parts + (request.query_string.decode('utf-8'),))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """Devuelve una respuesta 304 si el cliente ya tiene esta version del recurso, si no None."""
+    if request.if_none_match:
+        # Comparacion debil: el ETag pasa a ser debil si la respuesta va comprimida
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = bool(last_modified and request.if_modified_since
+                     and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None))
+    if not fresh:
+        return None
+    return with_etag(Response(status=304), etag, last_modified)
+
+
+def with_etag(response, etag, last_modified=None):
+    """Añade ETag y Last-Modified a una respuesta."""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,80 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func
+from model import db, project_member, Project, Task, Work, User
+from serializers import all_fields, dump_project, dump_tasks, dump_works, loading_plan
+from decorators import token_required
+from conditional import make_etag, not_modified, with_etag
+from permissions import is_project_member
+from report import filter_date_range
+
+
+dashboard_api = Blueprint('dashboard_api', __name__)
+
+# El proyecto sin las listas de ids que el panel ya devuelve completas
+_PROJECT_FIELDS = all_fields(Project) - {'tasks', 'members'}
+# Las tareas sin la lista de claves de sus trabajos; el panel da los totales
+_TASK_FIELDS = all_fields(Task) - {'works'}
+
+
+@dashboard_api.route('/api/v1/projects/<project_id>/dashboard', methods=['GET'])
+@token_required
+def get_project_dashboard(current_user, project_id):
+    """Proyecto, miembros, tareas y horas por tarea en una sola peticion.
+
+    Con ?from=YYYY-MM-DD y/o ?to=YYYY-MM-DD incluye tambien los dias trabajados
+    de ese periodo. Siempre ejecuta el mismo numero de consultas.
+    """
+    version = db.session.query(Project.updated_at).filter_by(project_id=project_id).first()
+
+    if not version:
+        return jsonify({'message': 'No project found!'}), 404
+
+    if not is_project_member(current_user, project_id):
+        return jsonify({'message': 'You don\'t have permission to access that project!'}), 403
+
+    etag = make_etag(project_id, version.updated_at)
+    cached = not_modified(etag, version.updated_at)
+    if cached:
+        return cached
+
+    works_query = None
+    if request.args.get('from') or request.args.get('to'):
+        try:
+            works_query = filter_date_range(Work.query.join(Task, Task.task_id == Work.task_id)
+                                            .filter(Task.project_id == project_id))
+        except ValueError:
+            return jsonify({'message': 'Dashboard not created!', 'errors': {'date': ['must be YYYY-MM-DD']}}), 400
+
+    project = Project.query.filter_by(project_id=project_id).options(*loading_plan(Project, _PROJECT_FIELDS)).first()
+
+    members = db.session.query(User.user_id, User.name, User.email) \
+        .join(project_member, project_member.c.user_id == User.user_id) \
+        .filter(project_member.c.project_id == project_id) \
+        .order_by(User.name)
+
+    tasks = Task.query.filter_by(project_id=project_id).options(*loading_plan(Task, _TASK_FIELDS)) \
+        .order_by(Task.task_id).all()
+
+    totals = {task_id: {'hours': hours, 'entries': entries, 'last_date': last_date.isoformat() if last_date else None}
+              for task_id, hours, entries, last_date in
+              db.session.query(Work.task_id, func.sum(Work.time), func.count(), func.max(Work.date))
+              .join(Task, Task.task_id == Work.task_id)
+              .filter(Task.project_id == project_id)
+              .group_by(Work.task_id)}
+    empty = {'hours': 0.0, 'entries': 0, 'last_date': None}
+
+    output = dump_tasks(tasks, _TASK_FIELDS)
+    for task, task_output in zip(tasks, output):
+        task_output['work'] = totals.get(task.task_id, empty)
+
+    dashboard = {
+        'project': dump_project(project, _PROJECT_FIELDS),
+        'members': [{'user_id': user_id, 'name': name, 'email': email} for user_id, name, email in members],
+        'tasks': output,
+        'total': {'hours': sum(total['hours'] or 0 for total in totals.values()),
+                  'expected': sum(task.expected or 0 for task in tasks)},
+    }
+    if works_query is not None:
+        dashboard['works'] = dump_works(works_query.options(*loading_plan(Work, all_fields(Work)))
+                                        .order_by(Work.date, Work.task_id, Work.user_id).all(), all_fields(Work))
+    return with_etag(jsonify(dashboard), etag, version.updated_at)
@@ -1,10 +1,82 @@
 from functools import wraps
 from flask import request, jsonify
 from flask import current_app as app
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.exc import ObjectDeletedError
 import jwt
 import json
+import os
 
-from model import User
+from model import db, User
+from cache import MemoryCache, RedisCache
+
+# Columnas del usuario que se guardan en cache. Ni la contraseña ni admin: admin se
+# lee de la base de datos al usarlo, asi un usuario borrado o al que se le quita
+# admin en otro worker no puede seguir haciendo de administrador con la cache.
+_USER_CACHE_COLUMNS = ('user_id', 'name', 'email', 'firebase_token')
+
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+class UserCache(object):
+    """Cache de los usuarios autenticados, para no leer su fila en cada peticion.
+
+    Configuracion: USER_CACHE_TTL (60 segundos por defecto) y USER_CACHE_URL
+    (redis://...). Sin USER_CACHE_URL cada worker tiene la suya, y los cambios de un
+    usuario no se ven en los demas workers hasta que caduca.
+    """
+
+    def __init__(self):
+        self.backend = MemoryCache(maxsize=1024, ttl=60)
+
+    def init_app(self, app):
+        """Lee la configuracion y crea el backend."""
+        app.config.setdefault('USER_CACHE_TTL', 60)
+        app.config.setdefault('USER_CACHE_URL', None)
+        ttl = app.config['USER_CACHE_TTL']
+        if app.config['USER_CACHE_URL']:
+            self.set_backend(RedisCache(app.config['USER_CACHE_URL'], ttl=ttl, prefix='user:'))
+        else:
+            self.set_backend(MemoryCache(maxsize=1024, ttl=ttl))
+            if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+                app.logger.warning('USER_CACHE_URL is not set: each worker has its own user cache and user changes '
+                                   'take up to %d seconds to reach the other workers', ttl)
+
+    def set_backend(self, backend):
+        """Cambia el backend de la cache (necesita get, set y delete)."""
+        self.backend = backend
+
+
+user_cache = UserCache()
+
+
+def set_user_cache(backend):
+    """Cambia el backend de la cache de usuarios (necesita get, set y delete)."""
+    user_cache.set_backend(backend)
+
+
+def invalidate_user(user_id):
+    """Elimina un usuario de la cache. Llamar siempre que se modifique su fila."""
+    user_cache.backend.delete(user_id)
+
+
+def _load_user(user_id):
+    """Devuelve el usuario desde la cache o, si no esta, desde la base de datos.
+
+    El de la cache no se comprueba en la base de datos, puede que ya no exista.
+    """
+    row = user_cache.backend.get(user_id)
+    if row is None:
+        cache_stats['misses'] += 1
+        user = User.query.filter_by(user_id=user_id).first()
+        if user:
+            user_cache.backend.set(user_id, {column: getattr(user, column) for column in _USER_CACHE_COLUMNS})
+        return user
+
+    cache_stats['hits'] += 1
+    user = User(**row)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 
 def token_required(f):
@@ -21,7 +93,7 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'])
-            current_user = User.query.filter_by(user_id=data['user_id']).first()
+            current_user = _load_user(data['user_id'])
         except:
             return jsonify({'message': 'Wrong token!'}), 401
 
@@ -29,11 +101,26 @@ def token_required(f):
     return decorated
 
 
+# Contadores de aciertos/fallos de la cache de usuarios
+token_required.cache_stats = cache_stats
+
+
+def is_admin(user):
+    """Si el usuario es administrador, leido de la base de datos (ver _USER_CACHE_COLUMNS). None si ya no existe."""
+    try:
+        return bool(user.admin)
+    except ObjectDeletedError:
+        return None
+
+
 def admin_required(f):
     """Decorator para comprobar que se es administrador antes de ejecutar la funcion."""
     @wraps(f)
     def decorated(current_user, *args, **kwargs):
-        if not current_user.admin:
+        admin = is_admin(current_user)
+        if admin is None:
+            return jsonify({'message': 'Wrong token!'}), 401
+        if not admin:
             return jsonify({'message': 'Cannot perform that function!'}), 403
         return f(current_user, *args, **kwargs)
     return decorated
@@ -0,0 +1,192 @@
+from flask import current_app
+from sqlalchemy import and_, or_
+from model import db, project_member, Project, Task, Work, Invitation, User, Tombstone, DeletionJob, \
+    add_tombstones, change_version, _utcnow
+from datetime import timedelta
+from threading import Thread
+
+# Filas borradas por cada transaccion en los borrados en segundo plano
+DELETE_BATCH_SIZE = 5000
+
+# Los borrados son un DELETE por tabla, de hijos a padres, sin cargar nada en la
+# sesion. Asi funcionan igual aunque la base de datos no tenga ON DELETE CASCADE
+# (SQLite, o PostgreSQL sin la migracion 5). Cada borrado deja sus lapidas para
+# la sincronizacion; la de un proyecto o una tarea vale tambien para sus hijos.
+
+
+def _project_tasks(project_id):
+    """Subconsulta con los ids de las tareas de un proyecto."""
+    return db.session.query(Task.task_id).filter(Task.project_id == project_id)
+
+
+def _delete(model, clause):
+    """DELETE de todas las filas de model que cumplen clause. Devuelve cuantas se han borrado."""
+    return db.session.query(model).filter(clause).delete(synchronize_session=False)
+
+
+def _changed():
+    """Valores para marcar como modificadas las filas que se actualizan sin el ORM."""
+    return {'updated_at': _utcnow(), 'version': change_version()}
+
+
+def delete_project_rows(project_id):
+    """Borra un proyecto con sus tareas, trabajos, invitaciones y miembros."""
+    db.session.execute(Tombstone.__table__.insert().values(version=change_version(), entity='project',
+                                                           entity_id=project_id, project_id=project_id))
+    _delete(Work, Work.task_id.in_(_project_tasks(project_id)))
+    _delete(Task, Task.project_id == project_id)
+    _delete(Invitation, Invitation.project_id == project_id)
+    db.session.execute(project_member.delete().where(project_member.c.project_id == project_id))
+    _delete(Project, Project.project_id == project_id)
+
+
+def delete_task_rows(task_id):
+    """Borra una tarea con sus trabajos y actualiza updated_at del proyecto."""
+    Project.query.filter(Project.project_id.in_(db.session.query(Task.project_id).filter(Task.task_id == task_id))) \
+        .update(_changed(), synchronize_session=False)
+    add_tombstones('task', db.session.query(Task.task_id, Task.project_id).filter(Task.task_id == task_id))
+    _delete(Work, Work.task_id == task_id)
+    _delete(Task, Task.task_id == task_id)
+
+
+def delete_user_rows(user_id):
+    """Borra un usuario con sus trabajos, invitaciones y membresias.
+
+    Las tareas y proyectos afectados se marcan como modificados para los ETag.
+    Los proyectos se quedan aunque no les queden miembros, igual que antes.
+    """
+    changes = _changed()
+    worked_tasks = db.session.query(Work.task_id).filter(Work.user_id == user_id)
+    member_projects = db.session.query(project_member.c.project_id).filter(project_member.c.user_id == user_id)
+    Project.query.filter(or_(Project.project_id.in_(member_projects),
+                             Project.project_id.in_(db.session.query(Task.project_id)
+                                                    .filter(Task.task_id.in_(worked_tasks))))) \
+        .update(changes, synchronize_session=False)
+    Task.query.filter(Task.task_id.in_(worked_tasks)).update(changes, synchronize_session=False)
+    add_tombstones('work', db.session.query(Work.work_id, Task.project_id)
+                   .join(Task, Task.task_id == Work.task_id).filter(Work.user_id == user_id))
+    add_tombstones('invitation', db.session.query(Invitation.invitation_id, Invitation.project_id)
+                   .filter(Invitation.user_id == user_id))
+    add_tombstones('member', db.session.query(project_member.c.user_id, project_member.c.project_id)
+                   .filter(project_member.c.user_id == user_id))
+    _delete(Work, Work.user_id == user_id)
+    _delete(Invitation, Invitation.user_id == user_id)
+    db.session.execute(project_member.delete().where(project_member.c.user_id == user_id))
+    _delete(User, User.user_id == user_id)
+
+
+def remove_project_member(project_id, user_id):
+    """Quita a un usuario de un proyecto. Devuelve True si al proyecto le quedan miembros."""
+    membership = and_(project_member.c.project_id == project_id, project_member.c.user_id == user_id)
+    add_tombstones('member', db.session.query(project_member.c.user_id, project_member.c.project_id)
+                   .filter(membership))
+    db.session.execute(project_member.delete().where(membership))
+    Project.query.filter_by(project_id=project_id).update(_changed(), synchronize_session=False)
+    return db.session.query(project_member.c.user_id).filter(project_member.c.project_id == project_id) \
+        .first() is not None
+
+
+def _steps(project_id):
+    """(entidad, modelo, clave, filas (id, project_id)) de un proyecto en el orden en que hay que borrarlas."""
+    return [('work', Work, Work.work_id, db.session.query(Work.work_id, Task.project_id)
+             .join(Task, Task.task_id == Work.task_id).filter(Task.project_id == project_id)),
+            ('task', Task, Task.task_id, db.session.query(Task.task_id, Task.project_id)
+             .filter(Task.project_id == project_id)),
+            ('invitation', Invitation, Invitation.invitation_id,
+             db.session.query(Invitation.invitation_id, Invitation.project_id)
+             .filter(Invitation.project_id == project_id))]
+
+
+def _delete_batch(project_id, entity, model, key, rows, ids):
+    """Borra un lote de filas con sus lapidas y marca como modificados sus padres."""
+    changes = _changed()
+    add_tombstones(entity, rows.filter(key.in_(ids)))
+    if model is Work:
+        Task.query.filter(Task.task_id.in_(db.session.query(Work.task_id).filter(Work.work_id.in_(ids)))) \
+            .update(changes, synchronize_session=False)
+    Project.query.filter_by(project_id=project_id).update(changes, synchronize_session=False)
+    _delete(model, key.in_(ids))
+
+
+def run_project_deletion(job_id, batch_size=DELETE_BATCH_SIZE):
+    """Borra el proyecto de un DeletionJob. Hay que llamarlo dentro de un contexto de aplicacion.
+
+    Cada lote es una transaccion corta con sus lapidas y el avance del borrado, asi
+    que no bloquea las tablas mientras dura y, si se corta, se retoma donde se quedo.
+    """
+    job = DeletionJob.query.get(job_id)
+    try:
+        steps = _steps(job.project_id)
+        job.status = 'running'
+        job.total = job.deleted + sum(rows.count() for _, _, _, rows in steps) + 1
+        job.updated_at = _utcnow()
+        db.session.commit()
+        for entity, model, key, rows in steps:
+            while True:
+                ids = [row[0] for row in rows.limit(batch_size)]
+                if not ids:
+                    break
+                _delete_batch(job.project_id, entity, model, key, rows, ids)
+                job.deleted += len(ids)
+                job.updated_at = _utcnow()
+                db.session.commit()
+        delete_project_rows(job.project_id)
+        job.deleted += 1
+        job.status = 'done'
+        job.updated_at = _utcnow()
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.exception('Project deletion failed')
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+        job.updated_at = _utcnow()
+        db.session.commit()
+    finally:
+        db.session.remove()
+
+
+def _claim(job_id, stale_before):
+    """Se queda con un borrado parado desde antes de stale_before. Devuelve False si otro ya lo ha retomado."""
+    claimed = DeletionJob.query.filter(DeletionJob.job_id == job_id, DeletionJob.status.in_(('pending', 'running')),
+                                       DeletionJob.updated_at < stale_before) \
+        .update({'updated_at': _utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _start(job_id, stale_before=None):
+    """Ejecuta el borrado en un hilo; si se pasa stale_before solo si sigue parado."""
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            if stale_before is None or _claim(job_id, stale_before):
+                run_project_deletion(job_id)
+            else:
+                db.session.remove()
+
+    Thread(target=run, daemon=True).start()
+
+
+def start_project_deletion(project_id, user_id):
+    """Guarda el borrado de un proyecto junto con los cambios pendientes, lo lanza en un hilo y lo devuelve."""
+    job = DeletionJob(project_id=project_id, user_id=user_id, status='pending', deleted=0)
+    db.session.add(job)
+    db.session.commit()
+    _start(job.job_id)
+    return job
+
+
+def get_deletion_job(job_id):
+    """Devuelve el borrado con ese id, o None si no existe.
+
+    Si lleva DELETION_STALE_SECONDS sin avanzar (se reinicio el worker que lo
+    ejecutaba) se retoma en este proceso.
+    """
+    job = DeletionJob.query.get(job_id)
+    if job is not None and job.status in ('pending', 'running'):
+        stale_before = _utcnow() - timedelta(seconds=current_app.config.get('DELETION_STALE_SECONDS', 300))
+        if job.updated_at < stale_before:
+            _start(job_id, stale_before)
+    return job
@@ -0,0 +1,181 @@
+from bisect import bisect_left
+from threading import Lock
+import time
+
+from flask import Blueprint, Response, g, has_request_context, jsonify, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from decorators import cache_stats
+from notifications import notifier
+from payloads import payload_cache
+
+# Limites de los buckets de los histogramas
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+class Histogram(object):
+    """Histograma acumulativo al estilo de Prometheus."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Añade una observacion."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        """Lineas del formato de texto de Prometheus (buckets acumulados, suma y cuenta)."""
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bound, total)
+        yield '%s_sum{%s} %r' % (name, labels, self.sum)
+        yield '%s_count{%s} %d' % (name, labels, self.count)
+
+
+def _labels(**labels):
+    """Etiquetas de una serie en formato Prometheus."""
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for key, value in sorted(labels.items()))
+
+
+class Metrics(object):
+    """Metricas por endpoint: latencia, tamaño de respuesta, consultas SQL y tiempo en la base de datos.
+
+    Se exponen en /metrics en formato Prometheus y en la cabecera Server-Timing de
+    cada respuesta. Solo suma contadores bajo un lock, asi que se puede dejar
+    activado en produccion. Cada proceso tiene sus propias metricas.
+    Configuracion: METRICS_ENABLED, SERVER_TIMING y METRICS_TOKEN (si se define, /metrics
+    pide la cabecera Authorization: Bearer <token>).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Pone todas las metricas a cero."""
+        with self._lock:
+            self._latency = {}
+            self._size = {}
+            self._queries = {}
+            self._requests = {}
+            self._db_time = {}
+
+    def init_app(self, app):
+        """Registra los hooks de la aplicacion y de SQLAlchemy."""
+        if not app.config.setdefault('METRICS_ENABLED', True):
+            return
+        app.config.setdefault('SERVER_TIMING', True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def _before_request(self):
+        """Empieza a medir la peticion."""
+        g._metrics = {'start': time.perf_counter(), 'queries': 0, 'db_time': 0.0}
+
+    def _after_request(self, response):
+        """Apunta la peticion y añade la cabecera Server-Timing."""
+        state = g.pop('_metrics', None)
+        if state is None:
+            return response
+        elapsed = time.perf_counter() - state['start']
+        endpoint = request.endpoint or 'unknown'
+        size = None if response.is_streamed else response.calculate_content_length()
+        self.observe(endpoint, request.method, response.status_code, elapsed, size, state['queries'],
+                     state['db_time'])
+        if current_app.config['SERVER_TIMING']:
+            response.headers.add('Server-Timing', 'app;dur=%.1f, db;dur=%.1f;desc="%d queries"'
+                                 % (elapsed * 1000, state['db_time'] * 1000, state['queries']))
+        return response
+
+    def observe(self, endpoint, method, status, elapsed, size, queries, db_time):
+        """Apunta una peticion terminada."""
+        with self._lock:
+            key = (endpoint, method)
+            if key not in self._latency:
+                self._latency[key] = Histogram(LATENCY_BUCKETS)
+                self._queries[key] = Histogram(QUERY_BUCKETS)
+                self._db_time[key] = 0.0
+            self._latency[key].observe(elapsed)
+            self._queries[key].observe(queries)
+            self._db_time[key] += db_time
+            if size is not None:
+                self._size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(size)
+            self._requests[(endpoint, method, status)] = self._requests.get((endpoint, method, status), 0) + 1
+
+    def render(self):
+        """Todas las metricas en el formato de texto de Prometheus."""
+        lines = []
+        with self._lock:
+            lines += ['# HELP http_requests_total Requests by endpoint, method and status.',
+                      '# TYPE http_requests_total counter']
+            lines += ['http_requests_total{%s} %d' % (_labels(endpoint=endpoint, method=method, status=status), count)
+                      for (endpoint, method, status), count in sorted(self._requests.items())]
+            for name, description, series in (
+                    ('http_request_duration_seconds', 'Request latency.', self._latency),
+                    ('http_response_size_bytes', 'Response body size.', self._size),
+                    ('db_queries_per_request', 'SQL statements per request.', self._queries)):
+                lines += ['# HELP %s %s' % (name, description), '# TYPE %s histogram' % name]
+                for (endpoint, method), histogram in sorted(series.items()):
+                    lines += histogram.lines(name, _labels(endpoint=endpoint, method=method))
+            lines += ['# HELP db_duration_seconds_total Time spent in SQL statements.',
+                      '# TYPE db_duration_seconds_total counter']
+            lines += ['db_duration_seconds_total{%s} %r' % (_labels(endpoint=endpoint, method=method), seconds)
+                      for (endpoint, method), seconds in sorted(self._db_time.items())]
+        lines += _external_metrics()
+        return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Apunta cuando empieza una sentencia SQL."""
+    conn.info['_metrics_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Suma la sentencia y su duracion a la peticion en curso."""
+    start = conn.info.pop('_metrics_start', None)
+    if start is not None and has_request_context():
+        state = g.get('_metrics')
+        if state is not None:
+            state['queries'] += 1
+            state['db_time'] += time.perf_counter() - start
+
+
+def _external_metrics():
+    """Metricas de la cola de notificaciones y de las caches de usuarios y de respuestas."""
+    stats = notifier.stats()
+    payloads = payload_cache.stats()
+    return ['# TYPE fcm_queue_depth gauge', 'fcm_queue_depth %d' % stats['queue_depth'],
+            '# TYPE fcm_sent_total counter', 'fcm_sent_total %d' % stats['sent'],
+            '# TYPE fcm_failed_total counter', 'fcm_failed_total %d' % stats['failed'],
+            '# TYPE fcm_latency_seconds_max gauge', 'fcm_latency_seconds_max %r' % stats['latency_max'],
+            '# TYPE user_cache_hits_total counter', 'user_cache_hits_total %d' % cache_stats['hits'],
+            '# TYPE user_cache_misses_total counter', 'user_cache_misses_total %d' % cache_stats['misses'],
+            '# TYPE payload_cache_hits_total counter', 'payload_cache_hits_total %d' % payloads['hits'],
+            '# TYPE payload_cache_misses_total counter', 'payload_cache_misses_total %d' % payloads['misses']]
+
+
+metrics = Metrics()
+
+
+@metrics_api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metricas en formato Prometheus."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        return jsonify({'message': 'Wrong token!'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,159 @@
+from sqlalchemy import inspect
+from model import db, change_counter, Tombstone, DeletionJob
+
+# Migraciones del esquema, en orden. Cada una se aplica una sola vez y queda
+# apuntada en la tabla schema_version. Una base de datos creada con
+# db.create_all() ya tiene el esquema actual y solo hay que marcarla con stamp().
+
+# Columnas con uuids, convertidas a uuid nativo en PostgreSQL
+_UUID_COLUMNS = [
+    ('user', 'user_id'),
+    ('project', 'project_id'),
+    ('task', 'task_id'), ('task', 'project_id'),
+    ('work', 'work_id'), ('work', 'task_id'), ('work', 'user_id'),
+    ('invitation', 'invitation_id'), ('invitation', 'user_id'), ('invitation', 'project_id'),
+    ('project_member', 'user_id'), ('project_member', 'project_id'),
+]
+
+# (tabla, columna, tabla referenciada, columna referenciada)
+_FOREIGN_KEYS = [
+    ('task', 'project_id', 'project', 'project_id'),
+    ('work', 'task_id', 'task', 'task_id'),
+    ('work', 'user_id', 'user', 'user_id'),
+    ('invitation', 'user_id', 'user', 'user_id'),
+    ('invitation', 'project_id', 'project', 'project_id'),
+    ('project_member', 'user_id', 'user', 'user_id'),
+    ('project_member', 'project_id', 'project', 'project_id'),
+]
+
+
+def _dialect():
+    """Nombre del motor de base de datos (postgresql, sqlite...)."""
+    return db.engine.dialect.name
+
+
+def _add_missing_column(table, name, ddl):
+    """Añade una columna a una tabla existente si todavia no la tiene."""
+    if name not in [column['name'] for column in inspect(db.engine).get_columns(table)]:
+        db.session.execute('ALTER TABLE "%s" ADD COLUMN %s %s' % (table, name, ddl))
+
+
+def _create_index(name, table, columns):
+    """Crea un indice si no existe. En PostgreSQL sin bloquear las escrituras (CONCURRENTLY)."""
+    if _dialect() == 'postgresql':
+        db.session.commit()
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT') \
+                .execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON "%s" (%s)' % (name, table, columns))
+    else:
+        db.session.execute('CREATE INDEX IF NOT EXISTS %s ON "%s" (%s)' % (name, table, columns))
+
+
+def _0001_project_img_hash():
+    """Hash de la imagen del proyecto en el almacen de blobs."""
+    _add_missing_column('project', 'img_hash', 'VARCHAR(64)')
+
+
+def _0002_updated_at():
+    """Columnas updated_at para los ETag."""
+    for table in ('project', 'task', 'work'):
+        _add_missing_column(table, 'updated_at', 'TIMESTAMP')
+        db.session.execute('UPDATE "%s" SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL' % table)
+
+
+def _0003_indexes():
+    """Indices para el login por nombre, las tareas de un proyecto y los trabajos de un usuario por fecha.
+
+    work.work_id e invitation.invitation_id ya tienen indice por ser unique.
+    """
+    _create_index('ix_user_name', 'user', 'name')
+    _create_index('ix_task_project_id', 'task', 'project_id')
+    _create_index('ix_work_user_id_date', 'work', 'user_id, date')
+
+
+def _drop_foreign_keys():
+    """Borra las claves ajenas de _FOREIGN_KEYS (PostgreSQL)."""
+    for table, column, _, _ in _FOREIGN_KEYS:
+        db.session.execute('ALTER TABLE "%s" DROP CONSTRAINT IF EXISTS %s_%s_fkey' % (table, table, column))
+
+
+def _add_foreign_keys(on_delete=''):
+    """Crea las claves ajenas de _FOREIGN_KEYS (PostgreSQL), p.e. con on_delete='ON DELETE CASCADE'."""
+    for table, column, referenced_table, referenced_column in _FOREIGN_KEYS:
+        db.session.execute('ALTER TABLE "%s" ADD CONSTRAINT %s_%s_fkey FOREIGN KEY (%s) REFERENCES "%s" (%s) %s'
+                           % (table, table, column, column, referenced_table, referenced_column, on_delete))
+
+
+def _0004_native_uuid():
+    """Convierte los ids de VARCHAR a uuid nativo (16 bytes) en PostgreSQL."""
+    if _dialect() != 'postgresql':
+        return
+    _drop_foreign_keys()
+    for table, column in _UUID_COLUMNS:
+        db.session.execute('ALTER TABLE "%s" ALTER COLUMN %s TYPE uuid USING %s::uuid' % (table, column, column))
+    _add_foreign_keys()
+
+
+def _0005_on_delete_cascade():
+    """Claves ajenas con ON DELETE CASCADE en PostgreSQL, para borrar un padre sin cargar sus hijos.
+
+    En SQLite no se pueden cambiar sin rehacer las tablas; ahi basta con los borrados de deletion.py.
+    """
+    if _dialect() != 'postgresql':
+        return
+    _drop_foreign_keys()
+    _add_foreign_keys('ON DELETE CASCADE')
+
+
+def _0006_change_versions():
+    """Versiones de cambios, lapidas y contador para la sincronizacion incremental (ver sync.py).
+
+    Las filas que ya existen quedan con version 0 y llegan en la primera sincronizacion.
+    """
+    for table in ('project', 'task', 'work', 'invitation', 'project_member'):
+        _add_missing_column(table, 'version', 'BIGINT NOT NULL DEFAULT 0')
+    Tombstone.__table__.create(db.session.connection(), checkfirst=True)
+    change_counter.create(db.session.connection(), checkfirst=True)
+    for table in ('project', 'task', 'work', 'invitation', 'project_member'):
+        _create_index('ix_%s_version' % table, table, 'version')
+
+
+def _0007_deletion_jobs():
+    """Estado de los borrados de proyectos en segundo plano, compartido por los workers."""
+    DeletionJob.__table__.create(db.session.connection(), checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, _0001_project_img_hash),
+    (2, _0002_updated_at),
+    (3, _0003_indexes),
+    (4, _0004_native_uuid),
+    (5, _0005_on_delete_cascade),
+    (6, _0006_change_versions),
+    (7, _0007_deletion_jobs),
+]
+
+
+def current_version():
+    """Version del esquema de la base de datos (0 si nunca se ha migrado)."""
+    db.session.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    return db.session.execute('SELECT MAX(version) FROM schema_version').scalar() or 0
+
+
+def upgrade():
+    """Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas."""
+    applied = []
+    for version, migration in MIGRATIONS:
+        if version > current_version():
+            migration()
+            db.session.execute('INSERT INTO schema_version (version) VALUES (:version)', {'version': version})
+            db.session.commit()
+            applied.append(version)
+    return applied
+
+
+def stamp():
+    """Marca la base de datos como actualizada sin ejecutar nada, tras un db.create_all()."""
+    if current_version() < MIGRATIONS[-1][0]:
+        db.session.execute('INSERT INTO schema_version (version) VALUES (:version)', {'version': MIGRATIONS[-1][0]})
+    db.session.commit()
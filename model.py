@@ -1,10 +1,14 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask import url_for
+from sqlalchemy import and_, event, literal, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, attributes
 from flask_marshmallow import Marshmallow
-from cerberus import Validator
+from validation import CompiledValidator
+from routing import RoutingSQLAlchemy
 import uuid
 import datetime
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 ma = Marshmallow()
 
 
@@ -18,25 +22,62 @@ def generate_uuid():
     return str(uuid.uuid4())
 
 
+def canonical_uuid(value):
+    """Devuelve un uuid en minusculas y con guiones, como se guardan, o None si no es un uuid."""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+class UUIDString(db.TypeDecorator):
+    """UUID nativo en PostgreSQL y texto en el resto. En Python siempre es un string."""
+    impl = db.String(36)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(db.String(36))
+
+    def process_bind_param(self, value, dialect):
+        # Un id mal formado no coincide con ninguna fila en vez de dar error en PostgreSQL
+        if value is None:
+            return None
+        return canonical_uuid(value)
+
+
+def _utcnow():
+    """Fecha y hora actual en UTC, para las columnas updated_at."""
+    return datetime.datetime.utcnow()
+
+
 # Tabla para miembros de proyectos
 project_member = db.Table('project_member',
-                          db.Column('user_id', db.String(50), db.ForeignKey('user.user_id'), primary_key=True),
-                          db.Column('project_id', db.String(50), db.ForeignKey('project.project_id'), primary_key=True)
+                          db.Column('user_id', UUIDString, db.ForeignKey('user.user_id', ondelete='CASCADE'),
+                                    primary_key=True),
+                          db.Column('project_id', UUIDString,
+                                    db.ForeignKey('project.project_id', ondelete='CASCADE'), primary_key=True),
+                          db.Column('version', db.BigInteger, nullable=False, server_default='0', index=True)
                           )
 
+# Ultima version de cambios repartida, en los motores sin txid_current() (ver change_version)
+change_counter = db.Table('change_counter', db.Column('version', db.BigInteger, nullable=False))
+
 
 class User(db.Model):
     """Tabla usuarios de la base de datos."""
-    user_id = db.Column(db.String(50), unique=True, primary_key=True, default=generate_uuid)
-    name = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(UUIDString, unique=True, primary_key=True, default=generate_uuid)
+    name = db.Column(db.String(50), nullable=False, index=True)
     email = db.Column(db.String(100), unique=True)
     password = db.Column(db.String(80), nullable=False)
     admin = db.Column(db.Boolean, default=False)
     firebase_token = db.Column(db.String(200))
 
-    projects = db.relationship('Project', secondary=project_member, backref=db.backref('members'))
-    works = db.relationship('Work', backref=db.backref('user'))
-    invitations = db.relationship('Invitation', backref=db.backref('user'))
+    # passive_deletes: al borrar se confia en el ON DELETE CASCADE en vez de cargar los hijos
+    projects = db.relationship('Project', secondary=project_member, passive_deletes=True,
+                               backref=db.backref('members', passive_deletes=True))
+    works = db.relationship('Work', backref=db.backref('user'), cascade='all', passive_deletes=True)
+    invitations = db.relationship('Invitation', backref=db.backref('user'), cascade='all', passive_deletes=True)
 
 
 _user_creation_schema = {
@@ -44,23 +85,30 @@ _user_creation_schema = {
     'name': {'type': 'string', 'required': True, 'empty': False},
     'password': {'type': 'string', 'required': True, 'empty': False}
 }
-create_user_validator = Validator(_user_creation_schema)
+create_user_validator = CompiledValidator(_user_creation_schema)
 
 _user_firebase_schema = {
     'firebase_token': {'type': 'string', 'required': True, 'empty': False}
 }
-user_firebase_validator = Validator(_user_firebase_schema)
+user_firebase_validator = CompiledValidator(_user_firebase_schema)
 
 
 class Project(db.Model):
     """Tabla proyectos de la base de datos."""
-    project_id = db.Column(db.String, primary_key=True, default=generate_uuid)
+    project_id = db.Column(UUIDString, primary_key=True, default=generate_uuid)
     name = db.Column(db.String(100), nullable=False)
     desc = db.Column(db.String(300))
-    img = db.Column(db.TEXT, default="")
+    # Imagenes antiguas guardadas en linea, ver api.migrate_project_images
+    img = db.deferred(db.Column(db.TEXT))
+    # Hash de la imagen en el almacen de blobs
+    img_hash = db.Column(db.String(64))
+    # Cambia tambien cuando cambian sus tareas, trabajos o miembros (ver _touch_parents)
+    updated_at = db.Column(db.DateTime, default=_utcnow, onupdate=_utcnow)
+    # Version de cambios de la ultima escritura, para la sincronizacion (ver sync.py)
+    version = db.Column(db.BigInteger, nullable=False, server_default='0', index=True)
 
-    tasks = db.relationship('Task', backref=db.backref('project'))
-    invitations = db.relationship('Invitation', backref=db.backref('project'))
+    tasks = db.relationship('Task', backref=db.backref('project'), cascade='all', passive_deletes=True)
+    invitations = db.relationship('Invitation', backref=db.backref('project'), cascade='all', passive_deletes=True)
 
 
 _project_creation_schema = {
@@ -68,27 +116,29 @@ _project_creation_schema = {
     'desc': {'type': 'string', 'empty': False},
     'img': {'type': 'string', 'empty': False}
 }
-create_project_validator = Validator(_project_creation_schema)
+create_project_validator = CompiledValidator(_project_creation_schema)
 
 _project_update_schema = {
     'name': {'type': 'string', 'empty': False},
     'desc': {'type': 'string', 'empty': False},
     'img': {'type': 'string', 'empty': False}
 }
-update_project_validator = Validator(_project_update_schema)
+update_project_validator = CompiledValidator(_project_update_schema)
 
 
 class Task(db.Model):
-    task_id = db.Column(db.String, primary_key=True, default=generate_uuid)
+    task_id = db.Column(UUIDString, primary_key=True, default=generate_uuid)
     name = db.Column(db.String(100), nullable=False)
     desc = db.Column(db.String(300))
     due_date = db.Column(db.Date)
     init_date = db.Column(db.Date)
     expected = db.Column(db.Float(), default=0)
     progress = db.Column(db.Integer(), default=0)
+    updated_at = db.Column(db.DateTime, default=_utcnow, onupdate=_utcnow)
+    version = db.Column(db.BigInteger, nullable=False, server_default='0', index=True)
 
-    project_id = db.Column(db.String(50), db.ForeignKey('project.project_id'))
-    works = db.relationship('Work', backref=db.backref('task'))
+    project_id = db.Column(UUIDString, db.ForeignKey('project.project_id', ondelete='CASCADE'), index=True)
+    works = db.relationship('Work', backref=db.backref('task'), cascade='all', passive_deletes=True)
 
 
 _task_creation_schema = {
@@ -99,7 +149,7 @@ _task_creation_schema = {
     'expected': {'type': 'float', 'empty': False, 'min': 0},
     'progress': {'type': 'integer', 'empty': False, 'min': 0, 'max': 100}
 }
-create_task_validator = Validator(_task_creation_schema)
+create_task_validator = CompiledValidator(_task_creation_schema)
 
 _task_update_schema = {
     'name': {'type': 'string', 'empty': False},
@@ -109,37 +159,241 @@ _task_update_schema = {
     'expected': {'type': 'float', 'empty': False, 'min': 0},
     'progress': {'type': 'integer', 'empty': False, 'min': 0, 'max': 100}
 }
-update_task_validator = Validator(_task_update_schema)
+update_task_validator = CompiledValidator(_task_update_schema)
 
 
 class Work(db.Model):
-    work_id = db.Column(db.String, default=generate_uuid, nullable=False, unique=True)
+    __table_args__ = (db.Index('ix_work_user_id_date', 'user_id', 'date'),)
+
+    work_id = db.Column(UUIDString, default=generate_uuid, nullable=False, unique=True)
 
-    task_id = db.Column(db.String(50), db.ForeignKey('task.task_id'), primary_key=True)
-    user_id = db.Column(db.String(50), db.ForeignKey('user.user_id'), primary_key=True)
+    task_id = db.Column(UUIDString, db.ForeignKey('task.task_id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('user.user_id', ondelete='CASCADE'), primary_key=True)
 
     date = db.Column(db.Date, primary_key=True)
     time = db.Column(db.Float(), nullable=False)
+    updated_at = db.Column(db.DateTime, default=_utcnow, onupdate=_utcnow)
+    version = db.Column(db.BigInteger, nullable=False, server_default='0', index=True)
 
 
 _work_creation_schema = {
     'date': {'type': 'date', 'empty': False, 'coerce': _to_date, 'required': True},
     'time': {'type': 'float', 'empty': False, 'required': True}
 }
-create_work_validator = Validator(_work_creation_schema)
+create_work_validator = CompiledValidator(_work_creation_schema)
 
 _work_update_schema = {
     'time': {'type': 'float', 'empty': False, 'required': True}
 }
-update_work_validator = Validator(_work_update_schema)
+update_work_validator = CompiledValidator(_work_update_schema)
 
 
 class Invitation(db.Model):
     """Tabla de datos de invitaciones. Si se acepta una invitacion se añade el usuario como miembro del proyecto."""
     # TODO igual es buena idea poner quien manda la invitacion del usuario
-    invitation_id = db.Column(db.String, default=generate_uuid, nullable=False, unique=True)
-    user_id = db.Column(db.String(50), db.ForeignKey('user.user_id'), primary_key=True)
-    project_id = db.Column(db.String(50), db.ForeignKey('project.project_id'), primary_key=True)
+    invitation_id = db.Column(UUIDString, default=generate_uuid, nullable=False, unique=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('user.user_id', ondelete='CASCADE'), primary_key=True)
+    project_id = db.Column(UUIDString, db.ForeignKey('project.project_id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, server_default='0', index=True)
+
+
+class Tombstone(db.Model):
+    """Filas borradas, para que los clientes las borren tambien al sincronizar (ver sync.py).
+
+    entity es 'project', 'task', 'work', 'invitation' o 'member'; en los miembros
+    entity_id es el usuario. Borrar un proyecto o una tarea borra tambien sus hijos.
+    """
+    tombstone_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, index=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(UUIDString, nullable=False)
+    project_id = db.Column(UUIDString, index=True)
+
+
+class DeletionJob(db.Model):
+    """Borrados de proyectos en segundo plano (ver deletion.py).
+
+    Esta en la base de datos para que lo vean todos los workers y no se pierda si
+    se reinicia el proceso. Sin claves ajenas: el proyecto desaparece al acabar.
+    """
+    job_id = db.Column(UUIDString, primary_key=True, default=generate_uuid)
+    project_id = db.Column(UUIDString, nullable=False, index=True)
+    user_id = db.Column(UUIDString, nullable=False)
+    # pending, running, done o failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    total = db.Column(db.Integer)
+    deleted = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    # Cambia con cada lote; si deja de cambiar es que el proceso que lo borraba ha muerto
+    updated_at = db.Column(db.DateTime, nullable=False, default=_utcnow)
+
+    def to_dict(self):
+        """Estado del borrado para devolverlo en la API."""
+        progress = 0.0
+        if self.status == 'done':
+            progress = 1.0
+        elif self.total:
+            progress = round(min(self.deleted / self.total, 1.0), 4)
+        return {'job_id': self.job_id, 'project_id': self.project_id, 'status': self.status,
+                'total': self.total, 'deleted': self.deleted, 'progress': progress, 'error': self.error}
+
+
+def _parent(session, obj):
+    """Devuelve el objeto cuyo updated_at depende de obj (trabajo -> tarea -> proyecto)."""
+    if isinstance(obj, Work):
+        return obj.task or (obj.task_id and session.query(Task).get(obj.task_id))
+    if isinstance(obj, (Task, Invitation)):
+        return obj.project or (obj.project_id and session.query(Project).get(obj.project_id))
+    return None
+
+
+def _touch(session, obj, now):
+    """Actualiza updated_at de obj y de todos sus padres."""
+    while obj is not None:
+        obj.updated_at = now
+        obj = _parent(session, obj)
+
+
+def touch_tasks(task_ids):
+    """Actualiza updated_at y la version de unas tareas y sus proyectos tras escribir trabajos sin pasar por el ORM."""
+    changes = {'updated_at': _utcnow(), 'version': change_version()}
+    Task.query.filter(Task.task_id.in_(task_ids)).update(changes, synchronize_session=False)
+    Project.query.filter(Project.project_id.in_(db.session.query(Task.project_id).filter(Task.task_id.in_(task_ids)))) \
+        .update(changes, synchronize_session=False)
+
+
+def change_version(session=None):
+    """Version de cambios de la transaccion actual; la misma para todas sus escrituras.
+
+    En PostgreSQL es el id de la transaccion (txid_current). En el resto de motores
+    sale de la tabla change_counter, que queda bloqueada hasta el commit, asi que
+    las versiones siguen el orden de los commits.
+    """
+    session = session or db.session
+    if 'change_version' not in session.info:
+        if session.get_bind().dialect.name == 'postgresql':
+            version = session.execute('SELECT txid_current()').scalar()
+        else:
+            if session.execute(change_counter.update().values(version=change_counter.c.version + 1)).rowcount == 0:
+                session.execute(change_counter.insert().values(version=1))
+            version = session.execute(select([change_counter.c.version])).scalar()
+        session.info['change_version'] = version
+    return session.info['change_version']
+
+
+def change_token(session=None):
+    """Version a partir de la cual puede haber cambios que la transaccion actual todavia no ve.
+
+    Todas las escrituras con una version menor ya estan confirmadas (o descartadas).
+    """
+    session = session or db.session
+    if session.get_bind().dialect.name == 'postgresql':
+        return session.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())').scalar()
+    return (session.execute(select([change_counter.c.version])).scalar() or 0) + 1
+
+
+def add_tombstones(entity, query, version=None):
+    """Guarda como borradas las filas de una consulta (id, project_id), antes de borrarlas sin el ORM."""
+    query = query.add_columns(literal(version or change_version(), db.BigInteger), literal(entity))
+    db.session.execute(Tombstone.__table__.insert().from_select(['entity_id', 'project_id', 'version', 'entity'],
+                                                                query.statement))
+
+
+@event.listens_for(Session, 'before_flush')
+def _touch_parents(session, flush_context, instances):
+    """Mantiene updated_at al dia cuando cambian los hijos o los miembros, para los ETag."""
+    now = _utcnow()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (Task, Work, Invitation)):
+            _touch(session, _parent(session, obj), now)
+    for obj in list(session.dirty):
+        if isinstance(obj, (Project, Task, Work)) and session.is_modified(obj):
+            _touch(session, obj, now)
+        elif isinstance(obj, User):
+            added, _, deleted = attributes.get_history(obj, 'projects', passive=attributes.PASSIVE_NO_INITIALIZE)
+            for project in (added or []) + (deleted or []):
+                _touch(session, project, now)
+
+
+# Tablas con version de cambios y como se llaman en las lapidas
+_ENTITIES = {Project: 'project', Task: 'task', Work: 'work', Invitation: 'invitation'}
+
+
+def _entity_ids(session, obj):
+    """(id, project_id) de una fila de _ENTITIES, para su lapida."""
+    if isinstance(obj, Project):
+        return obj.project_id, obj.project_id
+    if isinstance(obj, Task):
+        return obj.task_id, obj.project_id
+    if isinstance(obj, Invitation):
+        return obj.invitation_id, obj.project_id
+    task = _parent(session, obj)
+    return obj.work_id, task.project_id if task is not None else None
+
+
+def _member_changes(session):
+    """Pares (usuario, proyecto) añadidos y quitados de project_member en este flush."""
+    added, removed = set(), set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            history = attributes.get_history(obj, 'projects', passive=attributes.PASSIVE_NO_INITIALIZE)
+            added.update((obj, project) for project in history.added or ())
+            removed.update((obj, project) for project in history.deleted or ())
+        elif isinstance(obj, Project):
+            history = attributes.get_history(obj, 'members', passive=attributes.PASSIVE_NO_INITIALIZE)
+            added.update((user, obj) for user in history.added or ())
+            removed.update((user, obj) for user in history.deleted or ())
+    return added, removed
+
+
+@event.listens_for(Session, 'before_flush')
+def _version_changes(session, flush_context, instances):
+    """Pone la version de cambios a las filas nuevas o modificadas y guarda lapidas de las borradas."""
+    changed = [obj for obj in session.new if isinstance(obj, tuple(_ENTITIES))]
+    changed += [obj for obj in session.dirty if isinstance(obj, tuple(_ENTITIES)) and session.is_modified(obj)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, tuple(_ENTITIES))]
+    added, removed = _member_changes(session)
+    if not (changed or deleted or added or removed):
+        return
+    version = change_version(session)
+    for obj in changed:
+        obj.version = version
+    for obj in deleted:
+        entity_id, project_id = _entity_ids(session, obj)
+        session.add(Tombstone(version=version, entity=_ENTITIES[type(obj)], entity_id=entity_id,
+                              project_id=project_id))
+    for user, project in removed:
+        session.add(Tombstone(version=version, entity='member', entity_id=user.user_id,
+                              project_id=project.project_id))
+    # Las filas de project_member las inserta el ORM; su version se pone despues
+    session.info['_added_members'] = added
+
+
+@event.listens_for(Session, 'after_flush')
+def _version_members(session, flush_context):
+    """Pone la version de cambios a las filas de project_member recien insertadas."""
+    added = session.info.pop('_added_members', None)
+    for user, project in added or ():
+        session.execute(project_member.update()
+                        .where(and_(project_member.c.user_id == user.user_id,
+                                    project_member.c.project_id == project.project_id))
+                        .values(version=change_version(session)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_change_version(session):
+    """La siguiente transaccion tendra otra version de cambios.
+
+    Al liberar un SAVEPOINT se sigue en la misma transaccion y con la misma version.
+    """
+    if not session.transaction.nested:
+        session.info.pop('change_version', None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_version(session):
+    """Tras un rollback, aunque sea de un SAVEPOINT, la version puede no existir ya."""
+    session.info.pop('change_version', None)
 
 
 class UserSchema(ma.ModelSchema):
@@ -159,12 +413,21 @@ class ProjectSchema(ma.ModelSchema):
 
     class Meta:
         model = Project
+        exclude = ('img', 'version')
+
+    img_url = ma.Method('get_img_url')
 
     _links = ma.Hyperlinks(
         {"self": ma.URLFor("project_api.get_one_project", project_id="<project_id>"),
          "collection": ma.URLFor("project_api.get_user_projects")}
     )
 
+    def get_img_url(self, obj):
+        """URL de la imagen del proyecto, versionada con su hash."""
+        if not obj.img_hash:
+            return None
+        return url_for("project_api.get_project_img", project_id=obj.project_id, v=obj.img_hash)
+
 
 class TaskSchema(ma.ModelSchema):
     """Esquema para la clase proyectos."""
@@ -173,6 +436,7 @@ class TaskSchema(ma.ModelSchema):
         # TODO date
         # https://stackoverflow.com/questions/35795622/short-way-to-serialize-datetime-with-marshmallow
         model = Task
+        exclude = ('version',)
 
     _links = ma.Hyperlinks(
         {"self": ma.URLFor("task_api.get_one_task", task_id="<task_id>"),
@@ -185,6 +449,7 @@ class WorkSchema(ma.ModelSchema):
 
     class Meta:
         model = Work
+        exclude = ('version',)
 
     _links = ma.Hyperlinks(
         {"self": ma.URLFor("work_api.get_one_work", work_id="<work_id>"),
@@ -197,11 +462,7 @@ class InvitationSchema(ma.ModelSchema):
 
     class Meta:
         model = Invitation
-
-    _links = ma.Hyperlinks(
-        {"self": ma.URLFor("invitation_api.get_one_invitation", invitation_id="<invitation_id>"),
-         "collection": ma.URLFor("invitation_api.get_all_invitations")}
-    )
+        exclude = ('version',)
 
 
 user_schema = UserSchema()
@@ -0,0 +1,136 @@
+from threading import Lock, Thread
+import json
+import os
+import queue
+import time
+
+FCM_URL = "https://fcm.googleapis.com/fcm/send"
+FCM_SERVER_KEY = "AAAAlWsV5Ew:APA91bGtFKoXq3uzfnuvAtqJslXWzXpujpEJDeZTrjVXufRvMlX05U_Pbk9JPtoa1b0-OYxZ8PBQz5oJFaRDyWkz5WJR3VpQASdzpzTqJ1FZxry1y4_s0BZAIL2bfICOAj46xwcuK84Q"
+
+
+class Notifier(object):
+    """Envia notificaciones push a firebase desde una cola y un grupo de hilos.
+
+    Las peticiones solo encolan, asi que un servidor push lento no bloquea a los
+    workers. Los mensajes pendientes con los mismos datos se envian juntos
+    (registration_ids) y los fallos de red o 5xx se reintentan con espera exponencial.
+    Configuracion: FCM_URL, FCM_SERVER_KEY, FCM_WORKERS, FCM_TIMEOUT, FCM_RETRIES.
+    """
+
+    def __init__(self, url=FCM_URL, server_key=FCM_SERVER_KEY, workers=2, timeout=5, retries=3,
+                 backoff=0.5, batch_size=100):
+        self.url = url
+        self.server_key = server_key
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._pid = None
+        self._session = None
+        self._stats = {'sent': 0, 'failed': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+    def init_app(self, app):
+        """Lee la configuracion de la aplicacion."""
+        self.url = app.config.get('FCM_URL', self.url)
+        self.server_key = app.config.get('FCM_SERVER_KEY', self.server_key)
+        self.workers = app.config.get('FCM_WORKERS', self.workers)
+        self.timeout = app.config.get('FCM_TIMEOUT', self.timeout)
+        self.retries = app.config.get('FCM_RETRIES', self.retries)
+
+    def send(self, token, data):
+        """Encola una notificacion para el token de firebase dado. No bloquea."""
+        if not token:
+            return False
+        self._start()
+        self._queue.put((time.monotonic(), token, data))
+        return True
+
+    def join(self):
+        """Espera a que se hayan procesado todas las notificaciones encoladas."""
+        self._queue.join()
+
+    def stats(self):
+        """Metricas de la cola: profundidad, enviadas, fallidas y latencia (segundos)."""
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats['sent'] + stats['failed']
+        stats['queue_depth'] = self._queue.qsize()
+        stats['latency_avg'] = stats['latency_total'] / done if done else 0.0
+        return stats
+
+    def _start(self):
+        """Arranca los hilos la primera vez que se usa en cada proceso (tambien tras un fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # requests se importa la primera vez que se envia algo, no al arrancar cada worker
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+            for _ in range(self.workers):
+                Thread(target=self._run, daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        """Bucle de cada hilo: coge un lote de la cola y lo envia agrupado por datos."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(json.dumps(item[2], sort_keys=True), []).append(item)
+            for items in groups.values():
+                self._deliver(items)
+
+            for _ in batch:
+                self._queue.task_done()
+
+    def _deliver(self, items):
+        """Envia un mensaje a todos los tokens del grupo, reintentando si falla."""
+        import requests
+        tokens = [token for _, token, _ in items]
+        body = {'data': items[0][2]}
+        if len(tokens) == 1:
+            body['to'] = tokens[0]
+        else:
+            body['registration_ids'] = tokens
+        headers = {
+            "Authorization": "key=" + self.server_key,
+            "Content-Type": "application/json"
+        }
+
+        ok = False
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._session.post(self.url, data=json.dumps(body), headers=headers, timeout=self.timeout)
+                ok = response.status_code < 400
+                if response.status_code < 500:
+                    break
+            except requests.RequestException:
+                pass
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+
+        now = time.monotonic()
+        with self._lock:
+            self._stats['sent' if ok else 'failed'] += len(items)
+            for queued_at, _, _ in items:
+                latency = now - queued_at
+                self._stats['latency_total'] += latency
+                self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+
+
+notifier = Notifier()
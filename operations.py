@@ -0,0 +1,21 @@
+from flask import jsonify
+from model import db
+
+# Las operaciones de escritura (create_task_operation, create_work_operation...) hacen los
+# cambios en la transaccion actual sin confirmarla y devuelven (respuesta, codigo, tras el commit).
+# "Tras el commit" es None o una funcion sin argumentos, normalmente para invalidar la cache de
+# respuestas. Asi las usan tanto sus endpoints como los lotes (ver batch.py).
+
+
+def succeeded(status):
+    """Si el codigo de una operacion es de exito."""
+    return status < 400
+
+
+def commit_operation(output, status, after_commit):
+    """Confirma la operacion si ha ido bien y devuelve su respuesta."""
+    if succeeded(status):
+        db.session.commit()
+        if after_commit is not None:
+            after_commit()
+    return jsonify(output), status
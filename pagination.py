@@ -0,0 +1,82 @@
+from flask import request, jsonify, make_response, abort, url_for
+from sqlalchemy import tuple_
+import base64
+import datetime
+import json
+
+from model import db
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def _encode_cursor(item, columns, direction):
+    """Genera un cursor opaco con la clave del elemento y la direccion."""
+    key = []
+    for column in columns:
+        value = getattr(item, column.key)
+        key.append(value.isoformat() if isinstance(value, datetime.date) else value)
+    raw = json.dumps({'k': key, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor, columns):
+    """Devuelve (clave, direccion) de un cursor. Aborta con 400 si esta mal formado."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        key, direction = data['k'], data['d']
+        if len(key) != len(columns) or direction not in ('next', 'prev'):
+            raise ValueError(cursor)
+        values = []
+        for column, value in zip(columns, key):
+            if isinstance(column.type, db.Date):
+                value = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            values.append(value)
+        return values, direction
+    except Exception:
+        abort(make_response(jsonify({'message': 'Bad cursor!'}), 400))
+
+
+def _page_url(cursor, limit):
+    """URL de la misma peticion apuntando a otra pagina."""
+    args = dict(request.view_args or {})
+    args.update({'cursor': cursor, 'limit': limit})
+    return url_for(request.endpoint, **args)
+
+
+def paginate(query, *columns):
+    """Pagina una consulta por keyset sobre las columnas dadas (deben ser unicas e indexadas).
+
+    Lee `limit` y `cursor` de la peticion y devuelve (elementos, links), donde
+    links tiene las URLs `next` y `prev` (None si no hay mas paginas).
+    """
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    cursor = request.args.get('cursor')
+
+    direction = 'next'
+    if cursor:
+        key, direction = _decode_cursor(cursor, columns)
+        if direction == 'next':
+            query = query.filter(tuple_(*columns) > tuple_(*key))
+        else:
+            query = query.filter(tuple_(*columns) < tuple_(*key))
+
+    if direction == 'next':
+        items = query.order_by(*columns).limit(limit + 1).all()
+    else:
+        items = query.order_by(*[column.desc() for column in columns]).limit(limit + 1).all()
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    if direction == 'prev':
+        items.reverse()
+
+    has_next = has_more if direction == 'next' else bool(cursor)
+    has_prev = bool(cursor) if direction == 'next' else has_more
+
+    links = {'next': None, 'prev': None}
+    if items and has_next:
+        links['next'] = _page_url(_encode_cursor(items[-1], columns, 'next'), limit)
+    if items and has_prev:
+        links['prev'] = _page_url(_encode_cursor(items[0], columns, 'prev'), limit)
+    return items, links
@@ -0,0 +1,102 @@
+from threading import Lock
+
+from flask import request, current_app, jsonify
+
+from cache import MemoryCache, RedisCache
+
+
+class PayloadCache(object):
+    """Cache de lectura de las respuestas ya serializadas de proyectos, tareas y trabajos.
+
+    Hay una entrada por entidad, p.e. ('tasks', project_id), con la version de
+    cambios de la fila (ver model.change_version) y una respuesta por cada
+    combinacion de argumentos de la peticion (?fields=, ?cursor=...), hasta
+    PAYLOAD_CACHE_VARIANTS. Si la version de la base de datos ya es otra la
+    entrada no vale, asi que nunca se devuelve nada antiguo; ademas las escrituras
+    borran las entradas afectadas (invalidate_project, invalidate_task).
+    Configuracion: PAYLOAD_CACHE_ENABLED, PAYLOAD_CACHE_SIZE, PAYLOAD_CACHE_TTL,
+    PAYLOAD_CACHE_VARIANTS y PAYLOAD_CACHE_URL (redis://..., compartida entre workers).
+    """
+
+    def __init__(self):
+        self.backend = MemoryCache(maxsize=4096, ttl=300)
+        self._lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def init_app(self, app):
+        """Lee la configuracion y crea el backend."""
+        app.config.setdefault('PAYLOAD_CACHE_ENABLED', True)
+        app.config.setdefault('PAYLOAD_CACHE_SIZE', 4096)
+        app.config.setdefault('PAYLOAD_CACHE_TTL', 300)
+        app.config.setdefault('PAYLOAD_CACHE_VARIANTS', 16)
+        app.config.setdefault('PAYLOAD_CACHE_URL', None)
+        if app.config['PAYLOAD_CACHE_URL']:
+            self.set_backend(RedisCache(app.config['PAYLOAD_CACHE_URL'], ttl=app.config['PAYLOAD_CACHE_TTL'],
+                                        prefix='payload:'))
+        else:
+            self.set_backend(MemoryCache(maxsize=app.config['PAYLOAD_CACHE_SIZE'],
+                                         ttl=app.config['PAYLOAD_CACHE_TTL']))
+
+    def set_backend(self, backend):
+        """Cambia el backend de la cache (necesita get, set y delete)."""
+        self.backend = backend
+
+    def stats(self):
+        """Aciertos y fallos desde que arranco el proceso."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        """Suma un acierto o un fallo."""
+        with self._lock:
+            self._stats[name] += 1
+
+    def load(self, kind, entity_id, version, build):
+        """Cuerpo JSON de la entidad en esa version, llamando a build() si no esta en cache.
+
+        Se guarda el texto que genera jsonify y no el diccionario: asi vale para
+        cualquier backend (RedisCache guarda JSON y no sabe de fechas) y la
+        respuesta es identica tanto si viene de la cache como si no.
+        """
+        if not current_app.config.get('PAYLOAD_CACHE_ENABLED', True):
+            return jsonify(build()).get_data(as_text=True)
+        key = '%s:%s' % (kind, entity_id)
+        variant = '%s?%s' % (request.script_root, request.query_string.decode('utf-8'))
+        entry = self.backend.get(key)
+        if entry is not None and entry['version'] == version and variant in entry['variants']:
+            self._count('hits')
+            return entry['variants'][variant]
+
+        self._count('misses')
+        body = jsonify(build()).get_data(as_text=True)
+        # Una copia: la entrada puede estar leyendola otra peticion
+        variants = dict(entry['variants']) if entry is not None and entry['version'] == version else {}
+        if len(variants) < current_app.config.get('PAYLOAD_CACHE_VARIANTS', 16):
+            variants[variant] = body
+            self.backend.set(key, {'version': version, 'variants': variants})
+        return body
+
+    def response(self, kind, entity_id, version, build):
+        """Respuesta JSON de la entidad en esa version (ver load)."""
+        return current_app.response_class(self.load(kind, entity_id, version, build),
+                                          mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+    def invalidate(self, kind, entity_id):
+        """Borra la entrada de una entidad."""
+        self.backend.delete('%s:%s' % (kind, entity_id))
+
+
+payload_cache = PayloadCache()
+
+
+def invalidate_project(project_id):
+    """Borra de la cache el proyecto y su lista de tareas. Llamar tras cambiar el proyecto o sus miembros."""
+    payload_cache.invalidate('project', project_id)
+    payload_cache.invalidate('tasks', project_id)
+
+
+def invalidate_task(task_id, project_id):
+    """Borra de la cache la tarea, sus trabajos y su proyecto. Llamar tras cambiar la tarea o sus trabajos."""
+    payload_cache.invalidate('task', task_id)
+    payload_cache.invalidate('works', task_id)
+    invalidate_project(project_id)
@@ -0,0 +1,63 @@
+from flask import g, has_app_context
+from sqlalchemy import and_, exists
+from model import db, project_member, Task, Work
+
+
+def _memo():
+    """Devuelve el diccionario de permisos ya calculados en esta peticion."""
+    if not has_app_context():
+        return {}
+    if '_membership' not in g:
+        g._membership = {}
+    return g._membership
+
+
+def _check(key, clause):
+    """Ejecuta un EXISTS sobre project_member y guarda el resultado en la peticion."""
+    memo = _memo()
+    if key not in memo:
+        memo[key] = db.session.query(exists().where(clause)).scalar()
+    return memo[key]
+
+
+def forget_membership():
+    """Olvida los permisos calculados, p.e. tras cambiar los miembros de un proyecto."""
+    _memo().clear()
+
+
+def is_project_member(user, project_id):
+    """Comprueba si el usuario es miembro del proyecto."""
+    return _check(('project', user.user_id, project_id),
+                  and_(project_member.c.user_id == user.user_id,
+                       project_member.c.project_id == project_id))
+
+
+def is_task_member(user, task_id):
+    """Comprueba si el usuario es miembro del proyecto de la tarea."""
+    return _check(('task', user.user_id, task_id),
+                  and_(project_member.c.user_id == user.user_id,
+                       project_member.c.project_id == Task.project_id,
+                       Task.task_id == task_id))
+
+
+def is_work_member(user, work_id):
+    """Comprueba si el usuario es miembro del proyecto de la tarea del trabajo."""
+    return _check(('work', user.user_id, work_id),
+                  and_(project_member.c.user_id == user.user_id,
+                       project_member.c.project_id == Task.project_id,
+                       Task.task_id == Work.task_id,
+                       Work.work_id == work_id))
+
+
+def member_task_ids(user, task_ids):
+    """Devuelve cuales de las tareas dadas son de proyectos del usuario, con una sola consulta."""
+    memo = _memo()
+    task_ids = set(task_ids)
+    pending = [task_id for task_id in task_ids if ('task', user.user_id, task_id) not in memo]
+    if pending:
+        found = {task_id for (task_id,) in db.session.query(Task.task_id)
+                 .join(project_member, project_member.c.project_id == Task.project_id)
+                 .filter(project_member.c.user_id == user.user_id, Task.task_id.in_(pending))}
+        for task_id in pending:
+            memo[('task', user.user_id, task_id)] = task_id in found
+    return {task_id for task_id in task_ids if memo[('task', user.user_id, task_id)]}
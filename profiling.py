@@ -0,0 +1,240 @@
+from threading import Lock
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import time
+
+from flask import Blueprint, g, has_request_context, jsonify, request, send_file, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import jwt
+
+from decorators import token_required, admin_required, _load_user
+from model import generate_uuid
+
+profile_api = Blueprint('profile_api', __name__)
+
+# Cabecera con la que un administrador pide que se perfile su peticion
+PROFILE_HEADER = 'X-Profile'
+
+_PROFILE_ID = re.compile(r'^[0-9a-f-]{36}$')
+
+
+class Profiler(object):
+    """Perfilado bajo demanda de peticiones lentas.
+
+    Se perfila una peticion si la hace un administrador con la cabecera
+    X-Profile: 1, o al azar con probabilidad PROFILE_SAMPLE_RATE (0 por defecto).
+    Se guarda el perfil de cProfile y cada sentencia SQL con su duracion; las
+    SELECT que tardan mas de PROFILE_EXPLAIN_MS llevan ademas su plan (EXPLAIN).
+    Los resultados van a PROFILE_DIR (instance/profiles por defecto) y solo se
+    guardan los ultimos PROFILE_MAX_FILES.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """Lee la configuracion y registra los hooks de la aplicacion y de SQLAlchemy."""
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_EXPLAIN_MS', 100)
+        app.config.setdefault('PROFILE_MAX_FILES', 50)
+        app.config.setdefault('PROFILE_DIR', None)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def directory(self):
+        """Directorio donde se guardan los perfiles."""
+        return current_app.config['PROFILE_DIR'] or os.path.join(current_app.instance_path, 'profiles')
+
+    def _trigger(self):
+        """Motivo para perfilar la peticion actual ('header' o 'sample'), o None."""
+        if request.headers.get(PROFILE_HEADER) == '1' and 'x-access-token' in request.headers:
+            try:
+                data = jwt.decode(request.headers['x-access-token'], current_app.config['SECRET_KEY'])
+                user = _load_user(data['user_id'])
+                admin = user is not None and user.admin
+            except Exception:
+                admin = False
+            if admin:
+                return 'header'
+        rate = current_app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            return 'sample'
+        return None
+
+    def _before_request(self):
+        """Empieza a perfilar si toca."""
+        trigger = self._trigger()
+        if trigger is None:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None  # ya hay otro perfilador activo en este proceso
+        g._profile = {'trigger': trigger, 'start': time.perf_counter(), 'profile': profile, 'queries': [],
+                      'explain_ms': current_app.config['PROFILE_EXPLAIN_MS']}
+
+    def _after_request(self, response):
+        """Para el perfilador y guarda el resultado."""
+        state = g.pop('_profile', None)
+        if state is None:
+            return response
+        profile = state['profile']
+        if profile is not None:
+            profile.disable()
+        record = {
+            'profile_id': generate_uuid(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'trigger': state['trigger'],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': (time.perf_counter() - state['start']) * 1000,
+            'queries': state['queries'],
+        }
+        record['db_ms'] = sum(query['duration_ms'] for query in record['queries'])
+        if profile is not None:
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(50)
+            record['profile'] = text.getvalue()
+        self._save(record, profile)
+        response.headers['X-Profile-Id'] = record['profile_id']
+        return response
+
+    def _save(self, record, profile):
+        """Escribe el perfil en disco y borra los mas antiguos (buffer circular)."""
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp, os.path.join(directory, record['profile_id'] + '.json'))
+        if profile is not None:
+            profile.dump_stats(os.path.join(directory, record['profile_id'] + '.prof'))
+        with self._lock:
+            for old in self.list()[current_app.config['PROFILE_MAX_FILES']:]:
+                for extension in ('.json', '.prof'):
+                    try:
+                        os.remove(os.path.join(directory, old + extension))
+                    except OSError:
+                        pass
+
+    def list(self):
+        """Ids de los perfiles guardados, del mas reciente al mas antiguo."""
+        directory = self.directory()
+        if not os.path.isdir(directory):
+            return []
+        found = []
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                try:
+                    found.append((os.path.getmtime(os.path.join(directory, name)), name[:-len('.json')]))
+                except OSError:
+                    pass  # borrado mientras tanto por otra peticion
+        return [profile_id for _, profile_id in sorted(found, reverse=True)]
+
+    def path(self, profile_id, extension='.json'):
+        """Ruta de un perfil guardado, o None si no existe."""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory(), profile_id + extension)
+        return path if os.path.exists(path) else None
+
+    def load(self, profile_id):
+        """Devuelve un perfil guardado, o None si no existe."""
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+def _explain(conn, statement, parameters):
+    """Plan de una SELECT, ejecutado directamente en el cursor para no pasar por estos mismos eventos."""
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    try:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception as e:
+        return ['EXPLAIN failed: %s' % e]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Apunta cuando empieza una sentencia SQL."""
+    conn.info['_profile_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Guarda la sentencia en el perfil de la peticion, con su plan si ha sido lenta."""
+    start = conn.info.pop('_profile_start', None)
+    if start is None or not has_request_context():
+        return
+    state = g.get('_profile')
+    if state is None:
+        return
+    duration_ms = (time.perf_counter() - start) * 1000
+    query = {'statement': statement, 'parameters': repr(parameters)[:1000], 'duration_ms': duration_ms}
+    if (duration_ms > state['explain_ms'] and not executemany
+            and statement.lstrip().upper().startswith(('SELECT', 'WITH'))):
+        query['explain'] = _explain(conn, statement, parameters)
+    state['queries'].append(query)
+
+
+profiler = Profiler()
+
+
+@profile_api.route('/api/v1/profiles', methods=['GET'])
+@token_required
+@admin_required
+def get_profiles(current_user):
+    """Devuelve los perfiles guardados, del mas reciente al mas antiguo."""
+    output = []
+    for profile_id in profiler.list():
+        record = profiler.load(profile_id)
+        if record:
+            output.append({key: record[key] for key in ('profile_id', 'date', 'trigger', 'method', 'path',
+                                                        'status', 'duration_ms', 'db_ms')})
+            output[-1]['queries'] = len(record['queries'])
+    return jsonify({'profiles': output})
+
+
+@profile_api.route('/api/v1/profiles/<profile_id>', methods=['GET'])
+@token_required
+@admin_required
+def get_one_profile(current_user, profile_id):
+    """Devuelve un perfil con sus consultas y el resumen de cProfile."""
+    record = profiler.load(profile_id)
+
+    if not record:
+        return jsonify({'message': 'No profile found!'}), 404
+
+    return jsonify({'profile': record})
+
+
+@profile_api.route('/api/v1/profiles/<profile_id>/pstats', methods=['GET'])
+@token_required
+@admin_required
+def download_profile(current_user, profile_id):
+    """Descarga el perfil de cProfile, para abrirlo con pstats o snakeviz."""
+    path = profiler.path(profile_id, '.prof')
+
+    if not path:
+        return jsonify({'message': 'No profile found!'}), 404
+
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     attachment_filename=profile_id + '.prof')
@@ -1,30 +1,50 @@
-from flask import Blueprint, jsonify
-from model import Project, projects_schema, db, User, project_schema, create_project_validator, update_project_validator
-from decorators import token_required, admin_required, load_data
-import json
-import requests
+from flask import Blueprint, jsonify, request, Response, url_for
+from model import Project, db, User, create_project_validator, update_project_validator
+from serializers import dump_project, dump_projects, loading_plan
+from decorators import token_required, admin_required, load_data, is_admin
+from blobstore import get_blob_store
+from conditional import make_etag, not_modified, with_etag
+from pagination import paginate
+from streaming import wants_stream, stream_json
+from permissions import is_project_member, forget_membership
+from notifications import notifier
+from deletion import delete_project_rows, remove_project_member, start_project_deletion, get_deletion_job
+from payloads import payload_cache, invalidate_project
+from compression import compressor
 
 
 project_api = Blueprint('project_api', __name__)
 
 
+def _store_img(data):
+    """Guarda la imagen recibida en el almacen de blobs y deja solo su hash en los datos."""
+    if 'img' in data:
+        data['img_hash'] = get_blob_store().put(data.pop('img').encode('utf-8'))
+    return data
+
+
 @project_api.route('/api/v1/projects/all', methods=['GET'])
 @token_required
 @admin_required
 def get_all_projects(current_user):
     """Devolver todos los proyectos."""
-    projects = Project.query.all()
-    output = projects_schema.dump(projects)
-    return jsonify({"projects": output.data})
+    if wants_stream():
+        return stream_json('projects', Project.query.options(*loading_plan(Project)).order_by(Project.project_id),
+                           dump_projects)
+
+    projects, links = paginate(Project.query.options(*loading_plan(Project)), Project.project_id)
+    output = dump_projects(projects)
+    return jsonify({"projects": output, "_links": links})
 
 
 @project_api.route('/api/v1/projects', methods=['GET'])
 @token_required
 def get_user_projects(current_user):
     """Devolver todos los proyectos."""
-    projects = current_user.projects
-    output = projects_schema.dump(projects)
-    return jsonify({"projects": output.data})
+    projects, links = paginate(Project.query.with_parent(current_user, 'projects').options(*loading_plan(Project)),
+                               Project.project_id)
+    output = dump_projects(projects)
+    return jsonify({"projects": output, "_links": links})
 
 
 @project_api.route('/api/v1/projects', methods=['POST'])
@@ -32,14 +52,15 @@ def get_user_projects(current_user):
 @load_data
 def create_project(data, current_user: User):
     """Crea un proyecto."""
-    if create_project_validator.validate(data):
-        project = Project(**data)
+    _, errors = create_project_validator.validate(data)
+    if not errors:
+        project = Project(**_store_img(data))
         db.session.add(project)
         current_user.projects.append(project)
         db.session.commit()
-        return jsonify({'message': 'New project created!', 'project': project_schema.dump(project).data}), 201
+        return jsonify({'message': 'New project created!', 'project': dump_project(project)}), 201
     else:
-        return jsonify({'message': 'Project not created!', 'errors': create_project_validator.errors}), 400
+        return jsonify({'message': 'Project not created!', 'errors': errors}), 400
 
 
 @project_api.route('/api/v1/projects/<project_id>', methods=['DELETE'])
@@ -51,29 +72,66 @@ def delete_project(current_user, project_id):
     if not project:
         return jsonify({'message': 'No project found!'}), 404
 
-    if current_user not in project.members:
+    if not is_project_member(current_user, project.project_id):
         return jsonify({'message': 'You don\'t have permission to delete that project!'}), 403
 
-    project.members.remove(current_user)
-    if len(project.members) == 0:
-        db.session.delete(project)
+    if not remove_project_member(project.project_id, current_user.user_id):
+        if request.args.get('background') == '1':
+            # Para proyectos muy grandes: se borra por lotes y se consulta el progreso
+            job = start_project_deletion(project.project_id, current_user.user_id)
+            forget_membership()
+            invalidate_project(project_id)
+            return jsonify({'message': 'The project is being deleted!', 'job': job.to_dict(),
+                            '_links': {'job': url_for('project_api.get_deletion', job_id=job.job_id)}}), 202
+        delete_project_rows(project.project_id)
     db.session.commit()
+    forget_membership()
+    invalidate_project(project_id)
     return jsonify({'message': 'The project has been deleted!'})
 
 
+@project_api.route('/api/v1/deletions/<job_id>', methods=['GET'])
+@token_required
+def get_deletion(current_user, job_id):
+    """Devuelve el progreso del borrado de un proyecto en segundo plano."""
+    job = get_deletion_job(job_id)
+
+    if not job:
+        return jsonify({'message': 'No deletion found!'}), 404
+
+    if job.user_id != current_user.user_id:
+        admin = is_admin(current_user)
+        if admin is None:
+            return jsonify({'message': 'Wrong token!'}), 401
+        if not admin:
+            return jsonify({'message': 'You don\'t have permission to access this deletion!'}), 403
+
+    return jsonify({'job': job.to_dict()})
+
+
 @project_api.route('/api/v1/projects/<project_id>', methods=['GET'])
 @token_required
 def get_one_project(current_user, project_id):
     """Devuelve un proyecto."""
-    project = Project.query.filter_by(project_id=project_id).first()
+    version = db.session.query(Project.updated_at, Project.version).filter_by(project_id=project_id).first()
 
-    if not project:
+    if not version:
         return jsonify({'message': 'No project found!'}), 404
 
-    if current_user not in project.members:
+    if not is_project_member(current_user, project_id):
         return jsonify({'message': 'You don\'t have permission to delete that project!'}), 403
 
-    return jsonify({'project': project_schema.dump(project).data})
+    etag = make_etag(project_id, version.updated_at)
+    cached = not_modified(etag, version.updated_at)
+    if cached:
+        return cached
+
+    def build():
+        project = Project.query.filter_by(project_id=project_id).options(*loading_plan(Project)).first()
+        return {'project': dump_project(project)}
+
+    return with_etag(payload_cache.response('project', project_id, version.version, build),
+                     etag, version.updated_at)
 
 
 @project_api.route('/api/v1/projects/<project_id>', methods=['POST'])
@@ -86,16 +144,52 @@ def update_project(data, current_user, project_id):
     if not project:
         return jsonify({'message': 'No project found!'}), 404
 
-    if current_user not in project.members:
+    if not is_project_member(current_user, project.project_id):
         return jsonify({'message': 'You don\'t have permission to delete that project!'}), 403
 
-    if update_project_validator.validate(data):
-        for key, value in data.items():
+    _, errors = update_project_validator.validate(data)
+    if not errors:
+        for key, value in _store_img(data).items():
             setattr(project, key, value)
         db.session.commit()
-        return jsonify({'message': 'Project updated!', 'project': project_schema.dump(project).data}), 200
+        invalidate_project(project_id)
+        return jsonify({'message': 'Project updated!', 'project': dump_project(project)}), 200
+    else:
+        return jsonify({'message': 'Project not updated!', 'errors': errors}), 400
+
+
+@project_api.route('/api/v1/projects/<project_id>/img', methods=['GET'])
+@token_required
+@compressor.exempt  # sin comprimir, para que el ETag siga siendo el hash de la imagen (fuerte)
+def get_project_img(current_user, project_id):
+    """Devuelve la imagen de un proyecto. Si se pide con ?v=<hash> se puede cachear indefinidamente."""
+    project = db.session.query(Project.project_id, Project.img_hash).filter_by(project_id=project_id).first()
+
+    if not project:
+        return jsonify({'message': 'No project found!'}), 404
+
+    if not is_project_member(current_user, project.project_id):
+        return jsonify({'message': 'You don\'t have permission to access that project!'}), 403
+
+    if not project.img_hash:
+        return jsonify({'message': 'No image found!'}), 404
+
+    if request.args.get('v') == project.img_hash:
+        cache_control = 'private, max-age=31536000, immutable'
     else:
-        return jsonify({'message': 'Project not updated!', 'errors': update_project_validator.errors}), 400
+        cache_control = 'private, no-cache'
+
+    if request.if_none_match.contains_weak(project.img_hash):
+        response = Response(status=304)
+    else:
+        img = get_blob_store().get(project.img_hash)
+        if img is None:
+            return jsonify({'message': 'No image found!'}), 404
+        response = Response(img, mimetype='text/plain')
+
+    response.set_etag(project.img_hash)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 
 @project_api.route('/api/v1/projects/<project_id>/invite/<user_email>', methods=['PUT'])
@@ -110,7 +204,7 @@ def create_invitation(current_user, project_id, user_email):
     if not project:
         return jsonify({'message': 'No project found!'}), 404
 
-    if current_user not in project.members:
+    if not is_project_member(current_user, project.project_id):
         return jsonify({'message': 'You don\'t have permission to access that project!'}), 403
 
     user = User.query.filter_by(email=user_email).first()
@@ -125,24 +219,14 @@ def create_invitation(current_user, project_id, user_email):
     project.members.append(user)
 
     db.session.commit()
-
-    # Conecta al servidor firebase
-    firebase_server_token = "AAAAlWsV5Ew:APA91bGtFKoXq3uzfnuvAtqJslXWzXpujpEJDeZTrjVXufRvMlX05U_Pbk9JPtoa1b0-OYxZ8PBQz5oJFaRDyWkz5WJR3VpQASdzpzTqJ1FZxry1y4_s0BZAIL2bfICOAj46xwcuK84Q"
-    headers = {
-        "Authorization": "key=" + firebase_server_token,
-        "Content-Type": "application/json"
-    }
-    print(str(headers))
-    body = {
-        "data": {
-            "message": "New project member",
-            "project": project.name,
-            "user": current_user.name
-        },
-        "to": user.firebase_token
-    }
-    response = requests.post("https://fcm.googleapis.com/fcm/send", data=json.dumps(body), headers=headers)
-    print(user.firebase_token)
-    print(str(response.status_code))
+    forget_membership()
+    invalidate_project(project_id)
+
+    # Se envia en segundo plano, ver notifications.Notifier
+    notifier.send(user.firebase_token, {
+        "message": "New project member",
+        "project": project.name,
+        "user": current_user.name
+    })
 
     return jsonify({"message": "User is part of project!"})
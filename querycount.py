@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from model import db
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Cuenta las sentencias SQL ejecutadas dentro del bloque.
+
+    with count_queries() as statements:
+        ...
+    len(statements)
+    """
+    engine = engine or db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """Falla con AssertionError si el bloque ejecuta mas de `limit` sentencias SQL."""
+    with count_queries(engine) as statements:
+        yield statements
+    if len(statements) > limit:
+        raise AssertionError('%d queries executed, expected at most %d:\n%s'
+                             % (len(statements), limit, '\n'.join(statements)))
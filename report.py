@@ -0,0 +1,104 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func, cast
+from model import db, Project, Task, Work, _to_date
+from decorators import token_required
+from permissions import is_project_member
+import datetime
+
+
+report_api = Blueprint('report_api', __name__)
+
+DIMENSIONS = ('task', 'user', 'day', 'week', 'month')
+
+
+def _period(period):
+    """Expresion SQL que agrupa la fecha de un trabajo por dia, semana (lunes) o mes."""
+    if period == 'day':
+        return Work.date
+    if db.session.get_bind().dialect.name == 'sqlite':
+        if period == 'week':
+            return func.date(Work.date, '-6 days', 'weekday 1')
+        return func.strftime('%Y-%m-01', Work.date)
+    return cast(func.date_trunc(period, Work.date), db.Date)
+
+
+def _dimension(name):
+    """Columna por la que agrupar segun el nombre pedido."""
+    if name == 'task':
+        return Work.task_id
+    if name == 'user':
+        return Work.user_id
+    return _period(name)
+
+
+def _value(value):
+    """Convierte las fechas a ISO para que el JSON sea compacto y estable."""
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def filter_date_range(query):
+    """Aplica a una consulta de trabajos los filtros opcionales ?from=YYYY-MM-DD y ?to=YYYY-MM-DD."""
+    if request.args.get('from'):
+        query = query.filter(Work.date >= _to_date(request.args['from']).date())
+    if request.args.get('to'):
+        query = query.filter(Work.date <= _to_date(request.args['to']).date())
+    return query
+
+
+@report_api.route('/api/v1/projects/<project_id>/report', methods=['GET'])
+@token_required
+def get_project_report(current_user, project_id):
+    """Horas trabajadas en un proyecto agrupadas por ?by=task,user,day,week,month."""
+    project = Project.query.filter_by(project_id=project_id).first()
+
+    if not project:
+        return jsonify({'message': 'No project found!'}), 404
+
+    if not is_project_member(current_user, project.project_id):
+        return jsonify({'message': 'You don\'t have permission to access that project!'}), 403
+
+    by = [name for name in request.args.get('by', 'task').split(',') if name]
+    if not by or any(name not in DIMENSIONS for name in by) or len(set(by)) != len(by):
+        return jsonify({'message': 'Report not created!', 'errors': {'by': ['must be a list of ' + ', '.join(DIMENSIONS)]}}), 400
+
+    columns = [_dimension(name).label(name) for name in by]
+    query = db.session.query(*columns, func.sum(Work.time)) \
+        .join(Task, Task.task_id == Work.task_id) \
+        .filter(Task.project_id == project.project_id)
+    try:
+        query = filter_date_range(query)
+    except ValueError:
+        return jsonify({'message': 'Report not created!', 'errors': {'date': ['must be YYYY-MM-DD']}}), 400
+
+    rows = [[_value(value) for value in row] for row in query.group_by(*columns).order_by(*columns)]
+    return jsonify({'columns': by + ['hours'],
+                    'rows': rows,
+                    'total': sum(row[-1] or 0 for row in rows)})
+
+
+@report_api.route('/api/v1/projects/<project_id>/report/expected', methods=['GET'])
+@token_required
+def get_project_expected_report(current_user, project_id):
+    """Horas esperadas frente a horas trabajadas por cada tarea del proyecto."""
+    project = Project.query.filter_by(project_id=project_id).first()
+
+    if not project:
+        return jsonify({'message': 'No project found!'}), 404
+
+    if not is_project_member(current_user, project.project_id):
+        return jsonify({'message': 'You don\'t have permission to access that project!'}), 403
+
+    hours = func.coalesce(func.sum(Work.time), 0)
+    query = db.session.query(Task.task_id, Task.name, Task.expected, hours) \
+        .outerjoin(Work, Work.task_id == Task.task_id) \
+        .filter(Task.project_id == project.project_id) \
+        .group_by(Task.task_id, Task.name, Task.expected) \
+        .order_by(Task.task_id)
+
+    rows = [list(row) for row in query]
+    return jsonify({'columns': ['task_id', 'name', 'expected', 'hours'],
+                    'rows': rows,
+                    'total': {'expected': sum(row[2] or 0 for row in rows),
+                              'hours': sum(row[3] for row in rows)}})
@@ -0,0 +1,145 @@
+import os
+import random
+
+from flask import g, request, current_app
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import Pool
+import jwt
+
+from cache import MemoryCache, RedisCache
+
+# Metodos que solo leen y se pueden mandar a una replica
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# (opcion de create_engine, clave de configuracion)
+_POOL_OPTIONS = [('pool_size', 'DATABASE_POOL_SIZE'), ('max_overflow', 'DATABASE_MAX_OVERFLOW'),
+                 ('pool_timeout', 'DATABASE_POOL_TIMEOUT')]
+# Estas valen tambien para SQLite
+_CONNECTION_OPTIONS = [('pool_pre_ping', 'DATABASE_POOL_PRE_PING'), ('pool_recycle', 'DATABASE_POOL_RECYCLE')]
+
+
+@event.listens_for(Pool, 'connect')
+def _remember_pid(dbapi_connection, connection_record):
+    """Apunta que proceso abrio la conexion."""
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    """No deja usar en un worker las conexiones abiertas antes del fork (gunicorn --preload).
+
+    La conexion se descarta sin cerrarla, porque el socket es del proceso padre,
+    y el pool abre otra.
+    """
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError('Connection record belongs to pid %s, attempting to check out in pid %s'
+                                     % (connection_record.info['pid'], pid))
+
+
+class RoutingSession(SignallingSession):
+    """Sesion que lee de una replica si la peticion lo permite (ver DatabaseRouter).
+
+    Los flush van siempre a la base de datos principal.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        """Engine de la replica elegida para la peticion, o el de siempre."""
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy con sesiones que pueden leer de replicas y con el pool configurable.
+
+    Configuracion del pool, igual para la principal y las replicas:
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_RECYCLE (segundos) y DATABASE_POOL_PRE_PING.
+    """
+
+    def create_session(self, options):
+        """Fabrica de sesiones RoutingSession."""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        """Añade las opciones del pool de la configuracion antes de crear el engine."""
+        keys = _CONNECTION_OPTIONS if sa_url.drivername.startswith('sqlite') else _POOL_OPTIONS + _CONNECTION_OPTIONS
+        for option, key in keys:
+            if app.config.get(key) is not None:
+                options.setdefault(option, app.config[key])
+        return super(RoutingSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+
+
+class DatabaseRouter(object):
+    """Manda las peticiones de solo lectura (GET, HEAD) a una replica elegida al azar.
+
+    Despues de que un usuario escriba, sus peticiones van a la principal durante
+    DATABASE_STICKY_SECONDS (5 por defecto), para que lea lo que acaba de
+    escribir aunque la replica vaya con retraso. El usuario se saca del token, o
+    de la IP si no lo hay.
+    Configuracion: DATABASE_REPLICA_URIS (lista de URIs; si esta vacia todo va a la
+    principal), DATABASE_STICKY_SECONDS y DATABASE_STICKY_URL (redis://..., para
+    compartir las escrituras recientes entre workers).
+    """
+
+    def __init__(self):
+        self.recent_writes = MemoryCache(maxsize=10000, ttl=5)
+
+    def init_app(self, app):
+        """Lee la configuracion y registra los hooks de la aplicacion."""
+        app.config.setdefault('DATABASE_REPLICA_URIS', [])
+        app.config.setdefault('DATABASE_STICKY_SECONDS', 5)
+        app.config.setdefault('DATABASE_STICKY_URL', None)
+        ttl = app.config['DATABASE_STICKY_SECONDS']
+        if app.config['DATABASE_STICKY_URL']:
+            self.set_backend(RedisCache(app.config['DATABASE_STICKY_URL'], ttl=ttl, prefix='sticky:'))
+        else:
+            self.set_backend(MemoryCache(maxsize=10000, ttl=ttl))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def set_backend(self, backend):
+        """Cambia donde se apuntan las escrituras recientes (necesita get, set y delete)."""
+        self.recent_writes = backend
+
+    def replicas(self, app):
+        """Binds de SQLAlchemy de las replicas configuradas, que se registran la primera vez."""
+        uris = app.config['DATABASE_REPLICA_URIS']
+        names = ['replica%d' % number for number in range(len(uris))]
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        if any(binds.get(name) != uri for name, uri in zip(names, uris)):
+            app.config['SQLALCHEMY_BINDS'] = dict(binds, **dict(zip(names, uris)))
+        return names
+
+    def _client(self):
+        """Quien hace la peticion, para saber si ha escrito hace poco."""
+        token = request.headers.get('x-access-token')
+        if token:
+            try:
+                return 'user:%s' % jwt.decode(token, current_app.config['SECRET_KEY'])['user_id']
+            except Exception:
+                pass
+        return 'addr:%s' % request.remote_addr
+
+    def _before_request(self):
+        """Elige la base de datos de la peticion."""
+        replicas = self.replicas(current_app)
+        if not replicas:
+            return
+        g._db_client = self._client()
+        if request.method in READ_METHODS and not self.recent_writes.get(g._db_client):
+            get_state(current_app).db.session.info['replica'] = random.choice(replicas)
+
+    def _after_request(self, response):
+        """Apunta las escrituras para leer de la principal durante un rato."""
+        client = g.pop('_db_client', None)
+        if client is not None and request.method not in READ_METHODS:
+            self.recent_writes.set(client, True)
+        return response
+
+
+router = DatabaseRouter()
@@ -0,0 +1,291 @@
+from flask import current_app as app, request, url_for, has_request_context, jsonify, make_response, abort
+from urllib.parse import quote
+from sqlalchemy.orm import selectinload, load_only
+from model import db, project_member, User, Project, Task, Work, Invitation, users_schema, projects_schema, tasks_schema, \
+    works_schema, invitations_schema
+import pytz
+
+# Serializadores rapidos con la misma salida que los esquemas de model.py. Los
+# _links se generan con plantillas de URL calculadas una vez y las relaciones se
+# leen con una consulta por relacion para toda la lista. Con FAST_SERIALIZERS a
+# False se usan los esquemas de marshmallow. Con ?fields= y ?exclude= solo se
+# devuelven (y solo se leen de la base de datos) los campos pedidos.
+
+_templates = {}
+
+
+def _template(endpoint, *args):
+    """Plantilla de URL de un endpoint con huecos para los argumentos dados."""
+    key = (endpoint, args, request.script_root)
+    if key not in _templates:
+        _templates[key] = url_for(endpoint, **{arg: '__%s__' % arg for arg in args})
+    return _templates[key]
+
+
+def _url(endpoint, **values):
+    """Equivalente a url_for usando las plantillas cacheadas."""
+    url = _template(endpoint, *sorted(values))
+    for arg, value in values.items():
+        url = url.replace('__%s__' % arg, quote(str(value), safe='/:'))
+    return url
+
+
+def _date(value):
+    """Fecha en el formato de marshmallow."""
+    return value.isoformat() if value is not None else None
+
+
+def _datetime(value):
+    """Fecha y hora en el formato de marshmallow (ISO 8601 en UTC)."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return pytz.utc.localize(value).isoformat()
+    return value.astimezone(pytz.utc).isoformat()
+
+
+def _float(value):
+    """Numero en el formato de marshmallow."""
+    return float(value) if value is not None else None
+
+
+def _group(rows):
+    """Agrupa filas (padre, valor) en {padre: [valores]}."""
+    groups = {}
+    for parent, value in rows:
+        groups.setdefault(parent, []).append(value)
+    return groups
+
+
+def _dump(objects, selected, fields):
+    """Serializa objetos con una lista de (campo, funcion), solo con los campos seleccionados.
+
+    Los campos no seleccionados ni se leen, porque pueden no estar cargados (load_only).
+    """
+    getters = [(name, getter) for name, getter in fields if name in selected]
+    return [{name: getter(obj) for name, getter in getters} for obj in objects]
+
+
+def _fast(fast=None):
+    """Indica si se usan los serializadores rapidos o los esquemas de marshmallow (por defecto FAST_SERIALIZERS)."""
+    return app.config.get('FAST_SERIALIZERS', True) if fast is None else fast
+
+
+# Relaciones que necesitan los esquemas de marshmallow, por campo. Sin cargarlas
+# antes, cada fila las pide con una consulta propia.
+_SCHEMA_LOADING_PLANS = {
+    User: {},
+    Project: {'tasks': selectinload(Project.tasks), 'members': selectinload(Project.members),
+              'invitations': selectinload(Project.invitations)},
+    Task: {'project': selectinload(Task.project), 'works': selectinload(Task.works)},
+    Work: {'task': selectinload(Work.task), 'user': selectinload(Work.user)},
+    Invitation: {'user': selectinload(Invitation.user), 'project': selectinload(Invitation.project)},
+}
+
+
+# Campos de cada serializador y columnas que necesita leer cada uno, ademas de
+# la clave primaria. Las relaciones se leen aparte solo si se piden.
+_FIELDS = {
+    User: {'user_id': (), 'name': ('name',), 'email': ('email',), 'admin': ('admin',),
+           'firebase_token': ('firebase_token',), '_links': ()},
+    Project: {'project_id': (), 'name': ('name',), 'desc': ('desc',), 'img_hash': ('img_hash',),
+              'img_url': ('img_hash',), 'updated_at': ('updated_at',), 'tasks': (), 'members': (),
+              'invitations': (), '_links': ()},
+    Task: {'task_id': (), 'name': ('name',), 'desc': ('desc',), 'due_date': ('due_date',),
+           'init_date': ('init_date',), 'expected': ('expected',), 'progress': ('progress',),
+           'updated_at': ('updated_at',), 'project': ('project_id',), 'works': (), '_links': ('project_id',)},
+    Work: {'work_id': ('work_id',), 'date': (), 'time': ('time',), 'updated_at': ('updated_at',), 'task': (),
+           'user': (), '_links': ('work_id',)},
+    Invitation: {'invitation_id': ('invitation_id',), 'user': (), 'project': ()},
+}
+
+_schemas = {}
+
+
+def _split(value):
+    """Lista separada por comas de un argumento de la peticion."""
+    return {field.strip() for field in value.split(',') if field.strip()} if value else set()
+
+
+def all_fields(model):
+    """Todos los campos que devuelve el serializador de `model`."""
+    return set(_FIELDS[model])
+
+
+def selected_fields(model):
+    """Campos de `model` pedidos con ?fields= y ?exclude=. Aborta con 400 si alguno no existe."""
+    fields = _FIELDS[model]
+    if not has_request_context():
+        return set(fields)
+    only, exclude = _split(request.args.get('fields')), _split(request.args.get('exclude'))
+    unknown = (only | exclude) - set(fields)
+    if unknown:
+        abort(make_response(jsonify({'message': 'Unknown fields!', 'errors': {'fields': sorted(unknown)}}), 400))
+    return (only or set(fields)) - exclude
+
+
+def _schema(schema, model, selected):
+    """El esquema dado, o uno igual que solo devuelve los campos seleccionados."""
+    if len(selected) == len(_FIELDS[model]):
+        return schema
+    key = (type(schema), frozenset(selected))
+    if key not in _schemas:
+        _schemas[key] = type(schema)(many=True, only=tuple(selected))
+    return _schemas[key]
+
+
+def loading_plan(model, selected=None, fast=None):
+    """Opciones de carga para consultar `model` antes de serializarlo.
+
+    Los serializadores rapidos leen solo los ids de las relaciones con una
+    consulta por relacion, asi que no hace falta cargar nada mas. Si se piden
+    solo algunos campos, el resto de columnas no se leen (load_only). Por
+    defecto los campos son los de ?fields= y ?exclude=. Con fast=True el plan es
+    el del serializador rapido aunque FAST_SERIALIZERS sea False.
+    """
+    if selected is None:
+        selected = selected_fields(model)
+    options = ()
+    if not _fast(fast):
+        options = tuple(option for field, option in sorted(_SCHEMA_LOADING_PLANS[model].items()) if field in selected)
+    if len(selected) < len(_FIELDS[model]):
+        columns = {column.key for column in model.__mapper__.primary_key}
+        for field in selected:
+            columns.update(_FIELDS[model][field])
+        options += (load_only(*sorted(columns)),)
+    return options
+
+
+def dump_users(users, selected=None):
+    """Serializa una lista de usuarios. Por defecto con los campos de ?fields= y ?exclude=."""
+    if selected is None:
+        selected = selected_fields(User)
+    if not _fast():
+        return _schema(users_schema, User, selected).dump(users).data
+    collection = _url('user_api.get_all_users')
+    return _dump(users, selected, (
+        ('user_id', lambda user: user.user_id),
+        ('name', lambda user: user.name),
+        ('email', lambda user: user.email),
+        ('admin', lambda user: user.admin),
+        ('firebase_token', lambda user: user.firebase_token),
+        ('_links', lambda user: {'self': _url('user_api.get_one_user', user_id=user.user_id),
+                                 'collection': collection}),
+    ))
+
+
+def dump_projects(projects, selected=None):
+    """Serializa una lista de proyectos. Por defecto con los campos de ?fields= y ?exclude=."""
+    if selected is None:
+        selected = selected_fields(Project)
+    if not _fast():
+        return _schema(projects_schema, Project, selected).dump(projects).data
+    ids = [project.project_id for project in projects]
+    tasks, members, invitations = {}, {}, {}
+    if ids and 'tasks' in selected:
+        tasks = _group(db.session.query(Task.project_id, Task.task_id).filter(Task.project_id.in_(ids)))
+    if ids and 'members' in selected:
+        members = _group(db.session.query(project_member.c.project_id, project_member.c.user_id)
+                         .filter(project_member.c.project_id.in_(ids)))
+    if ids and 'invitations' in selected:
+        invitations = _group((project_id, {'user_id': user_id, 'project_id': project_id}) for project_id, user_id in
+                             db.session.query(Invitation.project_id, Invitation.user_id)
+                             .filter(Invitation.project_id.in_(ids)))
+    collection = _url('project_api.get_user_projects')
+    return _dump(projects, selected, (
+        ('project_id', lambda project: project.project_id),
+        ('name', lambda project: project.name),
+        ('desc', lambda project: project.desc),
+        ('img_hash', lambda project: project.img_hash),
+        ('img_url', lambda project: _url('project_api.get_project_img', project_id=project.project_id,
+                                         v=project.img_hash) if project.img_hash else None),
+        ('updated_at', lambda project: _datetime(project.updated_at)),
+        ('tasks', lambda project: tasks.get(project.project_id, [])),
+        ('members', lambda project: members.get(project.project_id, [])),
+        ('invitations', lambda project: invitations.get(project.project_id, [])),
+        ('_links', lambda project: {'self': _url('project_api.get_one_project', project_id=project.project_id),
+                                    'collection': collection}),
+    ))
+
+
+def dump_tasks(tasks, selected=None):
+    """Serializa una lista de tareas. Por defecto con los campos de ?fields= y ?exclude=."""
+    if selected is None:
+        selected = selected_fields(Task)
+    if not _fast():
+        return _schema(tasks_schema, Task, selected).dump(tasks).data
+    ids = [task.task_id for task in tasks]
+    works = {}
+    if ids and 'works' in selected:
+        works = _group((task_id, {'task_id': task_id, 'user_id': user_id, 'date': date}) for task_id, user_id, date in
+                       db.session.query(Work.task_id, Work.user_id, Work.date).filter(Work.task_id.in_(ids)))
+    return _dump(tasks, selected, (
+        ('task_id', lambda task: task.task_id),
+        ('name', lambda task: task.name),
+        ('desc', lambda task: task.desc),
+        ('due_date', lambda task: _date(task.due_date)),
+        ('init_date', lambda task: _date(task.init_date)),
+        ('expected', lambda task: _float(task.expected)),
+        ('progress', lambda task: task.progress),
+        ('updated_at', lambda task: _datetime(task.updated_at)),
+        ('project', lambda task: task.project_id),
+        ('works', lambda task: works.get(task.task_id, [])),
+        ('_links', lambda task: {'self': _url('task_api.get_one_task', task_id=task.task_id),
+                                 'collection': _url('task_api.get_all_tasks', project_id=task.project_id)}),
+    ))
+
+
+def dump_works(works, selected=None, fast=None):
+    """Serializa una lista de dias trabajados. Por defecto con los campos de ?fields= y ?exclude=."""
+    if selected is None:
+        selected = selected_fields(Work)
+    if not _fast(fast):
+        return _schema(works_schema, Work, selected).dump(works).data
+    return _dump(works, selected, (
+        ('work_id', lambda work: work.work_id),
+        ('date', lambda work: _date(work.date)),
+        ('time', lambda work: _float(work.time)),
+        ('updated_at', lambda work: _datetime(work.updated_at)),
+        ('task', lambda work: work.task_id),
+        ('user', lambda work: work.user_id),
+        ('_links', lambda work: {'self': _url('work_api.get_one_work', work_id=work.work_id),
+                                 'collection': _url('work_api.get_all_task_work', task_id=work.task_id)}),
+    ))
+
+
+def dump_invitations(invitations, selected=None):
+    """Serializa una lista de invitaciones. Por defecto con los campos de ?fields= y ?exclude=."""
+    if selected is None:
+        selected = selected_fields(Invitation)
+    if not _fast():
+        return _schema(invitations_schema, Invitation, selected).dump(invitations).data
+    return _dump(invitations, selected, (
+        ('invitation_id', lambda invitation: invitation.invitation_id),
+        ('user', lambda invitation: invitation.user_id),
+        ('project', lambda invitation: invitation.project_id),
+    ))
+
+
+def dump_user(user, selected=None):
+    """Serializa un usuario."""
+    return dump_users([user], selected)[0]
+
+
+def dump_project(project, selected=None):
+    """Serializa un proyecto."""
+    return dump_projects([project], selected)[0]
+
+
+def dump_task(task, selected=None):
+    """Serializa una tarea."""
+    return dump_tasks([task], selected)[0]
+
+
+def dump_work(work, selected=None):
+    """Serializa un dia trabajado."""
+    return dump_works([work], selected)[0]
+
+
+def dump_invitation(invitation, selected=None):
+    """Serializa una invitacion."""
+    return dump_invitations([invitation], selected)[0]
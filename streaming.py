@@ -0,0 +1,40 @@
+from flask import Response, request, stream_with_context
+from flask.json import dumps
+
+BATCH_SIZE = 500
+
+
+def wants_stream():
+    """Indica si el cliente ha pedido la respuesta en streaming (?stream=1)."""
+    return request.args.get('stream', '0').lower() not in ('0', 'false', '')
+
+
+def _batches(rows, size):
+    """Agrupa un iterable en listas de como mucho `size` elementos."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_json(key, query, dump_many, batch_size=BATCH_SIZE):
+    """Devuelve una respuesta {key: [...]} escribiendo el array por trozos.
+
+    Las filas se leen con un cursor del servidor (yield_per) y se serializan por
+    lotes con `dump_many` (p.e. serializers.dump_users), asi que la memoria no
+    crece con el tamaño de la tabla.
+    """
+    def generate():
+        yield '{"%s":[' % key
+        separator = ''
+        for batch in _batches(query.yield_per(batch_size), batch_size):
+            for output in dump_many(batch):
+                yield separator + dumps(output, separators=(',', ':'))
+                separator = ','
+        yield ']}\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
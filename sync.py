@@ -0,0 +1,85 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy import and_, or_
+from model import db, project_member, change_token, Project, Task, Work, Invitation, Tombstone, User
+from serializers import all_fields, dump_projects, dump_tasks, dump_works, dump_invitations, loading_plan
+from decorators import token_required
+
+
+sync_api = Blueprint('sync_api', __name__)
+
+# Sin las listas de ids de los hijos: los hijos que cambian llegan aparte
+_PROJECT_FIELDS = all_fields(Project) - {'tasks', 'members', 'invitations'}
+_TASK_FIELDS = all_fields(Task) - {'works'}
+
+
+@sync_api.route('/api/v1/sync', methods=['GET'])
+@token_required
+def sync(current_user):
+    """Cambios en los proyectos del usuario desde ?since=<token>, con el token para la siguiente vez.
+
+    Sin token se devuelve todo, sin lapidas. El cliente aplica primero deleted y
+    luego el resto de listas, que traen las filas tal y como estan ahora. Una
+    lapida de proyecto o de tarea borra tambien sus hijos, y la de un miembro que
+    es el propio usuario, el proyecto entero. Las consultas van por los indices de version,
+    asi que el coste depende de cuantos cambios haya, no del tamaño de los datos.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        since = -1
+    if since < 0:
+        return jsonify({'message': 'Bad token!'}), 400
+
+    # Antes de leer nada: lo que se confirme mientras tanto llegara la proxima vez
+    token = change_token()
+
+    memberships = db.session.query(project_member.c.project_id, project_member.c.version) \
+        .filter(project_member.c.user_id == current_user.user_id).all()
+    project_ids = [project_id for project_id, _ in memberships]
+    # De los proyectos a los que acaba de entrar hacen falta tambien las filas antiguas
+    new_project_ids = [project_id for project_id, version in memberships if version >= since]
+
+    def changed(version, project_id):
+        """Filas de los proyectos del usuario que hay que enviar."""
+        clause = version >= since
+        if new_project_ids:
+            clause = or_(clause, project_id.in_(new_project_ids))
+        return and_(project_id.in_(project_ids), clause)
+
+    output = {'projects': [], 'tasks': [], 'works': [], 'invitations': [], 'members': []}
+    if project_ids:
+        output['projects'] = dump_projects(
+            Project.query.filter(changed(Project.version, Project.project_id))
+            .options(*loading_plan(Project, _PROJECT_FIELDS)).order_by(Project.version).all(), _PROJECT_FIELDS)
+        output['tasks'] = dump_tasks(
+            Task.query.filter(changed(Task.version, Task.project_id))
+            .options(*loading_plan(Task, _TASK_FIELDS)).order_by(Task.version).all(), _TASK_FIELDS)
+        # Los trabajos siempre con el serializador rapido, que solo necesita task_id y user_id. El esquema
+        # cargaria Work.task y Work.user, y SQLAlchemy 1.3.0 lo hace por lotes de 500 claves compuestas
+        output['works'] = dump_works(
+            Work.query.join(Task, Task.task_id == Work.task_id).filter(changed(Work.version, Task.project_id))
+            .options(*loading_plan(Work, all_fields(Work), fast=True)).order_by(Work.version).all(),
+            all_fields(Work), fast=True)
+        output['invitations'] = dump_invitations(
+            Invitation.query.filter(changed(Invitation.version, Invitation.project_id))
+            .options(*loading_plan(Invitation, all_fields(Invitation))).order_by(Invitation.version).all(),
+            all_fields(Invitation))
+        output['members'] = [{'user_id': user_id, 'project_id': project_id, 'name': name, 'email': email}
+                             for user_id, project_id, name, email in
+                             db.session.query(project_member.c.user_id, project_member.c.project_id,
+                                              User.name, User.email)
+                             .join(User, User.user_id == project_member.c.user_id)
+                             .filter(changed(project_member.c.version, project_member.c.project_id))
+                             .order_by(project_member.c.version)]
+
+    output['deleted'] = []
+    if since:
+        left = and_(Tombstone.entity == 'member', Tombstone.entity_id == current_user.user_id)
+        deleted = Tombstone.query.filter(Tombstone.version >= since,
+                                         or_(Tombstone.project_id.in_(project_ids), left) if project_ids else left) \
+            .order_by(Tombstone.version)
+        output['deleted'] = [{'entity': tombstone.entity, 'id': tombstone.entity_id,
+                              'project_id': tombstone.project_id} for tombstone in deleted]
+
+    output['token'] = str(token)
+    return jsonify(output)
@@ -1,6 +1,14 @@
-from flask import Blueprint, jsonify
-from model import tasks_schema, Project, Task, task_schema, db, create_task_validator, update_task_validator
+from flask import Blueprint, jsonify, request
+from conditional import make_etag, not_modified, with_etag
+from model import Project, Task, db, create_task_validator, update_task_validator
+from serializers import dump_task, dump_tasks, loading_plan
 from decorators import token_required, load_data
+from pagination import paginate
+from permissions import is_project_member, is_task_member
+from deletion import delete_task_rows
+from payloads import payload_cache, invalidate_project, invalidate_task
+from operations import commit_operation
+from functools import partial
 
 
 task_api = Blueprint('task_api', __name__)
@@ -10,50 +18,71 @@ task_api = Blueprint('task_api', __name__)
 @token_required
 def get_all_tasks(current_user, project_id):
     """Devolver todas las tareas."""
-    project = Project.query.filter_by(project_id=project_id).first()
+    version = db.session.query(Project.updated_at, Project.version).filter_by(project_id=project_id).first()
 
-    if not project:
+    if not version:
         return jsonify({'message': 'No project found!'}), 404
 
-    if current_user not in project.members:
+    if not is_project_member(current_user, project_id):
         return jsonify({'message': 'You don\'t have permission to access these tasks!'}), 403
 
-    tasks = project.tasks
+    etag = make_etag(project_id, version.updated_at)
+    cached = not_modified(etag, version.updated_at)
+    if cached:
+        return cached
+
+    def build():
+        tasks, links = paginate(Task.query.filter_by(project_id=project_id).options(*loading_plan(Task)),
+                                Task.task_id)
+        return {"tasks": dump_tasks(tasks), "_links": links}
 
-    output = tasks_schema.dump(tasks)
-    return jsonify({"tasks": output.data})
+    return with_etag(payload_cache.response('tasks', project_id, version.version, build),
+                     etag, version.updated_at)
 
 
 @task_api.route('/api/v1/tasks/<task_id>', methods=['GET'])
 @token_required
 def get_one_task(current_user, task_id):
     """Devolver una tarea."""
-    task = Task.query.filter_by(task_id=task_id).first()
+    version = db.session.query(Task.updated_at, Task.version).filter_by(task_id=task_id).first()
 
-    if not task:
+    if not version:
         return jsonify({'message': 'No task found!'}), 404
 
-    if current_user not in task.project.members:
+    if not is_task_member(current_user, task_id):
         return jsonify({'message': 'You don\'t have permission to access this task!'}), 403
 
-    return jsonify({"task": task_schema.dump(task).data})
+    etag = make_etag(task_id, version.updated_at)
+    cached = not_modified(etag, version.updated_at)
+    if cached:
+        return cached
+
+    def build():
+        return {"task": dump_task(Task.query.filter_by(task_id=task_id).options(*loading_plan(Task)).first())}
+
+    return with_etag(payload_cache.response('task', task_id, version.version, build), etag, version.updated_at)
 
 
 @task_api.route('/api/v1/tasks/<task_id>', methods=['DELETE'])
 @token_required
 def delete_task(current_user, task_id):
     """Eliminar una tarea."""
+    return commit_operation(*delete_task_operation(current_user, None, request.args, task_id=task_id))
+
+
+def delete_task_operation(current_user, data, args, task_id):
+    """Elimina una tarea sin confirmar la transaccion (ver operations.py)."""
     task = Task.query.filter_by(task_id=task_id).first()
 
     if not task:
-        return jsonify({'message': 'No task found!'}), 404
+        return {'message': 'No task found!'}, 404, None
 
-    if current_user not in task.project.members:
-        return jsonify({'message': 'You don\'t have permission to access this task!'}), 403
+    if not is_task_member(current_user, task.task_id):
+        return {'message': 'You don\'t have permission to access this task!'}, 403, None
 
-    db.session.delete(task)
-    db.session.commit()
-    return jsonify({'message': 'The task has been deleted!'})
+    task_id, project_id = task.task_id, task.project_id
+    delete_task_rows(task_id)
+    return {'message': 'The task has been deleted!'}, 200, partial(invalidate_task, task_id, project_id)
 
 
 @task_api.route('/api/v1/projects/<project_id>/tasks', methods=['POST'])
@@ -61,22 +90,29 @@ def delete_task(current_user, task_id):
 @load_data
 def create_task(data, current_user, project_id):
     """Crea una tarea."""
+    return commit_operation(*create_task_operation(current_user, data, request.args, project_id=project_id))
+
+
+def create_task_operation(current_user, data, args, project_id):
+    """Crea una tarea sin confirmar la transaccion (ver operations.py)."""
     project = Project.query.filter_by(project_id=project_id).first()
 
     if not project:
-        return jsonify({'message': 'No project found!'}), 404
+        return {'message': 'No project found!'}, 404, None
 
-    if current_user not in project.members:
-        return jsonify({'message': 'You don\'t have permission to delete that project!'}), 403
+    if not is_project_member(current_user, project.project_id):
+        return {'message': 'You don\'t have permission to delete that project!'}, 403, None
 
-    if create_task_validator.validate(data):
-        task = Task(**data)
-        db.session.add(task)
-        project.tasks.append(task)
-        db.session.commit()
-        return jsonify({'message': 'New task created!', 'task': task_schema.dump(task).data}), 201
-    else:
-        return jsonify({'message': 'Task not created!', 'errors': create_task_validator.errors}), 400
+    _, errors = create_task_validator.validate(data)
+    if errors:
+        return {'message': 'Task not created!', 'errors': errors}, 400, None
+
+    task = Task(**data)
+    db.session.add(task)
+    project.tasks.append(task)
+    _flush_and_expire(task)
+    return {'message': 'New task created!', 'task': dump_task(task)}, 201, \
+        partial(invalidate_project, project.project_id)
 
 
 @task_api.route('/api/v1/tasks/<task_id>', methods=['POST'])
@@ -84,18 +120,31 @@ def create_task(data, current_user, project_id):
 @load_data
 def modify_task(data, current_user, task_id):
     """Modifica una tarea."""
+    return commit_operation(*modify_task_operation(current_user, data, request.args, task_id=task_id))
+
+
+def modify_task_operation(current_user, data, args, task_id):
+    """Modifica una tarea sin confirmar la transaccion (ver operations.py)."""
     task = Task.query.filter_by(task_id=task_id).first()
 
     if not task:
-        return jsonify({'message': 'No task found!'}), 404
+        return {'message': 'No task found!'}, 404, None
+
+    if not is_task_member(current_user, task.task_id):
+        return {'message': 'You don\'t have permission to edit this task!'}, 403, None
+
+    _, errors = update_task_validator.validate(data)
+    if errors:
+        return {'message': 'Task not modified!', 'errors': errors}, 400, None
+
+    for key, value in data.items():
+        setattr(task, key, value)
+    _flush_and_expire(task)
+    return {'message': 'Task modified!', 'task': dump_task(task)}, 200, \
+        partial(invalidate_task, task.task_id, task.project_id)
 
-    if current_user not in task.project.members:
-        return jsonify({'message': 'You don\'t have permission to edit this task!'}), 403
 
-    if update_task_validator.validate(data):
-        for key, value in data.items():
-            setattr(task, key, value)
-        db.session.commit()
-        return jsonify({'message': 'Task modified!', 'task': task_schema.dump(task).data})
-    else:
-        return jsonify({'message': 'Task not modified!', 'errors': update_task_validator.errors}), 400
+def _flush_and_expire(task):
+    """Escribe la tarea y la vuelve a leer, para devolverla como quedara tras el commit."""
+    db.session.flush()
+    db.session.expire(task)
@@ -1,7 +1,11 @@
 from flask import jsonify, Blueprint
-from decorators import token_required, admin_required, load_data
+from decorators import token_required, admin_required, load_data, invalidate_user
 from werkzeug.security import generate_password_hash
-from model import db, User, user_schema, users_schema, create_user_validator, user_firebase_validator
+from pagination import paginate
+from streaming import wants_stream, stream_json
+from model import db, User, create_user_validator, user_firebase_validator
+from serializers import dump_user, dump_users, loading_plan
+from deletion import delete_user_rows
 
 
 user_api = Blueprint('user_api', __name__)
@@ -12,16 +16,20 @@ user_api = Blueprint('user_api', __name__)
 @admin_required
 def get_all_users(current_user):
     """Devolver todos los usuarios."""
-    users = User.query.all()
-    output = users_schema.dump(users)
-    return jsonify({"users": output.data})
+    if wants_stream():
+        return stream_json('users', User.query.options(*loading_plan(User)).order_by(User.user_id), dump_users)
+
+    users, links = paginate(User.query, User.user_id)
+    output = dump_users(users)
+    return jsonify({"users": output, "_links": links})
 
 
 @user_api.route('/api/v1/users', methods=['POST'])
 @load_data
 def create_user(data):
     """Crea un usuario."""
-    if create_user_validator.validate(data):
+    _, errors = create_user_validator.validate(data)
+    if not errors:
         # Check if user exists
         if User.query.filter_by(email=data['email']).first():
             return jsonify({'message': 'User already exists'}), 409
@@ -31,21 +39,21 @@ def create_user(data):
         db.session.add(new_user)
         db.session.commit()
 
-        return jsonify({'message': 'New user created!', 'user': user_schema.dump(new_user).data}), 201
+        return jsonify({'message': 'New user created!', 'user': dump_user(new_user)}), 201
     else:
-        return jsonify({'message': 'User not created!', 'errors': create_user_validator.errors}), 400
+        return jsonify({'message': 'User not created!', 'errors': errors}), 400
 
 
 @user_api.route('/api/v1/users/<user_id>', methods=['GET'])
 @token_required
 def get_one_user(current_user, user_id):
     """Devuelve la info de un usuario dado un user_id."""
-    user = User.query.filter_by(user_id=user_id).first()
+    user = User.query.filter_by(user_id=user_id).options(*loading_plan(User)).first()
 
     if not user:
         return jsonify({'message': 'No user found!'})
 
-    return user_schema.jsonify(user)
+    return jsonify(dump_user(user))
 
 
 @user_api.route('/api/v1/users/<user_id>', methods=['PUT'])
@@ -60,6 +68,7 @@ def promote_user(current_user, user_id):
 
     user.admin = True
     db.session.commit()
+    invalidate_user(user_id)
     return jsonify({'message': 'User promoted!'})
 
 
@@ -69,12 +78,14 @@ def promote_user(current_user, user_id):
 def update_firebase_token(data, current_user):
     """Convierte un usuario a administrador."""
 
-    if user_firebase_validator.validate(data):
+    _, errors = user_firebase_validator.validate(data)
+    if not errors:
         current_user.firebase_token = data["firebase_token"]
         db.session.commit()
-        return jsonify({'message': 'User firebase token updated!', 'user': user_schema.dump(current_user).data}), 200
+        invalidate_user(current_user.user_id)
+        return jsonify({'message': 'User firebase token updated!', 'user': dump_user(current_user)}), 200
     else:
-        return jsonify({'message': 'User token not updated!', 'errors': user_firebase_validator.errors}), 400
+        return jsonify({'message': 'User token not updated!', 'errors': errors}), 400
 
 
 @user_api.route('/api/v1/users/<user_id>', methods=['DELETE'])
@@ -87,6 +98,7 @@ def delete_user(current_user, user_id):
     if not user:
         return jsonify({'message': 'No user found!'})
 
-    db.session.delete(user)
+    delete_user_rows(user.user_id)
     db.session.commit()
+    invalidate_user(user_id)
     return jsonify({'message': 'The user has been deleted!'})
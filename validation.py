@@ -0,0 +1,79 @@
+from collections.abc import Sized
+import datetime
+
+# Tipos de cerberus que se usan en los esquemas. Como en cerberus, un bool vale como numero
+_TYPES = {
+    'string': str,
+    'integer': int,
+    'float': (float, int),
+    'date': datetime.date,
+    'boolean': bool,
+}
+
+_RULES = {'type', 'required', 'empty', 'min', 'max', 'coerce'}
+
+
+def _compile_field(field, rules):
+    """Funcion que comprueba un campo y devuelve (valor normalizado, errores)."""
+    unknown = set(rules) - _RULES
+    if unknown:
+        raise ValueError('Unsupported rules for %s: %s' % (field, ', '.join(sorted(unknown))))
+    coerce = rules.get('coerce')
+    types = _TYPES[rules['type']] if 'type' in rules else None
+    type_error = 'must be of %s type' % rules.get('type')
+    empty = rules.get('empty', True)
+    minimum, maximum = rules.get('min'), rules.get('max')
+
+    def check(value):
+        errors = []
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except Exception as error:
+                errors.append("field '%s' cannot be coerced: %s" % (field, error))
+        if value is None:
+            errors.append('null value not allowed')
+        elif types is not None and not isinstance(value, types):
+            errors.append(type_error)
+        elif not empty and isinstance(value, Sized) and not len(value):
+            errors.append('empty values not allowed')
+        else:
+            if minimum is not None and value < minimum:
+                errors.append('min value is %s' % minimum)
+            if maximum is not None and value > maximum:
+                errors.append('max value is %s' % maximum)
+        return value, errors
+    return check
+
+
+class CompiledValidator(object):
+    """Validador de un esquema de cerberus que se prepara una sola vez.
+
+    Acepta las reglas type, required, empty, min, max y coerce, con los mismos
+    mensajes de error que cerberus. No guarda nada entre llamadas, asi que la
+    misma instancia se puede usar a la vez desde varios hilos.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._checks = {field: _compile_field(field, rules) for field, rules in schema.items()}
+        self._required = [field for field, rules in schema.items() if rules.get('required')]
+
+    def validate(self, data):
+        """Devuelve (documento normalizado, errores). El documento es valido si no hay errores."""
+        if not isinstance(data, dict):
+            return data, {'document': ['must be of dict type']}
+        document = dict(data)
+        errors = {}
+        for field, value in data.items():
+            check = self._checks.get(field)
+            if check is None:
+                errors[field] = ['unknown field']
+                continue
+            document[field], field_errors = check(value)
+            if field_errors:
+                errors[field] = field_errors
+        for field in self._required:
+            if field not in data:
+                errors[field] = ['required field']
+        return document, errors
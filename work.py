@@ -1,59 +1,163 @@
-from flask import Blueprint, jsonify
-from model import works_schema, work_schema, Task, db, Work, create_work_validator, update_work_validator
+from flask import Blueprint, jsonify, request
+from sqlalchemy import and_, literal_column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from model import Task, db, Work, create_work_validator, update_work_validator, generate_uuid, canonical_uuid, \
+    touch_tasks, change_version, _utcnow
+from serializers import dump_work, dump_works, loading_plan
 from decorators import token_required, load_data
+from conditional import make_etag, not_modified, with_etag
+from pagination import paginate
+from permissions import is_task_member, is_work_member, member_task_ids
+from payloads import payload_cache, invalidate_task
+from operations import commit_operation
+from functools import partial
+import csv
+import io
+import json
 
 
 work_api = Blueprint('work_api', __name__)
 
+# Filas por cada INSERT multi-fila en la importacion masiva
+IMPORT_BATCH_SIZE = 1000
+
+# Que hacer si ya hay trabajo de ese usuario en esa tarea y fecha (?mode=)
+CREATE_MODES = ('error', 'add', 'replace')
+
+
+def _insert_work(values, mode):
+    """Inserta un dia trabajado dejando que la clave primaria detecte los duplicados.
+
+    Devuelve (fila, creada). Con mode='error' la fila es None si ya existia; con
+    'add' se suman las horas a las existentes y con 'replace' se sustituyen.
+    """
+    table = Work.__table__
+    keys = ('task_id', 'user_id', 'date')
+    same_key = and_(*[table.c[key] == values[key] for key in keys])
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(**values)
+        if mode == 'error':
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        else:
+            time = table.c.time + statement.excluded.time if mode == 'add' else statement.excluded.time
+            statement = statement.on_conflict_do_update(index_elements=keys,
+                                                        set_={'time': time, 'updated_at': values['updated_at'],
+                                                              'version': values['version']})
+        # xmax = 0 solo en las filas recien insertadas
+        row = db.session.execute(statement.returning(*table.c, literal_column('(xmax = 0)').label('inserted'))).first()
+        if row is None:
+            return None, False
+        return row, row.inserted
+
+    # Otros motores (SQLite en local): INSERT y, si choca con la clave, UPDATE
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(**values))
+        created = True
+    except IntegrityError:
+        if mode == 'error':
+            return None, False
+        time = table.c.time + values['time'] if mode == 'add' else values['time']
+        db.session.execute(table.update().where(same_key).values(time=time, updated_at=values['updated_at'],
+                                                                 version=values['version']))
+        created = False
+    return db.session.execute(table.select().where(same_key)).first(), created
+
+
+def _insert_new_works(rows):
+    """Inserta dias trabajados nuevos sin fallar si alguno ya existe (p.e. creado a la vez por otra peticion).
+
+    Devuelve los work_id de las filas que no se han insertado porque ya habia
+    trabajo de ese usuario en esa tarea y fecha.
+    """
+    table = Work.__table__
+    if db.session.get_bind().dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(rows) \
+            .on_conflict_do_nothing(index_elements=('task_id', 'user_id', 'date'))
+        inserted = {row.work_id for row in db.session.execute(statement.returning(table.c.work_id))}
+        return {row['work_id'] for row in rows} - inserted
+
+    # Otros motores (SQLite en local): el lote en un SAVEPOINT y, si choca, fila a fila
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(rows))
+        return set()
+    except IntegrityError:
+        pass
+    duplicated = set()
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(**row))
+        except IntegrityError:
+            duplicated.add(row['work_id'])
+    return duplicated
+
 
 @work_api.route('/api/v1/tasks/<task_id>/works', methods=['GET'])
 @token_required
 def get_all_task_work(current_user, task_id):
     """Devolver todos los dias trabajados en una tarea."""
-    task = Task.query.filter_by(task_id=task_id).first()
+    version = db.session.query(Task.updated_at, Task.version).filter_by(task_id=task_id).first()
 
-    if not task:
+    if not version:
         return jsonify({'message': 'No task found!'}), 404
 
-    if current_user not in task.project.members:
+    if not is_task_member(current_user, task_id):
         return jsonify({'message': 'You don\'t have permission to access task\'s work!'}), 403
 
-    works = task.works
+    etag = make_etag(task_id, version.updated_at)
+    cached = not_modified(etag, version.updated_at)
+    if cached:
+        return cached
+
+    def build():
+        works, links = paginate(Work.query.filter_by(task_id=task_id).options(*loading_plan(Work)),
+                               Work.user_id, Work.date)
+        return {"works": dump_works(works), "_links": links}
 
-    output = works_schema.dump(works)
-    return jsonify({"works": output.data})
+    return with_etag(payload_cache.response('works', task_id, version.version, build), etag, version.updated_at)
 
 
 @work_api.route('/api/v1/works/<work_id>', methods=['GET'])
 @token_required
 def get_one_work(current_user, work_id):
     """Devolver un dia trabajado."""
-    work = Work.query.filter_by(work_id=work_id).first()
+    work = Work.query.filter_by(work_id=work_id).options(*loading_plan(Work)).first()
 
     if not work:
         return jsonify({'message': 'No work found!'}), 404
 
-    if current_user not in work.task.project.members:
+    if not is_work_member(current_user, work_id):
         return jsonify({'message': 'You don\'t have permission to access this work!'}), 403
 
-    return jsonify({"work": work_schema.dump(work).data})
+    return jsonify({"work": dump_work(work)})
 
 
 @work_api.route('/api/v1/works/<work_id>', methods=['DELETE'])
 @token_required
 def delete_work(current_user, work_id):
     """Eliminar un dia trabajado."""
+    return commit_operation(*delete_work_operation(current_user, None, request.args, work_id=work_id))
+
+
+def delete_work_operation(current_user, data, args, work_id):
+    """Elimina un dia trabajado sin confirmar la transaccion (ver operations.py)."""
     work = Work.query.filter_by(work_id=work_id).first()
 
     if not work:
-        return jsonify({'message': 'No work found!'}), 404
+        return {'message': 'No work found!'}, 404, None
 
     if current_user.user_id != work.user_id:
-        return jsonify({'message': 'You don\'t have permission to delete this work!'}), 403
+        return {'message': 'You don\'t have permission to delete this work!'}, 403, None
 
+    task_id, project_id = work.task_id, work.task.project_id
     db.session.delete(work)
-    db.session.commit()
-    return jsonify({'message': 'The work has been deleted!'})
+    db.session.flush()
+    return {'message': 'The work has been deleted!'}, 200, partial(invalidate_task, task_id, project_id)
 
 
 @work_api.route('/api/v1/tasks/<task_id>/works', methods=['POST'])
@@ -61,26 +165,45 @@ def delete_work(current_user, work_id):
 @load_data
 def create_work(data, current_user, task_id):
     """Crea un dia trabajado."""
+    return commit_operation(*create_work_operation(current_user, data, request.args, task_id=task_id))
+
+
+def create_work_operation(current_user, data, args, task_id):
+    """Crea un dia trabajado sin confirmar la transaccion (ver operations.py)."""
     task = Task.query.filter_by(task_id=task_id).first()
 
     if not task:
-        return jsonify({'message': 'No task found!'}), 404
+        return {'message': 'No task found!'}, 404, None
 
-    if current_user not in task.project.members:
-        return jsonify({'message': 'You don\'t have permission to edit this task!'}), 403
+    if not is_task_member(current_user, task.task_id):
+        return {'message': 'You don\'t have permission to edit this task!'}, 403, None
 
-    if create_work_validator.validate(data):
-        if Work.query.filter_by(date=data['date']).first():
-            return jsonify({'message': 'There\'s already work on that date!'}), 400
-        else:
-            data['user_id'] = current_user.user_id
-            data['task_id'] = task.task_id
-            work = Work(**data)
-            db.session.add(work)
-            db.session.commit()
-            return jsonify({'message': 'Work created!', 'work': work_schema.dump(work).data}), 201
-    else:
-        return jsonify({'message': 'Work not created!', 'errors': create_work_validator.errors}), 400
+    mode = args.get('mode', 'error')
+    if mode not in CREATE_MODES:
+        return {'message': 'Work not created!', 'errors': {'mode': ['must be one of ' + ', '.join(CREATE_MODES)]}}, \
+            400, None
+
+    document, errors = create_work_validator.validate(data)
+    if errors:
+        return {'message': 'Work not created!', 'errors': errors}, 400, None
+
+    row, created = _insert_work({'work_id': generate_uuid(), 'task_id': task.task_id,
+                                 'user_id': current_user.user_id, 'date': document['date'].date(),
+                                 'time': document['time'], 'updated_at': _utcnow(),
+                                 'version': change_version()}, mode)
+    if row is None:
+        return {'message': 'There\'s already work on that date!'}, 400, None
+
+    task_id, project_id = task.task_id, task.project_id
+    touch_tasks([task_id])
+
+    work = Work(**{column.key: row[column.key] for column in Work.__table__.c})
+    make_transient_to_detached(work)
+    work = db.session.merge(work, load=False)
+    after_commit = partial(invalidate_task, task_id, project_id)
+    if created:
+        return {'message': 'Work created!', 'work': dump_work(work)}, 201, after_commit
+    return {'message': 'Work updated!', 'work': dump_work(work)}, 200, after_commit
 
 
 @work_api.route('/api/v1/works/<work_id>', methods=['POST'])
@@ -88,17 +211,118 @@ def create_work(data, current_user, task_id):
 @load_data
 def modify_work(data, current_user, work_id):
     """Modifica un dia trabajado."""
+    return commit_operation(*modify_work_operation(current_user, data, request.args, work_id=work_id))
+
+
+def modify_work_operation(current_user, data, args, work_id):
+    """Modifica un dia trabajado sin confirmar la transaccion (ver operations.py)."""
     work = Work.query.filter_by(work_id=work_id).first()
 
     if not work:
-        return jsonify({'message': 'No work found!'}), 404
+        return {'message': 'No work found!'}, 404, None
 
     if current_user.user_id != work.user_id:
-        return jsonify({'message': 'You don\'t have permission to edit this work!'}), 403
+        return {'message': 'You don\'t have permission to edit this work!'}, 403, None
+
+    _, errors = update_work_validator.validate(data)
+    if errors:
+        return {'message': 'Work not created!', 'errors': errors}, 400, None
+
+    task_id, project_id = work.task_id, work.task.project_id
+    work.time = data["time"]
+    db.session.flush()
+    db.session.expire(work)
+    return {'message': 'Work modified!', 'work': dump_work(work)}, 200, partial(invalidate_task, task_id, project_id)
+
 
-    if update_work_validator.validate(data):
-        work.time = data["time"]
-        db.session.commit()
-        return jsonify({'message': 'Work modified!', 'work': work_schema.dump(work).data})
+def _read_import_rows():
+    """Lee las filas a importar del cuerpo de la peticion, en CSV (text/csv) o NDJSON."""
+    body = request.get_data(as_text=True)
+    rows = []
+    if request.mimetype == 'text/csv':
+        for row in csv.DictReader(io.StringIO(body)):
+            try:
+                row['time'] = float(row['time'])
+            except (KeyError, TypeError, ValueError):
+                pass  # el validador se encarga de informar del error
+            rows.append(row)
     else:
-        return jsonify({'message': 'Work not created!', 'errors': update_work_validator.errors}), 400
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+    return rows
+
+
+@work_api.route('/api/v1/works/import', methods=['POST'])
+@token_required
+def import_works(current_user):
+    """Importa muchos dias trabajados de una vez. Cada fila lleva task_id, date y time."""
+    errors = []
+    valid = []
+    for number, row in enumerate(_read_import_rows(), 1):
+        if not isinstance(row, dict):
+            errors.append({'row': number, 'errors': 'Row bad formatted!'})
+            continue
+        if not row.get('task_id'):
+            errors.append({'row': number, 'errors': {'task_id': ['required field']}})
+            continue
+        # Los ids se comparan como se guardan, en minusculas
+        task_id = canonical_uuid(row['task_id'])
+        if task_id is None:
+            errors.append({'row': number, 'errors': {'task_id': ['must be a uuid']}})
+            continue
+        data = {key: row[key] for key in ('date', 'time') if key in row}
+        document, row_errors = create_work_validator.validate(data)
+        if row_errors:
+            errors.append({'row': number, 'errors': row_errors})
+            continue
+        valid.append((number, task_id, document['date'].date(), document['time']))
+
+    allowed = member_task_ids(current_user, {task_id for _, task_id, _, _ in valid})
+
+    existing = set()
+    if allowed and valid:
+        existing = set(db.session.query(Work.task_id, Work.date)
+                       .filter(Work.user_id == current_user.user_id,
+                               Work.task_id.in_(allowed),
+                               Work.date.between(min(v[2] for v in valid), max(v[2] for v in valid))))
+
+    new_works, numbers = [], {}
+    for number, task_id, day, time in valid:
+        if task_id not in allowed:
+            errors.append({'row': number, 'errors': 'You don\'t have permission to edit this task!'})
+        elif (task_id, day) in existing:
+            errors.append({'row': number, 'errors': 'There\'s already work on that date!'})
+        else:
+            existing.add((task_id, day))
+            work_id = generate_uuid()
+            numbers[work_id] = number
+            new_works.append({'work_id': work_id, 'task_id': task_id,
+                              'user_id': current_user.user_id, 'date': day, 'time': time})
+
+    errors.sort(key=lambda error: error['row'])
+    if not new_works:
+        return jsonify({'message': 'No work imported!', 'created': 0, 'errors': errors}), 400
+
+    version = change_version()
+    for work in new_works:
+        work['version'] = version
+    duplicated = set()
+    for start in range(0, len(new_works), IMPORT_BATCH_SIZE):
+        duplicated |= _insert_new_works(new_works[start:start + IMPORT_BATCH_SIZE])
+    # Los que otra peticion ha creado despues de buscar los que ya existian
+    if duplicated:
+        errors += [{'row': numbers[work_id], 'errors': 'There\'s already work on that date!'} for work_id in duplicated]
+        errors.sort(key=lambda error: error['row'])
+    created = [work for work in new_works if work['work_id'] not in duplicated]
+
+    if not created:
+        db.session.rollback()
+        return jsonify({'message': 'No work imported!', 'created': 0, 'errors': errors}), 400
+    touch_tasks({work['task_id'] for work in created})
+    db.session.commit()
+    return jsonify({'message': 'Works imported!', 'created': len(created), 'errors': errors}), 201